@@ -27,7 +27,7 @@ class Config:
         pipelinespath = ./Pipelines/
         referencespath = ./References/
         testpath = ./test/
-        dbpath = ./VariantsDB/variantsDB.csv
+        dbpath = ./VariantsDB/variantsDB.feather
         tmppath = ./tmp/
         binpath = ./bin/
         """
@@ -8,9 +8,12 @@ import subprocess
 from sys import argv
 
 from MODApy import (
+    cohortfreqs,
     coverage,
     downloader,
+    geneburden,
     parquetvardb,
+    patientcatalog,
     pipeline,
     variantsdb,
     vcfanalysis,
@@ -18,7 +21,7 @@ from MODApy import (
 )
 from MODApy.cfg import configuration
 from MODApy.modaapi import app
-from MODApy.utils import checkFile
+from MODApy.utils import VCF_EXTENSIONS, checkFile
 from MODApy.version import __version__
 
 import pandas as pd
@@ -42,10 +45,12 @@ class Parser(object):
         Commands:
         launcher        Run MoDAPy Web Interface
         variantsDB      Work with Variants Database
+        listPatients    List the patients found in the Patients folder
         addPatient      Download Patient Data to Patients folder. Receives
                         both url or xls/xlsx
         pipeline        Run pipeline on FastQ file/s
         abs_pipeline    Run pipeline on FastQ file/s using absolute paths
+        batch_pipeline  Run pipeline on every sample of a sample sheet
         parsevcf        Parse a VCF and write it's Raw Output to CSV or Parquet.
         diffvcf         Generate a Duos analysis on any given vcf
         single          Run study on a single patient
@@ -74,8 +79,8 @@ class Parser(object):
             parser.print_help()
             exit(1)
 
-        # goes to each command
-        getattr(self, args.command)()
+        # goes to each command, its return value is the exit status
+        exit(getattr(self, args.command)())
 
     def launcher(self):
         try:
@@ -120,15 +125,24 @@ class Parser(object):
                   wildcard) Example: /home/bams/*.bam",
             nargs="*",
         )
+        parser.add_argument(
+            "-engine",
+            default="auto",
+            choices=["auto", "native", "bedtools"],
+            help="native reads the BAMs in process (needs pysam), bedtools uses \
+                bedtools genomecov. auto uses native if pysam is installed",
+        )
         try:
             args = parser.parse_args(argv[2:])
             Bam_files = list(args.Bam_files)
             bed_file = args.Gene_Exon_Bed_File
             panel_file = args.Panel
-            coverage.main(Bam_files, bed_file, panel_file)
+            failed = coverage.main(Bam_files, bed_file, panel_file, engine=args.engine)
+            return 1 if failed else 0
         except Exception as err:
             logger.error("Coverage process failed")
             logger.debug(f"There was an error: {err}", exc_info=True)
+            return 1
 
     def addPatient(self):
         parser = argparse.ArgumentParser(
@@ -148,6 +162,27 @@ class Parser(object):
             logger.error("Download process failed")
             logger.debug(f"There was an error: {err}", exc_info=True)
 
+    def listPatients(self):
+        parser = argparse.ArgumentParser(
+            description="List the patients found in the Patients folder"
+        )
+        parser.add_argument(
+            "--suffix",
+            default=".final.vcf",
+            help="Suffix of the patient files, VCF suffixes also match compressed "
+            "files (default: .final.vcf)",
+        )
+        try:
+            args = parser.parse_args(argv[2:])
+            catalog = patientcatalog.get_catalog(
+                configuration.patientPath, suffix=args.suffix
+            )
+            for patient in catalog.patients():
+                print("%s\t%s" % (patient["sample"], patient["path"]))
+        except Exception as err:
+            logger.error("Patient listing failed")
+            logger.debug(f"There was an error: {err}", exc_info=True)
+
     def parsevcf(self):
         parser = argparse.ArgumentParser(
             description="Parses a VCF file using MODApy parser and exports output as \
@@ -185,7 +220,11 @@ class Parser(object):
                         prioritized: {prioritized}"""
             )
             if recursive:
-                file_list = glob.glob(path + "/**/*.vcf", recursive=True)
+                file_list = [
+                    x
+                    for ext in VCF_EXTENSIONS
+                    for x in glob.glob(path + "/**/*" + ext, recursive=True)
+                ]
             else:
                 file_list = [path]
             for file in file_list:
@@ -221,7 +260,39 @@ class Parser(object):
             help="Adds data from variantsdb to analysis done in modapy. Must \
                 supply path to excel output from modapy",
         )
-        parser.add_argument("--filetype", help="DB filetype (csv or parquet)", default="csv")
+        parser.add_argument(
+            "-addMultisample",
+            help="Adds every sample of a multi sample (joint called) vcf to DB. \
+                Must supply path to vcf",
+        )
+        parser.add_argument(
+            "-buildBurden",
+            action="store_true",
+            help="Rebuild the gene burden table from every sample in the parquet DB.",
+        )
+        parser.add_argument(
+            "-geneBurden",
+            help="Show how many samples of the parquet DB carry variants in a gene.",
+        )
+        parser.add_argument(
+            "-impact",
+            nargs="*",
+            help="IMPACT classes counted by -geneBurden (e.g. HIGH MODERATE).",
+        )
+        parser.add_argument(
+            "-dumpCSV",
+            action="store_true",
+            help="Write the Variants DataBase as one CSV file per chromosome.",
+        )
+        parser.add_argument(
+            "-buildFreqs",
+            action="store_true",
+            help="Rebuild the cohort frequency table from every sample in the \
+                parquet DB.",
+        )
+        parser.add_argument(
+            "--filetype", help="DB filetype (csv or parquet)", default="csv"
+        )
         parser.add_argument(
             "-nonprioritized",
             action="store_false",
@@ -233,20 +304,10 @@ class Parser(object):
             args = parser.parse_args(argv[2:])
             filetype = args.filetype
             prioritized = args.nonprioritized
-            if prioritized is True:
-                suffix = "-prioritized"
-            else:
-                suffix = "-nonprioritized"
-            dbpath = (
-                configuration.variantsDBPath.rsplit('/', maxsplit=1)[0]
-                + "/vardb"
-                + suffix
-                + ".parquet"
-            )
+            dbpath = parquetvardb.default_parquetdb_path(prioritized)
             if args.buildDB:
                 if filetype == 'csv':
-                    db = variantsdb.VariantsDB.buildDB()
-                    db.to_VarDBCSV()
+                    variantsdb.VariantsDB.buildDB()
                 elif filetype == 'parquet':
                     if os.path.exists(dbpath):
                         logger.info(f"Loading parquet db from {dbpath}")
@@ -263,10 +324,43 @@ class Parser(object):
                         filetype='vcf',
                         prioritized=prioritized,
                     )
+            if args.buildFreqs:
+                freqs = cohortfreqs.CohortFreqs.from_parquetdb(dbpath)
+                freqs.write(cohortfreqs.default_freqs_path(dbpath))
+            if args.buildBurden:
+                burden = geneburden.GeneBurden.from_parquetdb(dbpath)
+                burden.write(geneburden.default_burden_path(dbpath))
+            if args.geneBurden:
+                burden = geneburden.GeneBurden.read(
+                    geneburden.default_burden_path(dbpath), genes=[args.geneBurden]
+                )
+                result = burden.query(args.geneBurden, impacts=args.impact)
+                print(
+                    "%s: %i of %i samples carry variants"
+                    % (result["GENE_NAME"], result["N_CARRIERS"], result["N_SAMPLES"])
+                )
+                print(pd.DataFrame(result["COUNTS"]).to_string(index=False))
             if args.addPatientToDB:
                 patient = configuration.patientPath + args.addPatientToDB
-                db = variantsdb.VariantsDB.from_csvdb(variantsdb.variantsDBPath)
+                db = variantsdb.VariantsDB.from_VarDB()
                 db = db.addPatientToDB(patient)
+                db.to_VarDB()
+            if args.addMultisample:
+                if filetype == "parquet":
+                    parquetvardb.ParquetVarDB.add_multisample_vcf(
+                        args.addMultisample, dbpath, prioritized=prioritized
+                    )
+                else:
+                    db = variantsdb.VariantsDB.from_VarDB()
+                    pvcfs = vcfmgr.ParsedVCF.from_multisample_vcf(args.addMultisample)
+                    for name, pvcf in pvcfs.items():
+                        if name in db.patients:
+                            logger.warning("Patient %s already is in DB" % name)
+                            continue
+                        db = db.addPatientToDB(pvcf)
+                    db.to_VarDB()
+            if args.dumpCSV:
+                db = variantsdb.VariantsDB.from_VarDB()
                 db.to_VarDBCSV()
             if args.annotate:
                 fileName = args.annotate.rsplit("/", maxsplit=1)[1]
@@ -282,11 +376,19 @@ class Parser(object):
                     "FREQ",
                     "ALLELE_FREQ",
                 ]
-                db = variantsdb.VariantsDB.from_csvdb(
-                    variantsdb.variantsDBPath.rsplit("/", maxsplit=1)[0],
-                    columns=columns,
-                )
-                patient = db.annotate_excel(patient, fileName)
+                if filetype == "parquet":
+                    freqs = cohortfreqs.CohortFreqs.read(
+                        cohortfreqs.default_freqs_path(dbpath)
+                    ).get_freqs(patient)
+                    db = variantsdb.VariantsDB(
+                        freqs[cohortfreqs.FREQ_KEYS + cohortfreqs.FREQ_COLS]
+                    )
+                    patient = db.annotate_excel(
+                        patient, fileName, annotate_patients=False
+                    )
+                else:
+                    db = variantsdb.VariantsDB.from_VarDB_hits(patient, columns=columns)
+                    patient = db.annotate_excel(patient, fileName)
         except Exception as err:
             logger.error("Add patient process failed")
             logger.debug(f"There was an error: {err}", exc_info=True)
@@ -481,6 +583,60 @@ class Parser(object):
                 newpipe.runpipeline(fq1, startStep=args.startStep, endStep=args.endStep)
             return 0
 
+    def batch_pipeline(self):
+        # Description for batch pipeline usage
+        parser = argparse.ArgumentParser(
+            description="Run a Pipeline from FASTQ to VCF on a batch of samples"
+        )
+        parser.add_argument(
+            "-Pipeline",
+            required=True,
+            help="File name of the Pipeline inside Pipelines folder",
+        )
+        parser.add_argument(
+            "-SampleSheet",
+            required=True,
+            help="CSV or TSV file with FQ_1, FQ_2 and sample columns, inside "
+            "Patients folder or as an absolute path. FastQ paths are relative to "
+            "the sheet.",
+        )
+        parser.add_argument(
+            "-keeptmp",
+            action="store_true",
+            default=False,
+            help="Keep Temp files, otherwise just creates annotated vcf file.",
+        )
+        parser.add_argument(
+            "-maxSamples",
+            default=None,
+            type=int,
+            help="Samples running at the same time. Defaults to the cores in config.",
+        )
+        parser.add_argument(
+            "-force",
+            action="store_true",
+            default=False,
+            help="Run every step, even if its output is up to date.",
+        )
+
+        # ignore first argument
+        args = parser.parse_args(argv[2:])
+        pipe = configuration.pipelinesPath + args.Pipeline
+        checkFile(pipe, args.Pipeline.split(".")[-1])
+        sheet = args.SampleSheet
+        if not os.path.isabs(sheet):
+            sheet = configuration.patientPath + sheet
+        checkFile(sheet, "." + sheet.split(".")[-1])
+
+        newpipe = pipeline.Pipeline.from_json(pipe)
+        report = newpipe.runbatch(
+            sheet,
+            keeptmp=args.keeptmp,
+            max_samples=args.maxSamples,
+            force=args.force,
+        )
+        return 0 if report["failed"] == 0 else 1
+
     def abs_single(self):
         parser = argparse.ArgumentParser(description="Run study on a single patient")
         parser.add_argument(
@@ -529,7 +685,7 @@ class Parser(object):
             panel = configuration.panelsPath + args.Panel + ".xlsx"
             patient = configuration.patientPath + args.Patient
             annotate_patients = args.annotate_patients
-            checkFile(patient, ".vcf")
+            checkFile(patient, VCF_EXTENSIONS)
             checkFile(panel, ".xlsx")
             logger.info(
                 "Running %s on patient %s" % (str(args.Panel), str(args.Patient))
@@ -563,10 +719,7 @@ class Parser(object):
                 ]
             else:
                 columns = None
-            db = variantsdb.VariantsDB.from_csvdb(
-                configuration.variantsDBPath.rsplit("/", maxsplit=1)[0],
-                columns=columns,
-            )
+            db = variantsdb.VariantsDB.from_VarDB_hits(patient, columns=columns)
             patient = db.annotate_excel(patient, fileName, annotate_patients)
             logger.info("Single Analisis Complete")
             logger.info("File available at:%s" % outpath)
@@ -617,8 +770,8 @@ class Parser(object):
             patient1 = configuration.patientPath + args.Patient1
             patient2 = configuration.patientPath + args.Patient2
             # Checks file existence and type for patients
-            checkFile(patient1, ".vcf")
-            checkFile(patient2, ".vcf")
+            checkFile(patient1, VCF_EXTENSIONS)
+            checkFile(patient2, VCF_EXTENSIONS)
             logger.info(
                 "Running Duos Study on %s and %s"
                 % (str(args.Patient1), str(args.Patient2))
@@ -675,8 +828,8 @@ class Parser(object):
             patient1 = argv[2]
             patient2 = argv[3]
             # Checks file existence and type for patients
-            checkFile(patient1, ".vcf")
-            checkFile(patient2, ".vcf")
+            checkFile(patient1, VCF_EXTENSIONS)
+            checkFile(patient2, VCF_EXTENSIONS)
             logger.info(
                 "Evaluating differences between %s and %s"
                 % (str(patient1), str(patient2))
@@ -753,9 +906,9 @@ class Parser(object):
             patient2 = configuration.patientPath + args.Patient2
             patient3 = configuration.patientPath + args.Patient3
             # Checks file existence and type for patients
-            checkFile(patient1, ".vcf")
-            checkFile(patient2, ".vcf")
-            checkFile(patient3, ".vcf")
+            checkFile(patient1, VCF_EXTENSIONS)
+            checkFile(patient2, VCF_EXTENSIONS)
+            checkFile(patient3, VCF_EXTENSIONS)
             logger.info(
                 "Running Trios Study on %s, %s and %s"
                 % (str(args.Patient1), str(args.Patient2), str(args.Patient3))
@@ -0,0 +1,164 @@
+import logging
+
+from MODApy.sampletable import SampleTable, table_path
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FREQ_KEYS = ["CHROM", "POS", "REF", "ALT"]
+COUNT_COLS = ["N_CARRIERS", "N_HOM", "N_HET"]
+FREQ_COLS = ["FREQ", "ALLELE_FREQ"]
+
+
+def default_freqs_path(dbpath):
+    """
+    Returns the path of the frequency table that goes along a Parquet DB.
+
+    Parameters
+    ----------
+    dbpath : str
+        Path to the Parquet variants DB (a SAMPLE partitioned dataset).
+
+    Returns
+    -------
+    str
+        Path to the frequency table, next to the DB.
+    """
+    return table_path(dbpath, "_freqs.parquet")
+
+
+class CohortFreqs(SampleTable):
+    """
+    Materialized cohort allele frequency table for the Parquet variants DB.
+
+    One row per variant (CHROM, POS, REF, ALT) holding the number of carriers,
+    homozygous and heterozygous calls, and the derived FREQ and ALLELE_FREQ.
+    Frequencies are computed over all samples ingested in the table, which are
+    tracked in the `samples` attribute so the table can be updated with new
+    samples without rescanning the DB partitions.
+
+    The table is written sorted by CHROM and POS, so Parquet row group
+    statistics allow point and range lookups to skip most of the file.
+    """
+
+    COLUMNS = FREQ_KEYS + COUNT_COLS + FREQ_COLS
+    CALL_COLS = FREQ_KEYS + ["SAMPLE", "ZIGOSITY"]
+    SORT_COLS = ["CHROM", "POS"]
+    DESCRIPTION = "cohort frequencies"
+
+    @staticmethod
+    def count_calls(calls):
+        """
+        Aggregates variant calls into carrier and zygosity counts.
+
+        Parameters
+        ----------
+        calls : pandas.DataFrame
+            Long format calls, with CHROM, POS, REF, ALT and SAMPLE columns, and
+            optionally ZIGOSITY. Repeated rows for the same sample and variant
+            (e.g. one per annotation in non prioritized DBs) are counted once.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per variant with N_CARRIERS, N_HOM and N_HET columns.
+        """
+        cols = FREQ_KEYS + ["SAMPLE"]
+        if "ZIGOSITY" in calls.columns:
+            cols.append("ZIGOSITY")
+        calls = calls[cols].drop_duplicates(FREQ_KEYS + ["SAMPLE"])
+        if "ZIGOSITY" in calls.columns:
+            zigosity = calls["ZIGOSITY"].astype(str)
+        else:
+            zigosity = pd.Series("UNKWN", index=calls.index)
+        calls = calls[FREQ_KEYS].assign(
+            N_CARRIERS=1,
+            N_HOM=(zigosity == "HOM").astype("int64"),
+            N_HET=(zigosity == "HET").astype("int64"),
+        )
+        calls["CHROM"] = calls["CHROM"].astype(str)
+        calls["POS"] = calls["POS"].astype("int64")
+        counts = calls.groupby(FREQ_KEYS, sort=False)[COUNT_COLS].sum().reset_index()
+        return counts
+
+    @classmethod
+    def from_counts(cls, counts, samples):
+        """
+        Builds the frequency table from carrier counts and the list of samples
+        the counts were computed on.
+        """
+        nsamples = len(samples)
+        freqs = counts.sort_values(["CHROM", "POS"]).reset_index(drop=True)
+        freqs[COUNT_COLS] = freqs[COUNT_COLS].astype("int64")
+        if nsamples > 0:
+            freqs["FREQ"] = freqs["N_CARRIERS"] / nsamples
+            freqs["ALLELE_FREQ"] = (freqs["N_HOM"] * 2 + freqs["N_HET"]) / (
+                nsamples * 2
+            )
+        else:
+            freqs["FREQ"] = 0.0
+            freqs["ALLELE_FREQ"] = 0.0
+        return cls.with_samples(freqs, samples)
+
+    def merge_counts(self, counts):
+        """
+        Adds the counts of new samples to the counts of the table. Only the
+        counts of the variants carried by the new samples change, the rest of
+        the table just gets its frequencies rescaled to the new cohort size.
+        """
+        counts = pd.concat([pd.DataFrame(self)[FREQ_KEYS + COUNT_COLS], counts])
+        return counts.groupby(FREQ_KEYS, sort=False)[COUNT_COLS].sum().reset_index()
+
+    @classmethod
+    def read(cls, path, chrom=None, start=None, end=None):
+        """
+        Reads a frequency table, optionally restricted to a genomic region.
+
+        Parameters
+        ----------
+        path : str
+            Path to the frequency table.
+        chrom : str, optional
+            Chromosome to read. If None, the whole table is read.
+        start : int, optional
+            First position (inclusive) to read in `chrom`.
+        end : int, optional
+            Last position (inclusive) to read in `chrom`.
+
+        Returns
+        -------
+        CohortFreqs
+        """
+        filters = []
+        if chrom is not None:
+            filters.append(("CHROM", "==", str(chrom)))
+            if start is not None:
+                filters.append(("POS", ">=", int(start)))
+            if end is not None:
+                filters.append(("POS", "<=", int(end)))
+        return cls.read_table(path, filters=filters or None)
+
+    def get_freqs(self, variants):
+        """
+        Returns the frequencies of the given variants.
+
+        Parameters
+        ----------
+        variants : pandas.DataFrame
+            DataFrame with CHROM, POS, REF and ALT columns.
+
+        Returns
+        -------
+        pandas.DataFrame
+            `variants` key columns with the counts and frequencies of each one,
+            NaN for variants not present in the cohort.
+        """
+        keys = variants[FREQ_KEYS].copy()
+        keys["CHROM"] = keys["CHROM"].astype(str)
+        keys["POS"] = keys["POS"].astype("int64")
+        return keys.merge(
+            pd.DataFrame(self)[FREQ_KEYS + COUNT_COLS + FREQ_COLS],
+            on=FREQ_KEYS,
+            how="left",
+        )
@@ -1,53 +1,95 @@
 import logging
 import multiprocessing as mp
+import os
 import subprocess
-import traceback
+from collections import Counter
 
 from MODApy.cfg import configuration
 
+import numpy as np
+
 import pandas as pd
 
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
 logger = logging.getLogger(__name__)
 
+STATS = ["mean", "std", "min", "25%", "50%", "75%", "max"]
+# targets closer than this are read from the BAM in a single region, of at
+# most BLOCK_SIZE bases (unless a single target is longer)
+MAX_GAP = 10000
+BLOCK_SIZE = 1000000
+
+
+def _bedtools(args, output):
+    """
+    Runs bedtools, writing its stdout to `output`. Its stderr is logged, so
+    warnings do not end up in the output.
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If bedtools exits with an error.
+    """
+    cmd = ["bedtools"] + args
+    logger.debug("Running {}".format(" ".join(cmd)))
+    with open(output, "w") as out:
+        proc = subprocess.run(
+            cmd, stdout=out, stderr=subprocess.PIPE, universal_newlines=True
+        )
+    if proc.stderr:
+        logger.debug(proc.stderr.strip())
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=proc.stderr)
+    return output
+
 
 def generate_coverage(file):
-    cmd = "bedtools"
-    args = " genomecov -ibam {} -bga".format(file)
-    with open(
-        "{}_genomecov.bed".format(file.rsplit(".", maxsplit=1)[0]), "w"
-    ) as output:
-        p = subprocess.Popen(cmd + args, stdout=output, stderr=output, shell=True)
-        p.wait()
+    """
+    Writes the genome wide coverage bedgraph of a BAM file, and returns its
+    path.
+    """
+    output = "{}_genomecov.bed".format(file.rsplit(".", maxsplit=1)[0])
+    return _bedtools(["genomecov", "-ibam", file, "-bga"], output)
 
 
 def panel_intersect(file, panel_file):
-    cmd = "bedtools"
-    args = " intersect -a {} -b {}".format(file, panel_file)
-    with open(
-        "{}_{}.bed".format(
-            file.rsplit(".", maxsplit=1)[0],
-            panel_file.rsplit(".", maxsplit=1)[0],
-        ),
-        "w",
-    ) as output:
-        subprocess.Popen(cmd + args, stdout=output, stderr=output, shell=True)
+    """
+    Restricts a coverage bedgraph to the regions of a panel, and returns the
+    path of the result.
+    """
+    output = "{}_{}.bed".format(
+        file.rsplit(".", maxsplit=1)[0],
+        os.path.basename(panel_file).rsplit(".", maxsplit=1)[0],
+    )
+    return _bedtools(["intersect", "-a", file, "-b", panel_file], output)
 
 
 def annotate_genes(file, gene_file):
-    cmd = "bedtools"
-    args = " intersect -a {} -b {} -wb | awk -v OFS='\t' \
-        '{{print $1,$2,$3,$4,$8}}'".format(
-        file, gene_file
-    )
-    with open(
-        "{}_with_genes.cov".format(file.rsplit(".", maxsplit=1)[0]), "w"
-    ) as output:
-        p2 = subprocess.Popen(cmd + args, stdout=output, stderr=output, shell=True)
-        p2.wait()
+    """
+    Annotates a coverage bedgraph with the exons it overlaps, and returns the
+    path of the result (CHROM, START, END, DEPTH and EXON columns).
+    """
+    output = "{}_with_genes.cov".format(file.rsplit(".", maxsplit=1)[0])
+    wide = output + ".tmp"
+    _bedtools(["intersect", "-a", file, "-b", gene_file, "-wb"], wide)
+    # keep the bedgraph columns and the name of the exon
+    with open(wide) as intersected, open(output, "w") as out:
+        for line in intersected:
+            fields = line.rstrip("\n").split("\t")
+            out.write("\t".join(fields[:4] + [fields[7]]) + "\n")
+    os.remove(wide)
+    return output
 
 
 def create_coverage_reports(file):
-    # file = file.rsplit('.', maxsplit=1)[0]
+    """
+    Writes the per gene and per exon depth statistics of an annotated
+    coverage bedgraph.
+    """
     logger.debug(file)
     csv = pd.read_csv(file, sep="\t", names=["CHROM", "START", "END", "DEPTH", "EXON"])
     csv["GENE"] = csv["EXON"].str.split("_", n=1).str[0]
@@ -59,49 +101,338 @@ def create_coverage_reports(file):
     )
 
 
-def main(files, bedfile, panelfile=None):
-    pool = mp.Pool(processes=int(configuration.cfg["GENERAL"]["cores"]))
-    try:
-        logger.info("Generating coverage on {}".format(files))
-        r = pool.map_async(generate_coverage, files)
-        r.wait()
-        covfiles = [
-            "{}_genomecov.bed".format(file.rsplit(".", maxsplit=1)[0]) for file in files
-        ]
-        genfiles = [
-            "{}_genomecov_with_genes.cov".format(file.rsplit(".", maxsplit=1)[0])
-            for file in files
-        ]
-        if panelfile is not None:
-            logger.info("Intersecting panel in files {}".format(covfiles))
-            panel = pool.starmap_async(
-                panel_intersect, [(file, panelfile) for file in covfiles]
-            )
-            panel.wait()
-            intfiles = [
-                "{}_{}.bed".format(
-                    file.rsplit(".", maxsplit=1)[0],
-                    panelfile.rsplit(".", maxsplit=1)[0],
-                )
-                for file in files
-            ]
-            logger.info("Annotating genes {}".format(intfiles))
-            ann = pool.starmap_async(
-                annotate_genes, [(file, bedfile) for file in intfiles]
-            )
-            ann.wait()
+def read_bed(path, names=True):
+    """
+    Reads the intervals of a bed file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the bed file. Track, browser and comment lines are skipped.
+    names : bool, optional
+        Read the name (4th column) of each interval.
+
+    Returns
+    -------
+    list of tuple
+        CHROM, START, END (0-based, half open) and NAME (if `names`) of each
+        interval, in file order.
+    """
+    intervals = []
+    with open(path) as bed:
+        for line in bed:
+            if line.startswith(("#", "track", "browser")) or not line.strip():
+                continue
+            fields = line.rstrip("\n").split("\t")
+            interval = (fields[0], int(fields[1]), int(fields[2]))
+            if names:
+                interval += (fields[3],)
+            intervals.append(interval)
+    return intervals
+
+
+def restrict_targets(targets, panel):
+    """
+    Clips the named targets (exons) to the intervals of a panel, dropping the
+    targets outside it.
+    """
+    regions = {}
+    for chrom, start, end in sorted(panel):
+        merged = regions.setdefault(chrom, [])
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
         else:
-            logger.info("Annotating genes {}".format(covfiles))
-            ann = pool.starmap_async(
-                annotate_genes, [(file, bedfile) for file in covfiles]
+            merged.append([start, end])
+    restricted = []
+    for chrom, start, end, name in targets:
+        for rstart, rend in regions.get(chrom, []):
+            if rstart < end and start < rend:
+                restricted.append((chrom, max(start, rstart), min(end, rend), name))
+    return restricted
+
+
+def target_blocks(targets, max_gap=MAX_GAP, block_size=BLOCK_SIZE):
+    """
+    Groups the targets in the regions read from the BAM.
+
+    Returns
+    -------
+    list of tuple
+        CHROM, START and END of each region, and the targets in it, sorted by
+        position.
+    """
+    blocks = []
+    for target in sorted(targets, key=lambda x: (x[0], x[1], x[2])):
+        chrom, start, end = target[:3]
+        if (
+            blocks
+            and blocks[-1][0] == chrom
+            and start <= blocks[-1][2] + max_gap
+            and max(end, blocks[-1][2]) - blocks[-1][1] <= block_size
+        ):
+            block = blocks[-1]
+            blocks[-1] = (chrom, block[1], max(block[2], end), block[3] + [target])
+        else:
+            blocks.append((chrom, start, end, [target]))
+    return blocks
+
+
+def block_depth(spans, start, end):
+    """
+    Computes the depth of each base of a region from the reads over it.
+
+    Parameters
+    ----------
+    spans : iterable of tuple
+        Reference start and end (0-based, half open) of each read.
+    start, end : int
+        Region.
+
+    Returns
+    -------
+    numpy.ndarray
+        Depth of each base of the region.
+    """
+    diff = np.zeros(end - start + 1, dtype=np.int64)
+    starts = []
+    ends = []
+    for rstart, rend in spans:
+        rstart = max(rstart, start)
+        rend = min(rend, end)
+        if rend > rstart:
+            starts.append(rstart - start)
+            ends.append(rend - start)
+    np.add.at(diff, starts, 1)
+    np.add.at(diff, ends, -1)
+    return np.cumsum(diff[:-1])
+
+
+def histogram_stats(histogram):
+    """
+    Summarizes depths from their histogram (number of bases at each depth),
+    with the statistics of `pandas.Series.describe`.
+
+    Returns
+    -------
+    list of float
+        Mean, standard deviation, minimum, quartiles and maximum.
+    """
+    depths = np.nonzero(histogram)[0]
+    counts = histogram[depths]
+    total = counts.sum()
+    mean = (depths * counts).sum() / total
+    if total > 1:
+        std = np.sqrt((counts * (depths - mean) ** 2).sum() / (total - 1))
+    else:
+        std = np.nan
+    ranks = np.cumsum(counts)
+
+    def quantile(q):
+        # linear interpolation between the closest ranks, as pandas does
+        position = (total - 1) * q
+        lower = depths[np.searchsorted(ranks, np.floor(position), side="right")]
+        upper = depths[np.searchsorted(ranks, np.ceil(position), side="right")]
+        return lower + (upper - lower) * (position - np.floor(position))
+
+    return [
+        float(mean),
+        float(std),
+        float(depths[0]),
+        float(quantile(0.25)),
+        float(quantile(0.5)),
+        float(quantile(0.75)),
+        float(depths[-1]),
+    ]
+
+
+class _StatsAccumulator(object):
+    """
+    Depth histograms by key, summarized and freed as soon as every target of
+    a key has been read.
+    """
+
+    def __init__(self, keys):
+        self.remaining = Counter(keys)
+        self.histograms = {}
+        self.stats = {}
+
+    def add(self, key, depths):
+        histogram = self.histograms.pop(key, np.zeros(0, dtype=np.int64))
+        if len(depths):
+            counts = np.bincount(depths)
+            if len(histogram) < len(counts):
+                histogram, counts = counts, histogram
+            histogram[: len(counts)] += counts
+        self.remaining[key] -= 1
+        if self.remaining[key]:
+            self.histograms[key] = histogram
+        elif histogram.any():
+            self.stats[key] = histogram_stats(histogram)
+
+    def frame(self, names):
+        keys = sorted(self.stats)
+        return pd.DataFrame(
+            [self.stats[key] for key in keys],
+            index=pd.MultiIndex.from_arrays(
+                [[x[0] for x in keys], [x[1] for x in keys]], names=names
+            ),
+            columns=STATS,
+        )
+
+
+def target_coverage(bamfile, bedfile, panelfile=None, min_mapq=0):
+    """
+    Computes depth statistics of each exon and gene directly from a BAM.
+
+    The BAM is read region by region, only over the targets, so no genome
+    wide coverage file is written. As with bedtools genomecov, each mapped
+    read covers every base from its start to its end, and bases without reads
+    count with depth 0.
+
+    Parameters
+    ----------
+    bamfile : str
+        Path to the indexed BAM file.
+    bedfile : str
+        Bed file of exons, named GENE_EXON.
+    panelfile : str, optional
+        Bed file of the regions of interest. Exons are clipped to them.
+    min_mapq : int, optional
+        Minimum mapping quality of the reads counted.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Depth statistics by GENE and CHROM.
+    pandas.DataFrame
+        Depth statistics by EXON and CHROM.
+    """
+    if pysam is None:
+        raise ImportError("pysam is needed to compute coverage from BAM files")
+    targets = read_bed(bedfile)
+    if panelfile is not None:
+        targets = restrict_targets(targets, read_bed(panelfile, names=False))
+    with pysam.AlignmentFile(bamfile, "rb") as bam:
+        contigs = set(bam.references)
+        missing = sorted(set(x[0] for x in targets) - contigs)
+        if missing:
+            logger.warning(
+                "Contigs not in %s, skipped: %s" % (bamfile, ", ".join(missing))
             )
-            ann.wait()
-        logger.info("Creating Gene coverage report on {}".format(genfiles))
-        report = pool.map_async(create_coverage_reports, genfiles)
-        report.wait()
-        pool.close()
-        pool.join()
-    except Exception as e:
+            targets = [x for x in targets if x[0] in contigs]
+        exons = _StatsAccumulator((name, chrom) for chrom, _, _, name in targets)
+        genes = _StatsAccumulator(
+            (name.split("_", 1)[0], chrom) for chrom, _, _, name in targets
+        )
+        for chrom, start, end, block in target_blocks(targets):
+            spans = (
+                (read.reference_start, read.reference_end)
+                for read in bam.fetch(chrom, start, end)
+                if not read.is_unmapped and read.mapping_quality >= min_mapq
+            )
+            depth = block_depth(spans, start, end)
+            for _, tstart, tend, name in block:
+                depths = depth[tstart - start : tend - start]
+                exons.add((name, chrom), depths)
+                genes.add((name.split("_", 1)[0], chrom), depths)
+    return genes.frame(["GENE", "CHROM"]), exons.frame(["EXON", "CHROM"])
+
+
+def report_prefix(bamfile, panelfile=None):
+    """
+    Returns the prefix of the coverage reports of a BAM file.
+    """
+    prefix = bamfile.rsplit(".", maxsplit=1)[0] + "_genomecov"
+    if panelfile is not None:
+        prefix += "_" + os.path.basename(panelfile).rsplit(".", maxsplit=1)[0]
+    return prefix + "_with_genes"
+
+
+def native_coverage_reports(bamfile, bedfile, panelfile=None):
+    """
+    Writes the per gene and per exon coverage reports of a BAM file, computed
+    in process (see `target_coverage`).
+    """
+    logger.info("Computing coverage of {}".format(bamfile))
+    genes, exons = target_coverage(bamfile, bedfile, panelfile)
+    prefix = report_prefix(bamfile, panelfile)
+    genes.to_csv(prefix + "_coverage_per_gene.csv")
+    exons.to_csv(prefix + "_coverage_per_exon.csv")
+
+
+def coverage_reports(bamfile, bedfile, panelfile=None, engine="bedtools"):
+    """
+    Writes the per gene and per exon coverage reports of a BAM file.
+
+    With bedtools, each stage (genomecov, panel intersect, gene annotation
+    and report) starts once the previous one has finished writing its output.
+    The reports are written to `report_prefix` + "_coverage_per_gene.csv" and
+    "_coverage_per_exon.csv".
+    """
+    if engine == "native":
+        native_coverage_reports(bamfile, bedfile, panelfile)
+        return
+    logger.info("Generating coverage on {}".format(bamfile))
+    covfile = generate_coverage(bamfile)
+    if panelfile is not None:
+        logger.info("Intersecting panel in {}".format(covfile))
+        covfile = panel_intersect(covfile, panelfile)
+    logger.info("Annotating genes in {}".format(covfile))
+    genfile = annotate_genes(covfile, bedfile)
+    logger.info("Creating Gene coverage report on {}".format(genfile))
+    create_coverage_reports(genfile)
+
+
+def _coverage_task(args):
+    try:
+        coverage_reports(*args)
+        return args[0], None
+    except Exception as error:
+        logger.debug("Coverage of {} failed".format(args[0]), exc_info=True)
+        return args[0], str(error)
+
+
+def main(files, bedfile, panelfile=None, engine="auto"):
+    """
+    Writes coverage reports per gene and per exon of BAM files.
+
+    Each BAM is processed from start to end by a worker, so files do not wait
+    for each other between stages, and a failed file does not stop the rest.
+
+    Parameters
+    ----------
+    files : list of str
+        BAM files.
+    bedfile : str
+        Bed file of exons, named GENE_EXON.
+    panelfile : str, optional
+        Bed file of the regions of interest.
+    engine : str, optional
+        "native" computes coverage in process from the BAMs (needs pysam),
+        "bedtools" with bedtools genomecov and intersect. "auto" uses the
+        native engine if pysam is installed.
+
+    Returns
+    -------
+    dict
+        Error of each BAM file that failed.
+    """
+    if engine == "auto":
+        engine = "native" if pysam is not None else "bedtools"
+    if engine not in ("native", "bedtools"):
+        raise ValueError("Coverage engine must be native or bedtools, not %s" % engine)
+    failed = {}
+    if not files:
+        return failed
+    cores = int(configuration.cfg["GENERAL"]["cores"])
+    tasks = [(file, bedfile, panelfile, engine) for file in files]
+    with mp.Pool(processes=max(1, min(cores, len(files)))) as pool:
+        for bamfile, error in pool.imap(_coverage_task, tasks):
+            if error is None:
+                logger.info("Coverage reports of {} written".format(bamfile))
+            else:
+                logger.error("Coverage of {} failed: {}".format(bamfile, error))
+                failed[bamfile] = error
+    if failed:
         logger.error("Error running coverage. Check logs for debugging.")
-        logger.debug(e)
-        logger.debug(traceback.print_exc())
+    return failed
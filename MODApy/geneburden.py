@@ -0,0 +1,160 @@
+import logging
+
+from MODApy.sampletable import SampleTable, table_path
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+VARIANT_KEYS = ["CHROM", "POS", "REF", "ALT"]
+BURDEN_KEYS = ["GENE_NAME", "SAMPLE", "IMPACT", "ZIGOSITY"]
+IMPACTS = ["HIGH", "MODERATE", "LOW", "MODIFIER", "UNKNOWN"]
+
+
+def default_burden_path(dbpath):
+    """
+    Returns the path of the gene burden table that goes along a Parquet DB.
+
+    Parameters
+    ----------
+    dbpath : str
+        Path to the Parquet variants DB (a SAMPLE partitioned dataset).
+
+    Returns
+    -------
+    str
+        Path to the gene burden table, next to the DB.
+    """
+    return table_path(dbpath, "_burden.parquet")
+
+
+class GeneBurden(SampleTable):
+    """
+    Gene x sample burden summary of the Parquet variants DB.
+
+    One row per gene, sample, IMPACT and ZIGOSITY holding the number of
+    variants of the sample in the gene (N_VARIANTS). A variant annotated more
+    than once in the same gene (non prioritized DBs) is counted once, under
+    its most severe impact. The samples ingested in the table are tracked in
+    the `samples` attribute, so new samples are added without rescanning the
+    DB partitions.
+
+    The table is written sorted by GENE_NAME, so Parquet row group statistics
+    let gene queries read only a small part of the file.
+    """
+
+    COLUMNS = BURDEN_KEYS + ["N_VARIANTS"]
+    CALL_COLS = VARIANT_KEYS + BURDEN_KEYS
+    SORT_COLS = ["GENE_NAME", "SAMPLE"]
+    DESCRIPTION = "gene burden"
+
+    @staticmethod
+    def count_calls(calls):
+        """
+        Aggregates variant calls into gene x sample burden counts.
+
+        Parameters
+        ----------
+        calls : pandas.DataFrame
+            Long format calls, with CHROM, POS, REF, ALT and SAMPLE columns, and
+            optionally GENE_NAME, IMPACT and ZIGOSITY.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per BURDEN_KEYS with the N_VARIANTS count.
+        """
+        cols = [x for x in VARIANT_KEYS + BURDEN_KEYS if x in calls.columns]
+        calls = calls[cols].copy()
+        for col, default in [
+            ("GENE_NAME", "."),
+            ("IMPACT", "UNKNOWN"),
+            ("ZIGOSITY", "UNKWN"),
+        ]:
+            if col not in calls.columns:
+                calls[col] = default
+            calls[col] = calls[col].fillna(default).astype(str)
+        calls["SAMPLE"] = calls["SAMPLE"].astype(str)
+        calls.loc[~calls["IMPACT"].isin(IMPACTS), "IMPACT"] = "UNKNOWN"
+        severity = calls["IMPACT"].map({x: i for i, x in enumerate(IMPACTS)})
+        calls = calls.iloc[severity.argsort(kind="stable")].drop_duplicates(
+            VARIANT_KEYS + ["SAMPLE", "GENE_NAME"]
+        )
+        counts = calls.groupby(BURDEN_KEYS, sort=False).size()
+        return counts.rename("N_VARIANTS").reset_index()
+
+    @classmethod
+    def from_counts(cls, counts, samples):
+        """
+        Builds the burden table from burden counts and the list of samples the
+        counts were computed on.
+        """
+        burden = counts.sort_values(["GENE_NAME", "SAMPLE"]).reset_index(drop=True)
+        burden["N_VARIANTS"] = burden["N_VARIANTS"].astype("int64")
+        return cls.with_samples(burden, samples)
+
+    def merge_counts(self, counts):
+        """
+        Adds the counts of new samples to the counts of the table. Counts are
+        per sample, so the rows of the samples already in the table are kept
+        as they are.
+        """
+        return pd.concat([pd.DataFrame(self), counts])
+
+    @classmethod
+    def read(cls, path, genes=None):
+        """
+        Reads a burden table, optionally only the rows of some genes.
+
+        Parameters
+        ----------
+        path : str
+            Path to the burden table.
+        genes : list of str, optional
+            Genes to read. If None, the whole table is read.
+
+        Returns
+        -------
+        GeneBurden
+        """
+        filters = None
+        if genes is not None:
+            filters = [("GENE_NAME", "in", [str(x) for x in genes])]
+        return cls.read_table(path, filters=filters)
+
+    def query(self, gene, impacts=None, zygosities=None):
+        """
+        Summarizes the burden of a gene.
+
+        Parameters
+        ----------
+        gene : str
+            Gene name.
+        impacts : list of str, optional
+            IMPACT classes to count. If None, all are counted.
+        zygosities : list of str, optional
+            Zygosities to count (HOM, HET). If None, all are counted.
+
+        Returns
+        -------
+        dict
+            The gene, the number of samples in the table, the samples carrying
+            at least one matching variant and their counts by IMPACT and
+            ZIGOSITY.
+        """
+        rows = pd.DataFrame(self)
+        rows = rows[rows["GENE_NAME"] == str(gene)]
+        if impacts is not None:
+            rows = rows[rows["IMPACT"].isin(impacts)]
+        if zygosities is not None:
+            rows = rows[rows["ZIGOSITY"].isin(zygosities)]
+        carriers = sorted(rows["SAMPLE"].unique().tolist())
+        return {
+            "GENE_NAME": str(gene),
+            "N_SAMPLES": len(self.samples),
+            "N_CARRIERS": len(carriers),
+            "CARRIERS": carriers,
+            "COUNTS": rows[["SAMPLE", "IMPACT", "ZIGOSITY", "N_VARIANTS"]].to_dict(
+                orient="records"
+            ),
+        }
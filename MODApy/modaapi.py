@@ -1,15 +1,27 @@
 import logging
-from typing import Optional
-
-from MODApy import configuration, pipeline, vcfanalysis
+import os
+from typing import List, Optional
+
+from MODApy import (
+    configuration,
+    geneburden,
+    parquetvardb,
+    patientcatalog,
+    pipeline,
+    steprunner,
+    vcfanalysis,
+)
 from MODApy.utils import checkFile
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Query, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 from pydantic import BaseModel
 
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+
 logger = logging.getLogger()
 app = FastAPI()
 
@@ -47,6 +59,27 @@ class Pipeline(BaseModel):
     keeptmp: Optional[bool] = False
 
 
+class BatchPipeline(BaseModel):
+    """
+    Represents a pipeline run on a batch of samples.
+
+    Attributes:
+        Pipeline (str): The pipeline name.
+        SampleSheet (str): The CSV or TSV sample sheet (FQ_1, FQ_2, sample).
+            Relative paths are taken from the patients folder.
+        maxSamples (int, optional): Samples running at the same time. Defaults
+            to the cores of the node.
+        keeptmp (bool, optional): Whether to keep temporary files. Defaults to False.
+        force (bool, optional): Whether to rerun up to date steps. Defaults to False.
+    """
+
+    Pipeline: str
+    SampleSheet: str
+    maxSamples: Optional[int] = None
+    keeptmp: Optional[bool] = False
+    force: Optional[bool] = False
+
+
 class Single(BaseModel):
     """
     Represents single input data.
@@ -100,6 +133,61 @@ class Trios(BaseModel):
     filter: Optional[str] = None
 
 
+@app.get("/modaapi/patients")
+async def patients(suffix: Optional[str] = ".final.vcf"):
+    """
+    Lists the patients in the patients folder.
+
+    Parameters:
+        suffix (str, optional): Suffix of the patient files. Defaults to
+            ".final.vcf".
+
+    Returns:
+        JSONResponse: The patient files, with their sample name, mtime and size.
+    """
+    try:
+        catalog = patientcatalog.get_catalog(configuration.patientPath, suffix)
+        return JSONResponse(status_code=status.HTTP_200_OK, content=catalog.patients())
+    except Exception as err:
+        logger.error("Api error on Patients")
+        logger.debug(f"Error was: {err}", exc_info=True)
+        raise HTTPException(status_code=404, detail=str(err))
+
+
+@app.get("/modaapi/burden/{gene}")
+async def burden(
+    gene: str,
+    impact: Optional[List[str]] = Query(None),
+    zygosity: Optional[List[str]] = Query(None),
+    prioritized: Optional[bool] = True,
+):
+    """
+    Returns the samples of the parquet DB carrying variants in a gene.
+
+    Parameters:
+        gene (str): The gene name.
+        impact (list of str, optional): IMPACT classes to count.
+        zygosity (list of str, optional): Zygosities to count.
+        prioritized (bool, optional): Query the prioritized DB. Defaults to True.
+
+    Returns:
+        JSONResponse: The carriers and their counts by IMPACT and ZIGOSITY.
+    """
+    try:
+        dbpath = parquetvardb.default_parquetdb_path(prioritized)
+        table = geneburden.GeneBurden.read(
+            geneburden.default_burden_path(dbpath), genes=[gene]
+        )
+        return JSONResponse(
+            status_code=status.HTTP_200_OK,
+            content=table.query(gene, impacts=impact, zygosities=zygosity),
+        )
+    except Exception as err:
+        logger.error("Api error on Burden")
+        logger.debug(f"Error was: {err}", exc_info=True)
+        raise HTTPException(status_code=404, detail=str(err))
+
+
 @app.post("/modaapi/single")
 async def single(data: Single):
     """
@@ -257,3 +345,98 @@ async def run_pipeline(data: Pipeline):
         logger.error("Api error on Pipeline")
         logger.debug(f"Error was: {err}", exc_info=True)
         raise HTTPException(status_code=404, detail=str(err))
+
+
+@app.post("/modaapi/pipeline/batch")
+async def run_batch_pipeline(data: BatchPipeline):
+    """
+    Runs the pipeline on every sample of a sample sheet.
+
+    Parameters:
+        data (BatchPipeline): The batch pipeline data.
+
+    Returns:
+        JSONResponse: The response containing the job ID.
+    """
+    try:
+        data = data.dict()
+        pipe = data["Pipeline"]
+        sheet = data["SampleSheet"]
+        if not os.path.isabs(sheet):
+            sheet = configuration.patientPath + sheet
+
+        checkFile(pipe, pipe.split(".")[-1])
+        checkFile(sheet, "." + sheet.split(".")[-1])
+
+        newpipe = pipeline.Pipeline.from_json(pipe)
+        job_id = configuration.long_queue.enqueue(
+            newpipe.runbatch,
+            args=[sheet],
+            kwargs={
+                "keeptmp": data["keeptmp"],
+                "max_samples": data["maxSamples"],
+                "force": data["force"],
+            },
+        )
+        job_id = job_id.id
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content=f"Job Queued. Job id is {job_id}",
+        )
+    except Exception as err:
+        logger.error("Api error on Batch Pipeline")
+        logger.debug(f"Error was: {err}", exc_info=True)
+        raise HTTPException(status_code=404, detail=str(err))
+
+
+@app.get("/modaapi/jobs/{job_id}")
+async def job_status(job_id: str):
+    """
+    Returns the status of a queued job and, for pipelines, their progress.
+
+    Parameters:
+        job_id (str): The job ID.
+
+    Returns:
+        JSONResponse: The job status and the progress of each pipeline run by
+        patient (status of each step, last output line of the running steps
+        and recent events).
+    """
+    try:
+        job = Job.fetch(job_id, connection=configuration.redis_conn)
+    except NoSuchJobError:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "id": job_id,
+            "status": job.get_status(),
+            "progress": job.get_meta().get("progress", {}),
+        },
+    )
+
+
+@app.post("/modaapi/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """
+    Cancels a queued job. The pipelines of a running job kill the processes of
+    their running steps and fail as cancelled.
+
+    Parameters:
+        job_id (str): The job ID.
+
+    Returns:
+        JSONResponse: Confirmation of the request.
+    """
+    try:
+        job = Job.fetch(job_id, connection=configuration.redis_conn)
+    except NoSuchJobError:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if job.is_queued:
+        job.cancel()
+    else:
+        steprunner.request_cancel(configuration.redis_conn, job_id)
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=f"Cancel requested for job {job_id}",
+    )
@@ -2,6 +2,9 @@ import logging
 import os
 
 from MODApy.cfg import configuration
+from MODApy.cohortfreqs import CohortFreqs, default_freqs_path
+from MODApy.geneburden import GeneBurden, default_burden_path
+from MODApy.patientcatalog import get_catalog
 from MODApy.vcfmgr import ParsedVCF
 
 import cyvcf2
@@ -11,7 +14,50 @@ import pandas as pd
 logger = logging.getLogger(__name__)
 
 
-# TODO: FIND A MORE EFFICIENT WAY TO SUM EMPTY
+def default_parquetdb_path(prioritized=True):
+    """
+    Returns the path of the Parquet variants DB, in the configured DB folder.
+
+    Parameters
+    ----------
+    prioritized : bool, optional
+        Whether the DB holds one row per variant (prioritized) or one row per
+        variant annotation.
+
+    Returns
+    -------
+    str
+    """
+    suffix = "-prioritized" if prioritized else "-nonprioritized"
+    return (
+        configuration.variantsDBPath.rsplit("/", maxsplit=1)[0]
+        + "/vardb"
+        + suffix
+        + ".parquet"
+    )
+
+
+def _read_tables(dbpath):
+    """
+    Reads the cohort frequency and gene burden tables of a Parquet DB, building
+    them from the DB if they are missing.
+    """
+    dbexists = os.path.exists(dbpath) and len(os.listdir(dbpath)) > 0
+    freqspath = default_freqs_path(dbpath)
+    if os.path.exists(freqspath):
+        freqs = CohortFreqs.read(freqspath)
+    elif dbexists:
+        freqs = CohortFreqs.from_parquetdb(dbpath)
+    else:
+        freqs = CohortFreqs.empty()
+    burdenpath = default_burden_path(dbpath)
+    if os.path.exists(burdenpath):
+        burden = GeneBurden.read(burdenpath)
+    elif dbexists:
+        burden = GeneBurden.from_parquetdb(dbpath)
+    else:
+        burden = GeneBurden.empty()
+    return freqs, burden
 
 
 class ParquetVarDB(pd.DataFrame):
@@ -45,116 +91,39 @@ class ParquetVarDB(pd.DataFrame):
         prioritized=False,
     ):
         def patientLister(db=db, filetype=filetype):
-            vcfspath = []
-            for dirpath, dirnames, filenames in os.walk(patientPath):
-                for filename in [
-                    f for f in filenames if f.lower().endswith(f".final.{filetype}")
-                ]:
-                    vcfspath.append(os.path.join(dirpath, filename))
-            final_list = []
-            for idx in range(len(vcfspath)):
-                splitfn = vcfspath[idx].rsplit("/", maxsplit=1)[-1]
-                if "_MODApy" in splitfn:
-                    if not (any(splitfn in string for string in final_list)):
-                        final_list.append(vcfspath[idx])
-                else:
-                    if not (
-                        any(
-                            splitfn.strip(f".final.{filetype}") in string
-                            for string in final_list
-                        )
-                    ):
-                        final_list.append(vcfspath[idx])
-            for x in final_list:
-                fn = x.rsplit("/", maxsplit=1)[-1]
-                if any(
-                    fn.strip(f".final.{filetype}") + "_MODApy.final.{filetype}"
-                    in string
-                    for string in final_list
-                ):
-                    final_list.remove(x)
-            vcfspath = final_list
-
-            if db is not None:
-                if filetype == "vcf":
-                    try:
-                        vcfsnames = [cyvcf2.Reader(x).samples[0] for x in vcfspath]
-                    except Exception as e:
-                        logger.info(
-                            """No Sample name in one of the vcfs files.
-                            Using File Names Instead"""
-                        )
-                        logger.debug(str(e))
-                        vcfsnames = [
-                            x.rsplit("/", maxsplit=1)[-1].strip(f".final.{filetype}")
-                            for x in vcfspath
-                        ]
-                elif filetype == "parquet":
-                    try:
-                        vcfsnames = [
-                            pd.read_parquet(x, columns='SAMPLE', nrows=1).columns[
-                                'SAMPLE'
-                            ][0]
-                            for x in vcfspath
-                        ]
-                    except Exception as e:
-                        logger.info(
-                            """No Sample name in one of the vcfs files.
-                            Using File Names Instead"""
-                        )
-                        logger.debug(str(e))
-                        vcfsnames = [
-                            x.rsplit("/", maxsplit=1)[-1].strip(f".final.{filetype}")
-                            for x in vcfspath
-                        ]
-                addpatnames = [
-                    x
-                    for x in vcfsnames
-                    if (
-                        x not in db.SAMPLE.unique().astype(str).tolist()
-                        and x + "_MODApy" not in db.SAMPLE.unique().astype(str).tolist()
-                        and x.replace("_MODApy", "")
-                        not in db.SAMPLE.unique().astype(str).tolist()
-                    )
-                ]
-                if len(addpatnames) >= 1:
-                    logger.info("Adding Patients: {}".format([x for x in addpatnames]))
-                else:
-                    logger.error("No Patients to Add")
-                    exit(1)
-                patientslist = [x for x in vcfspath for y in addpatnames if y in x]
+            catalog = get_catalog(patientPath, suffix=f".final.{filetype}")
+            if db is None:
+                return [x["path"] for x in catalog.patients()]
+            addpats = catalog.missing_from(db.SAMPLE.unique().astype(str))
+            if len(addpats) >= 1:
+                logger.info(
+                    "Adding Patients: {}".format([x["sample"] for x in addpats])
+                )
             else:
-                patientslist = vcfspath
-
-            return patientslist
+                logger.error("No Patients to Add")
+                exit(1)
+            return [x["path"] for x in addpats]
 
-        def dbbuilder(patientslist, db=db, prioritized=prioritized):
+        def dbbuilder(patientslist, freqs, burden, db=db, prioritized=prioritized):
             logger.info("Parsing Patients")
             pvcfs = ParsedVCF.mp_parser(*patientslist, prioritized=prioritized)
             logger.info("Patients Parsed")
             logger.info("Building Database")
             if not os.path.exists(dbpath):
                 os.makedirs(dbpath)
-            if not os.path.exists(dbpath):
-                pvcfs[0].vcf_to_parquet(dbpath, partition_cols=['SAMPLE'], append=False)
-                [
-                    x.vcf_to_parquet(
-                        dbpath,
-                        partition_cols=['SAMPLE'],
-                        append=True,
-                    )
-                    for x in pvcfs[1:]
-                ]
-            else:
-                [
-                    x.vcf_to_parquet(
-                        dbpath,
-                        partition_cols=['SAMPLE'],
-                        append=True,
-                    )
-                    for x in pvcfs
-                ]
+            for x in pvcfs:
+                x.vcf_to_parquet(
+                    dbpath,
+                    partition_cols=['SAMPLE'],
+                    append=True,
+                )
             logger.info("Database Built")
+            calls = pd.concat(pvcfs, ignore_index=True)
+            freqs = freqs.add_samples(calls)
+            freqs.write(freqspath)
+            burden = burden.add_samples(calls)
+            burden.write(burdenpath)
+            return freqs, burden
 
         try:
             logger.info("Checking DB File")
@@ -168,6 +137,57 @@ class ParquetVarDB(pd.DataFrame):
                 0, len(patientslist), int(configuration.cfg["GENERAL"]["cores"])
             )
         ]
+        freqspath = default_freqs_path(dbpath)
+        burdenpath = default_burden_path(dbpath)
+        freqs, burden = _read_tables(dbpath)
         for lista in sublists:
-            db = dbbuilder(lista, db, prioritized=prioritized)
+            freqs, burden = dbbuilder(lista, freqs, burden, db, prioritized=prioritized)
         return db
+
+    @classmethod
+    def add_multisample_vcf(cls, vcf, dbpath, samples=None, prioritized=False):
+        """
+        Adds the samples of a multi sample VCF to the Parquet DB.
+
+        The VCF is parsed once and its long format calls are written straight
+        into the SAMPLE partitions of the DB, without splitting it into single
+        sample files. Samples already in the DB are skipped.
+
+        Parameters
+        ----------
+        vcf : str
+            Path to the multi sample vcf.
+        dbpath : str
+            Path to the Parquet variants DB.
+        samples : list of str, optional
+            Samples to add. If None, every sample in the VCF is added.
+        prioritized : bool, optional
+            Whether the DB holds prioritized variants.
+
+        Returns
+        -------
+        list of str
+            The samples added to the DB.
+        """
+        freqs, burden = _read_tables(dbpath)
+        if samples is None:
+            samples = cyvcf2.Reader(vcf).samples
+        already = [x for x in samples if x in freqs.samples]
+        if already:
+            logger.warning("Samples already in DB, skipping: {}".format(already))
+        samples = [x for x in samples if x not in freqs.samples]
+        if len(samples) == 0:
+            logger.error("No Patients to Add")
+            return []
+        logger.info("Adding Patients: {}".format(samples))
+        calls = ParsedVCF.multisample_calls(
+            vcf, samples=samples, prioritized=prioritized
+        )
+        calls.vcf_to_parquet(dbpath, partition_cols=["SAMPLE"], append=True)
+        # plain DataFrame, the ParsedVCF name would clash with groupby columns
+        calls = pd.DataFrame(calls)
+        freqs = freqs.add_samples(calls)
+        freqs.write(default_freqs_path(dbpath))
+        burden = burden.add_samples(calls)
+        burden.write(default_burden_path(dbpath))
+        return sorted(calls["SAMPLE"].unique().tolist())
@@ -0,0 +1,237 @@
+import gzip
+import json
+import logging
+import os
+
+from MODApy.cfg import configuration
+from MODApy.utils import VCF_EXTENSIONS
+
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+CATALOG_FILE = ".patient_catalog.json"
+_catalogs = {}
+
+
+def read_sample_name(path):
+    """
+    Reads the name of the first sample of a patient file without parsing it.
+
+    VCFs are read up to the #CHROM header line, Parquet files only load their
+    SAMPLE column.
+
+    Parameters
+    ----------
+    path : str
+        Path to a vcf (optionally gzipped) or parquet patient file.
+
+    Returns
+    -------
+    str
+        None if the file has no sample name.
+    """
+    if path.endswith(".parquet"):
+        table = pq.read_table(path, columns=["SAMPLE"])
+        return str(table.column("SAMPLE")[0]) if table.num_rows > 0 else None
+    opener = gzip.open if path.endswith((".gz", ".bgz")) else open
+    with opener(path, "rt") as f:
+        for line in f:
+            if line.startswith("#CHROM"):
+                fields = line.rstrip("\n").split("\t")
+                return fields[9] if len(fields) > 9 else None
+            if not line.startswith("#"):
+                return None
+    return None
+
+
+def patient_suffixes(suffix):
+    """
+    Returns the file suffixes matched by a patient file suffix: VCF suffixes
+    (e.g. ".final.vcf") also match their gzip and bgzip compressed versions.
+
+    Parameters
+    ----------
+    suffix : str
+        Suffix of the patient files.
+
+    Returns
+    -------
+    tuple of str
+        The matched suffixes, longest first.
+    """
+    if not suffix.lower().endswith(".vcf"):
+        return (suffix,)
+    return tuple(
+        sorted(
+            (suffix + ext[len(".vcf") :] for ext in VCF_EXTENSIONS),
+            key=len,
+            reverse=True,
+        )
+    )
+
+
+def get_catalog(patientPath=None, suffix=".final.vcf"):
+    """
+    Returns the up to date catalog of `patientPath`.
+
+    Catalogs are kept for the life of the process, so repeated calls (e.g.
+    from the API) only rescan the directory tree.
+    """
+    if patientPath is None:
+        patientPath = configuration.patientPath
+    key = (os.path.abspath(patientPath), suffix)
+    if key not in _catalogs:
+        _catalogs[key] = PatientCatalog(patientPath, suffix=suffix)
+    return _catalogs[key].scan()
+
+
+class PatientCatalog(object):
+    """
+    Index of the patient files found in the patients directory.
+
+    Each entry holds the path, the patient name (file name without suffix),
+    the sample name in the file, and the file mtime and size. Rescans walk
+    the tree with os.scandir and only read the header of new or modified
+    files. The catalog is cached in a json file in the patients directory, so
+    it is also reused between processes.
+    """
+
+    def __init__(self, patientPath, suffix=".final.vcf"):
+        """
+        Initializes a PatientCatalog object.
+
+        Parameters
+        ----------
+        patientPath : str
+            Patients directory.
+        suffix : str, optional
+            Suffix of the patient files to index. VCF suffixes also index the
+            compressed files, see `patient_suffixes`.
+        """
+        self.patientPath = patientPath
+        self.suffix = suffix
+        self.suffixes = tuple(x.lower() for x in patient_suffixes(suffix))
+        self.cachepath = os.path.join(patientPath, CATALOG_FILE)
+        self.entries = {}
+        if os.path.isfile(self.cachepath):
+            try:
+                with open(self.cachepath) as f:
+                    self.entries = json.load(f).get(suffix, {})
+            except (OSError, ValueError) as e:
+                logger.debug("Could not read patient catalog cache. {}".format(e))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _walk(self, path):
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from self._walk(entry.path)
+                    elif entry.name.lower().endswith(self.suffixes):
+                        yield entry
+        except OSError as e:
+            logger.debug("Could not scan {}. {}".format(path, e))
+
+    def scan(self):
+        """
+        Updates the catalog with the files currently in the patients directory.
+
+        Returns
+        -------
+        PatientCatalog
+            The updated catalog.
+        """
+        entries = {}
+        changed = False
+        for entry in self._walk(self.patientPath):
+            stat = entry.stat()
+            cached = self.entries.get(entry.path)
+            if (
+                cached is not None
+                and cached["mtime"] == stat.st_mtime
+                and cached["size"] == stat.st_size
+            ):
+                entries[entry.path] = cached
+                continue
+            try:
+                sample = read_sample_name(entry.path)
+            except Exception as e:
+                logger.debug("Could not read sample of {}. {}".format(entry.path, e))
+                sample = None
+            suffix = next(x for x in self.suffixes if entry.name.lower().endswith(x))
+            name = entry.name[: -len(suffix)]
+            entries[entry.path] = {
+                "path": entry.path,
+                "name": name,
+                "sample": sample if sample else name,
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+            }
+            changed = True
+        changed = changed or entries.keys() != self.entries.keys()
+        self.entries = entries
+        if changed:
+            self._save()
+        return self
+
+    def _save(self):
+        try:
+            cache = {}
+            if os.path.isfile(self.cachepath):
+                with open(self.cachepath) as f:
+                    cache = json.load(f)
+            cache[self.suffix] = self.entries
+            with open(self.cachepath + ".tmp", "w") as f:
+                json.dump(cache, f)
+            os.replace(self.cachepath + ".tmp", self.cachepath)
+        except (OSError, ValueError) as e:
+            logger.debug("Could not write patient catalog cache. {}".format(e))
+
+    def patients(self):
+        """
+        Returns one entry per patient, sorted by path.
+
+        When a patient has both a NAME and a NAME_MODApy file, the _MODApy one
+        is kept. Among files with the same name in different directories, the
+        first one by path is kept.
+
+        Returns
+        -------
+        list of dict
+        """
+        patients = {}
+        for path in sorted(self.entries):
+            entry = self.entries[path]
+            base = entry["name"].replace("_MODApy", "")
+            current = patients.get(base)
+            if current is None or (
+                "_MODApy" in entry["name"] and "_MODApy" not in current["name"]
+            ):
+                patients[base] = entry
+        return sorted(patients.values(), key=lambda x: x["path"])
+
+    def missing_from(self, names):
+        """
+        Returns the patients whose sample is not in `names`, e.g. the patients
+        not yet in a variants DB. NAME and NAME_MODApy are the same patient.
+
+        Parameters
+        ----------
+        names : iterable of str
+            Sample names already present.
+
+        Returns
+        -------
+        list of dict
+        """
+        names = set(str(x) for x in names)
+        return [
+            x
+            for x in self.patients()
+            if x["sample"] not in names
+            and x["sample"] + "_MODApy" not in names
+            and x["sample"].replace("_MODApy", "") not in names
+        ]
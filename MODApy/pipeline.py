@@ -1,11 +1,25 @@
+import copy
+import csv
+import functools
 import json
 import logging
 import os
 import shlex
 import shutil
 import subprocess
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from MODApy import configuration, vcfmgr
+from MODApy import configuration, profiling, stepcache, steprunner, vcfmgr
+from MODApy.scatter import gather_vcfs, read_fai, scatter_intervals
+from MODApy.scheduler import (
+    ResourceManager,
+    build_graph,
+    node_resources,
+    parse_memory,
+    run_graph,
+)
 
 import xmltodict
 
@@ -14,6 +28,9 @@ import yaml
 
 logger = logging.getLogger(__name__)
 logger2 = logging.getLogger("Pipeline Module")
+# exit codes of pipeline runs stopped by a step timeout or a cancellation
+EXIT_TIMEOUT = 124
+EXIT_CANCELLED = 130
 os.makedirs(configuration.rootDir + "/logs", exist_ok=True)
 hdlr = logging.FileHandler(configuration.rootDir + "/logs/pipe_run.log")
 formatter = logging.Formatter("%(asctime)s %(name)-25s %(levelname)-8s %(message)s")
@@ -25,12 +42,104 @@ logger2.setLevel(logging.DEBUG)
 # TODO: restructure pipeline, being less open, so less prone to errors
 
 
+def read_samplesheet(path):
+    """
+    Reads a sample sheet for batch pipeline runs.
+
+    The sheet is a comma or tab separated file with a header and one sample
+    per row, with columns FQ_1, FQ_2 (empty for single end) and optionally
+    sample. Relative FASTQ paths are taken from the folder of the sheet.
+
+    Returns
+    -------
+    list of dict
+        sample, FQ_1 and FQ_2 of each sample. Samples without name are named
+        after their FQ_1 file, as in `Pipeline.runpipeline`.
+    """
+    basedir = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        dialect = csv.Sniffer().sniff(f.readline(), delimiters=",\t")
+        f.seek(0)
+        rows = list(csv.DictReader(f, dialect=dialect))
+    samples = []
+    for row in rows:
+        row = {k.strip(): (v or "").strip() for k, v in row.items() if k}
+        if not row.get("FQ_1"):
+            continue
+        fastqs = [
+            os.path.join(basedir, row[x]) if row.get(x) else ""
+            for x in ("FQ_1", "FQ_2")
+        ]
+        sample = row.get("sample") or (
+            fastqs[0].split("/")[-1].split(".")[0].split("_1")[0]
+        )
+        samples.append({"sample": sample, "FQ_1": fastqs[0], "FQ_2": fastqs[1]})
+    names = [x["sample"] for x in samples]
+    duplicated = sorted(set(x for x in names if names.count(x) > 1))
+    if duplicated:
+        raise ValueError("Duplicated samples in sheet: %s" % ", ".join(duplicated))
+    return samples
+
+
+class PipeStepError(Exception):
+    """
+    Error raised when the command of a pipeline step fails, times out or is
+    cancelled (as told by its reason).
+    """
+
+    def __init__(self, step, returncode, reason="failed"):
+        if reason == "failed":
+            message = "Step %s failed with error code: %s" % (step.name, returncode)
+        elif reason == "timeout":
+            message = "Step %s timed out after %ss" % (step.name, step.timeout)
+        else:
+            message = "Step %s was %s" % (step.name, reason)
+        super().__init__(message)
+        self.step = step
+        self.returncode = returncode
+        self.reason = reason
+        self.usage = []
+
+    @property
+    def exitcode(self):
+        """
+        Exit code of a pipeline run stopped by this error: EXIT_TIMEOUT or
+        EXIT_CANCELLED, 128 plus the signal for steps killed by a signal, and
+        the return code of the step otherwise (never 0).
+        """
+        if self.reason == "timeout":
+            return EXIT_TIMEOUT
+        if self.reason == "cancelled":
+            return EXIT_CANCELLED
+        if self.returncode and self.returncode < 0:
+            return 128 - self.returncode
+        return self.returncode or 1
+
+
 class PipeStep(object):
     """
     Class defined for each step of the Pipeline
     """
 
-    def __init__(self, name, command, subcommand, version, inputfile, outputfile, args):
+    def __init__(
+        self,
+        name,
+        command,
+        subcommand,
+        version,
+        inputfile,
+        outputfile,
+        args,
+        depends_on=None,
+        threads=1,
+        memory=0,
+        scatter=None,
+        stream=False,
+        heap=None,
+        tmpdir=None,
+        threads_arg=None,
+        timeout=None,
+    ):
         """
         Initializes a PipeStep object.
 
@@ -50,6 +159,49 @@ class PipeStep(object):
             Path to the output file.
         args : str
             Additional arguments for the command.
+        depends_on : list of str or str, optional
+            Names of the steps that must finish before this one (a comma
+            separated string is also accepted). If None, the step depends on
+            the previous step of the pipeline.
+        threads : int, optional
+            Cores used by the step, by default 1.
+        memory : int, float or str, optional
+            Memory used by the step, in GB or with a unit suffix (e.g. "12G").
+        scatter : dict or str, optional
+            Scatter-gather of the step by genomic interval. Keys:
+
+            - by: "chromosome" (shards of whole contigs of the reference
+              .fa.fai) or "chunks" (`count` shards of about the same size).
+            - count: number of shards for "chunks", and maximum number of
+              shards for "chromosome" (consecutive contigs are grouped when
+              the reference has more). Defaults to the cores.
+            - arg: option that passes each interval to the tool, by default
+              "-L" (GATK).
+            - gather: "vcf" (concatenated in process) or "bam" (merged with
+              samtools), guessed from the output extension if not given.
+            - version: samtools version used to gather BAMs. If not given,
+              the unversioned samtools of the bin folder (or the PATH) is
+              used.
+
+            A string is taken as the "by" key.
+        stream : bool or str, optional
+            Pipe the stdout of this step into the stdin of the next step of
+            the pipeline, instead of writing its output file. The output of
+            this step and the input of the next are replaced by "-", or by the
+            given string (e.g. "/dev/stdin").
+        heap : int, float or str, optional
+            Heap of java tools (-Xmx), in GB or with a unit suffix. Defaults
+            to `memory` if declared, and 12G otherwise. The memory reserved
+            for the step is at least the heap.
+        tmpdir : str, optional
+            Temp dir of java tools (-Djava.io.tmpdir), "patientname" is
+            replaced as in the output. Defaults to the tmp dir of the run.
+        threads_arg : str, optional
+            Option that passes `threads` to the tool (e.g. "-t" for bwa, "-@"
+            for samtools). If None, the tool gets no thread count.
+        timeout : int, float or str, optional
+            Seconds after which the step is killed and fails, or a duration
+            with a s, m, h or d suffix (e.g. "6h").
         """
         self.name = name
         self.command = command
@@ -58,6 +210,24 @@ class PipeStep(object):
         self.inputfile = inputfile
         self.outputfile = outputfile
         self.args = args
+        if isinstance(depends_on, str):
+            depends_on = [x.strip() for x in depends_on.split(",") if x.strip()]
+        self.depends_on = depends_on
+        self.threads = int(threads)
+        self.memory = parse_memory(memory)
+        if isinstance(scatter, str):
+            scatter = {"by": scatter}
+        self.scatter = scatter
+        if isinstance(stream, str) and stream.lower() in ("true", "yes", "false", "no"):
+            stream = stream.lower() in ("true", "yes")
+        if stream is True:
+            stream = "-"
+        self.stream = stream or None
+        self.heap = parse_memory(heap) or self.memory
+        self.memory = max(self.memory, self.heap)
+        self.tmpdir = tmpdir
+        self.threads_arg = threads_arg
+        self.timeout = steprunner.parse_duration(timeout)
 
     def __str__(self):
         """
@@ -145,6 +315,10 @@ class Pipeline(object):
         """
         Private Class Method to build pipeline from loaded json,xml or yaml
 
+        Besides name, command, subcommand, version, input, output and args,
+        steps can declare depends_on, threads, memory, scatter, stream, heap,
+        tmpdir, threads_arg and timeout (see PipeStep).
+
         Parameters
         ----------
         pipedict : dict
@@ -171,7 +345,22 @@ class Pipeline(object):
             outputfile = steps[i]["output"]
             args = steps[i]["args"]
             newstep = PipeStep(
-                name, command, subcommand, version, inputfile, outputfile, args
+                name,
+                command,
+                subcommand,
+                version,
+                inputfile,
+                outputfile,
+                args,
+                depends_on=steps[i].get("depends_on"),
+                threads=steps[i].get("threads", 1),
+                memory=steps[i].get("memory", 0),
+                scatter=steps[i].get("scatter"),
+                stream=steps[i].get("stream", False),
+                heap=steps[i].get("heap"),
+                tmpdir=steps[i].get("tmpdir"),
+                threads_arg=steps[i].get("threads_arg"),
+                timeout=steps[i].get("timeout"),
             )
             newpipe.add_steps(newstep)
 
@@ -232,6 +421,434 @@ class Pipeline(object):
 
         return builtpipe
 
+    @staticmethod
+    def _stepinput(step, first, fastq1, fastq2, stepprefix):
+        """
+        Returns the input of a step: the FASTQ files for the first step of the
+        pipeline, its input files with the patient prefix otherwise.
+        """
+        if first:
+            logger2.debug("First Step")
+            if isinstance(step.inputfile, list) and not fastq2:
+                logger.warning(
+                    "WARNING: This pipeline was designed for Pair End \
+                    and you are running it as Single End"
+                )
+            elif isinstance(step.inputfile, str) and fastq2:
+                logger.warning(
+                    "WARNING: This pipeline was designed for Single \
+                        End and you are running it as Pair End"
+                )
+            if fastq2:
+                return fastq1 + " " + fastq2
+            return fastq1
+        # If it's not first step, input depends on output of previous
+        # step + patientname
+        if isinstance(step.inputfile, list):
+            return " ".join(
+                x.replace("patientname", stepprefix) for x in step.inputfile
+            )
+        elif isinstance(step.inputfile, str):
+            return step.inputfile.replace("patientname", stepprefix)
+        return ""
+
+    @staticmethod
+    def _stepcommand(step, inputfile, stepprefix, ref, samplename):
+        """
+        Builds the command line of a step.
+
+        Returns
+        -------
+        tuple
+            Command as a list of arguments, and the file its stdout is written
+            to (None if the tool writes its output file itself).
+        """
+        # replaces patient name in outputfiles
+        outputfile = step.outputfile.replace("patientname", stepprefix)
+        args = (
+            step.args.replace("patientname", stepprefix)
+            .replace("reference", ref)
+            .replace("samplename", samplename)
+        )
+        if step.threads_arg:
+            args += " %s %i" % (step.threads_arg, step.threads)
+        cmdver = step.version.replace(".", "_")
+        javacmds = ["GATK", "picard", "SnpSift", "snpEff"]
+        if any(javacmd in step.command for javacmd in javacmds):
+            heap = "%iM" % (step.heap * 1024) if step.heap else "12G"
+            if step.tmpdir:
+                javatmp = step.tmpdir.replace("patientname", stepprefix)
+            else:
+                javatmp = os.path.dirname(stepprefix)
+            os.makedirs(javatmp, exist_ok=True)
+            cmd = (
+                "java -jar -Xmx%s -Djava.io.tmpdir=%s " % (heap, javatmp)
+                + configuration.binPath
+                + step.command
+                + "/"
+                + step.command
+                + "_"
+                + cmdver
+                + ".jar "
+                + step.subcommand
+            )
+        else:
+            cmd = (
+                configuration.binPath
+                + step.command
+                + "/"
+                + step.command
+                + "_"
+                + cmdver
+                + " "
+                + step.subcommand
+            )
+        if "HaplotypeCaller" in cmd:
+            cmdstr = cmd + " " + args + " " + inputfile + " " + outputfile
+        else:
+            cmdstr = cmd + " " + args + " " + " " + inputfile + " " + outputfile
+        logger2.info("Subprocess: " + cmdstr)
+        cmd = shlex.split(cmdstr)
+        stdcmds = ["bwa", "bedtools", "snpEff", "SnpSift"]
+        if any(stdcmd in s for s in cmd for stdcmd in stdcmds):
+            return cmd[:-1], cmd[-1]
+        return cmd, None
+
+    @staticmethod
+    def _runstep(step, cmd, output=None, monitor=None):
+        """
+        Runs the command of a step, writing its stdout to `output` if given.
+
+        Returns
+        -------
+        list of dict
+            Profile of the process (see `profiling.usage_record`).
+
+        Raises
+        ------
+        PipeStepError
+            If the command can not be run, exits with an error, times out or
+            is cancelled.
+        """
+        return Pipeline._runstream([step], [cmd], output, monitor)
+
+    @staticmethod
+    def _runstream(steps, cmds, output=None, monitor=None):
+        """
+        Runs the commands of streamed steps connected by OS pipes, the stdout
+        of each one into the stdin of the next, writing the stdout of the last
+        one to `output` if given.
+
+        The stderr of every process, and the stdout of the last one if there
+        is no `output`, are logged line by line while they run (see
+        `steprunner.watch_processes`). The processes are killed if they run
+        longer than the shortest timeout of the steps, or if the run is
+        cancelled through `monitor`.
+
+        Returns
+        -------
+        list of dict
+            Profile of each process (see `profiling.usage_record`).
+
+        Raises
+        ------
+        PipeStepError
+            If a command can not be run, exits with an error, times out or is
+            cancelled. Its usage attribute holds the profiles of the processes.
+        """
+        logger2.info(" | ".join(step.name for step in steps))
+        procs = []
+        starts = []
+        outfile = open(output, "wb") if output is not None else subprocess.PIPE
+        try:
+            stdin = None
+            for i, (step, cmd) in enumerate(zip(steps, cmds)):
+                logger.info(f"Command is: {cmd}")
+                try:
+                    starts.append(time.time())
+                    procs.append(
+                        subprocess.Popen(
+                            cmd,
+                            stdin=stdin,
+                            stdout=outfile if i == len(cmds) - 1 else subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            start_new_session=True,
+                        )
+                    )
+                except OSError as exception:
+                    logger2.debug("Subprocess failed")
+                    logger2.debug("Exception ocurred: " + str(exception))
+                    for proc in procs:
+                        proc.kill()
+                        proc.wait()
+                    raise PipeStepError(step, 1) from exception
+                if stdin is not None:
+                    # the child holds it now, so it gets SIGPIPE if the
+                    # next step exits early
+                    stdin.close()
+                stdin = procs[-1].stdout
+        finally:
+            if output is not None:
+                outfile.close()
+
+        def online(i, stream, line):
+            logger2.debug("%s %s: %s" % (steps[i].name, stream, line))
+            if monitor is not None:
+                monitor.line(steps[i].name, line)
+
+        timeouts = [step.timeout for step in steps if step.timeout]
+        results, reason = steprunner.watch_processes(
+            procs,
+            online,
+            min(timeouts) if timeouts else None,
+            monitor.cancelled if monitor is not None else None,
+        )
+        records = []
+        failed = None
+        for step, cmd, proc, start, result in zip(steps, cmds, procs, starts, results):
+            records.append(
+                profiling.usage_record(
+                    step.name,
+                    cmd,
+                    start,
+                    result["end"],
+                    result["usage"],
+                    proc.returncode,
+                    step.threads,
+                )
+            )
+            if (proc.returncode != 0 or reason) and failed is None:
+                failed = PipeStepError(step, proc.returncode, reason or "failed")
+                logger2.error(str(failed))
+                if result["tail"]:
+                    logger2.error("Last stderr lines:\n" + "\n".join(result["tail"]))
+        if failed is not None:
+            logger2.error("Check log for more details")
+            failed.usage = records
+            raise failed
+        logger2.info("Subprocess %s finished" % ", ".join(x.name for x in steps))
+        return records
+
+    @staticmethod
+    def _streamchain(chain, graph, monitor=None):
+        """
+        Merges a chain of streamed steps into a single step of the graph,
+        named after its last step, that runs them connected by pipes.
+
+        Parameters
+        ----------
+        chain : list of tuple
+            Step, command line, stdout file and output of each step.
+        graph : dict
+            Dependency graph, updated in place.
+        monitor : steprunner.RunMonitor, optional
+            Monitor of the run, told the output of the steps.
+
+        Returns
+        -------
+        tuple
+            Merged step, its command line, output and the function that runs it.
+
+        Raises
+        ------
+        ValueError
+            If a streamed step does not read the output of the step streamed
+            into it, or another step depends on the output of a streamed
+            step, which is never written.
+        """
+        step, cmd, stdout, output = chain[-1]
+        for (producer, _, _, poutput), (consumer, ccmd, _, _) in zip(chain, chain[1:]):
+            if not any(x.split("=", 1)[-1] == poutput for x in ccmd):
+                raise ValueError(
+                    "Step %s is streamed into %s, which does not read its output %s"
+                    % (producer.name, consumer.name, poutput)
+                )
+            readers = [
+                name
+                for name, deps in graph.items()
+                if producer.name in deps and name != consumer.name
+            ]
+            if readers:
+                raise ValueError(
+                    "Step %s is streamed into %s, but its output is also needed by %s"
+                    % (producer.name, consumer.name, ", ".join(readers))
+                )
+        if len(chain) == 1:
+            return (
+                step,
+                cmd,
+                output,
+                functools.partial(Pipeline._runstep, *chain[0][:3], monitor),
+            )
+        cmds = [list(x[1]) for x in chain]
+        for i, (producer, _, pstdout, poutput) in enumerate(chain[:-1]):
+            token = producer.stream
+            if pstdout is None:
+                cmds[i] = [
+                    token if x.split("=", 1)[-1] == poutput else x for x in cmds[i]
+                ]
+            cmds[i + 1] = [
+                x.replace(poutput, token) if x.split("=", 1)[-1] == poutput else x
+                for x in cmds[i + 1]
+            ]
+        names = [x[0].name for x in chain]
+        merged = copy.copy(step)
+        merged.threads = sum(x[0].threads for x in chain)
+        merged.memory = sum(x[0].memory for x in chain)
+        graph[step.name] = set().union(*(graph.pop(x) for x in names)) - set(names)
+        for deps in graph.values():
+            if deps & set(names):
+                deps.difference_update(names)
+                deps.add(step.name)
+        logger2.info("Streaming steps %s" % " | ".join(names))
+        run = functools.partial(
+            Pipeline._runstream, [x[0] for x in chain], cmds, stdout, monitor
+        )
+        merged_cmd = [word for x in cmds for word in x + ["|"]][:-1]
+        return merged, merged_cmd, output, run
+
+    @staticmethod
+    def _outputpath(outputfile, stepprefix):
+        """
+        Returns the path of the output file of a step (the last word of its
+        output, without option name).
+        """
+        return outputfile.replace("patientname", stepprefix).split()[-1].split("=")[-1]
+
+    @staticmethod
+    def _cachedrun(step, run, cmd, output, force=False, report=None, monitor=None):
+        """
+        Runs a step unless its output is up to date with its command line and
+        inputs, and records its fingerprint next to the output when it finishes.
+        The profile of the step is added to `report`, and its state published
+        through `monitor`, if given.
+        """
+        record = stepcache.fingerprint(cmd, stepcache.command_files(cmd, output))
+        if not force and stepcache.is_current(record, output):
+            logger2.info(f"Step {step.name} is up to date, skipping it")
+            if report is not None:
+                report.skipped(step.name)
+            if monitor is not None:
+                monitor.publish(step.name, "skipped")
+            return
+        if monitor is not None:
+            if monitor.cancelled():
+                raise PipeStepError(step, 1, "cancelled")
+            monitor.publish(step.name, "running")
+        if os.path.exists(stepcache.sidecar_path(output)):
+            os.remove(stepcache.sidecar_path(output))
+        start = time.time()
+        before = profiling.thread_usage()
+        try:
+            usage = run()
+        except PipeStepError as error:
+            if report is not None:
+                report.add(error.usage)
+            if monitor is not None:
+                monitor.publish(step.name, error.reason, returncode=error.returncode)
+            raise
+        except Exception as error:
+            if monitor is not None:
+                monitor.publish(step.name, "failed", error=str(error))
+            raise
+        if usage is None:
+            # in process step, profiled with the usage of its thread
+            usage = [
+                profiling.usage_record(
+                    step.name,
+                    cmd,
+                    start,
+                    time.time(),
+                    profiling.usage_delta(before, profiling.thread_usage()),
+                    threads=step.threads,
+                )
+            ]
+        if report is not None:
+            report.add(usage)
+        stepcache.write_fingerprint(record, output)
+        if monitor is not None:
+            monitor.publish(step.name, "completed")
+
+    @staticmethod
+    def _samtools(version=None):
+        """
+        Returns the samtools binary that gathers scattered BAMs: the given
+        version from the bin folder, or else the unversioned samtools of the
+        bin folder, or the one in the PATH.
+        """
+        if version:
+            return (
+                configuration.binPath
+                + "samtools/samtools_"
+                + str(version).replace(".", "_")
+            )
+        samtools = configuration.binPath + "samtools/samtools"
+        return samtools if os.path.isfile(samtools) else "samtools"
+
+    def _scatterstep(
+        self, step, inputfile, stepprefix, ref, samplename, count, monitor=None
+    ):
+        """
+        Splits a scattered step into one step per shard of the reference, plus
+        the step that gathers their outputs.
+
+        Returns
+        -------
+        list of tuple
+            Each shard step with its command line, output and the function that
+            runs it, and last the gather step (named after `step`, so its
+            dependents wait for it).
+        """
+        scatter = step.scatter
+        intervals = scatter_intervals(
+            read_fai(ref + ".fai"),
+            scatter.get("by", "chromosome"),
+            int(scatter.get("count") or count),
+        )
+        output = self._outputpath(step.outputfile, stepprefix)
+        gather = scatter.get("gather")
+        if gather is None:
+            gather = "bam" if output.endswith(".bam") else "vcf"
+        shardname = "".join(x for x in step.name if x.isalnum())
+        logger2.info(f"Scattering {step.name} in {len(intervals)} shards")
+        runs = []
+        outputs = []
+        for i, regions in enumerate(intervals):
+            shard = copy.copy(step)
+            shard.name = "%s.%03d" % (step.name, i)
+            shard.outputfile = step.outputfile.replace(
+                "patientname", "patientname.%s_%03d" % (shardname, i)
+            )
+            shard.args = " ".join(
+                [step.args] + [scatter.get("arg", "-L") + " " + x for x in regions]
+            )
+            cmd, stdout = self._stepcommand(
+                shard, inputfile, stepprefix, ref, samplename
+            )
+            outputs.append(self._outputpath(shard.outputfile, stepprefix))
+            run = functools.partial(self._runstep, shard, cmd, stdout, monitor)
+            runs.append((shard, cmd, outputs[-1], run))
+        gatherstep = copy.copy(step)
+        if gather == "vcf":
+            gatherstep.threads = 1
+            cmd = ["gather_vcfs"] + outputs + [output]
+            run = functools.partial(gather_vcfs, outputs, output)
+        elif gather == "bam":
+            cmd = [
+                self._samtools(scatter.get("version")),
+                "merge",
+                "-f",
+                "-@",
+                str(step.threads),
+                output,
+            ]
+            cmd += outputs
+            run = functools.partial(self._runstep, gatherstep, cmd, None, monitor)
+        else:
+            raise ValueError("Gather must be vcf or bam, not %s" % gather)
+        runs.append((gatherstep, cmd, output, run))
+        return runs
+
     def runpipeline(
         self,
         fastq1: str,
@@ -240,16 +857,56 @@ class Pipeline(object):
         startStep=0,
         endStep=0,
         patientPath=None,
+        cores=None,
+        memory=None,
+        force=False,
+        resources=None,
+        patientname=None,
+        monitor=None,
     ):
         """
         Method to run the Pipeline
 
+        Returns the run report (see `profiling.RunReport`) if the pipeline
+        completed, and None otherwise.
+
+        Steps run as soon as the steps they depend on have finished, so
+        independent steps run concurrently as long as their threads and
+        memory fit in the cores and memory of the node. Pipelines run
+        concurrently in the same process share the resources of the node, so
+        the steps of several samples are packed up to its limits.
+
         Parameters
         ----------
         fastq1
             Path to the first fastq file.
         fastq2
             Path to the second fastq file, in case of paired reads.
+        cores
+            Cores available to the steps of this run only. If neither cores
+            nor memory are given, the steps share the resources of the node.
+        memory
+            Memory available to the steps of this run only, in GB or with a
+            unit suffix.
+        force
+            Run every step, even those whose output is up to date. Otherwise
+            steps whose output was made by the same command line from the same
+            inputs are skipped, so reruns resume from the first changed step.
+        resources
+            ResourceManager shared with other runs. Defaults to the node
+            resources (see `scheduler.node_resources`), sized from the cores
+            and the optional memory key of the GENERAL config section.
+        patientname
+            Name of the patient, by default taken from the fastq1 file name.
+        monitor
+            steprunner.RunMonitor that publishes the progress of the run and
+            cancels it on request. By default, progress is stored in the meta
+            of the rq job running the pipeline, if any.
+
+        The output of the steps is logged while they run, and steps with a
+        timeout are killed when they exceed it. The wall time, CPU time, peak
+        RSS and block I/O of each step are written to a json run report, next
+        to the tmp dir of the run.
         """
 
         try:
@@ -257,7 +914,8 @@ class Pipeline(object):
             logger.info("Nro de Pasos: %s" % str(len(self.steps)))
             logger2.info(self.steps)
             logger2.info("Nro de Pasos: %s" % str(len(self.steps)))
-            patientname = fastq1.split("/")[-1].split(".")[0].split("_1")[0]
+            if patientname is None:
+                patientname = fastq1.split("/")[-1].split(".")[0].split("_1")[0]
             ref = (
                 configuration.referencesPath
                 + self.reference
@@ -295,167 +953,100 @@ class Pipeline(object):
                 + " pipeline on patient: "
                 + str(patientname)
             )
-            # bool to check if first step
-            first = True
             if endStep == 0:
                 endStep = len(self.steps) + 1
-            if startStep > 0:
-                first = False
             logger2.info(f"STARTSTEP {startStep}")
-            for step in self.steps[startStep:endStep]:
-                if first is True:
-                    logger2.debug("First Step")
-                    first = False
-                    if isinstance(step.inputfile, list):
-                        if any(
-                            x in y
-                            for y in [fastq1, fastq2]
-                            for x in [".fastq", ".fastq.gz", ".fq", ".fq.gz"]
-                        ):
-                            if (fastq1 is not None) & (fastq2 is not None):
-                                inputfile = fastq1 + " " + fastq2
-                            else:
-                                logger.warn(
-                                    "WARNING: This pipeline was designed for Pair End \
-                                    and you are running it as Single End"
-                                )
-                                inputfile = fastq1
-                    elif isinstance(step.inputfile, str):
-                        if any(
-                            x in y
-                            for y in [fastq1]
-                            for x in [".fastq", ".fastq.gz", ".fq", ".fq.gz"]
-                        ):
-                            if (fastq1 is not None) & (fastq2 is not None):
-                                logger.warn(
-                                    "WARNING: This pipeline was designed for Single \
-                                        End and you are running it as Pair End"
-                                )
-                                inputfile = fastq1 + " " + fastq2
-                        else:
-                            inputfile = fastq1
-                # If it's not first step, input depends on output of previous
-                # step + patientname
+            steps = self.steps[startStep:endStep]
+            graph = build_graph(self.steps)
+            stepprefix = tmpdir + patientname
+            if resources is None:
+                if cores is None and memory is None:
+                    resources = node_resources()
                 else:
-                    if isinstance(step.inputfile, str):
-                        inputfile1 = step.inputfile[0].replace(
-                            "patientname",
-                            tmpdir + patientname + "/" + patientname,
-                        )
-                        inputfile2 = step.inputfile[1].replace(
-                            "patientname",
-                            tmpdir + patientname + "/" + patientname,
-                        )
-                        inputfile = inputfile1 + " " + inputfile2
-                    elif isinstance(step.inputfile, str):
-                        inputfile = step.inputfile.replace(
-                            "patientname", tmpdir + patientname
-                        )
-                # replaces patient name in outputfiles
-                if isinstance(step.outputfile, str):
-                    outputfile = step.outputfile.replace(
-                        "patientname", tmpdir + patientname
+                    resources = ResourceManager(
+                        cores or int(configuration.cfg["GENERAL"]["cores"]), memory
                     )
-                else:
+            runsteps = []
+            commands = {}
+            chain = []
+            # the report is kept next to the tmp dir, which may be removed
+            report = profiling.RunReport(self.name, patientname)
+            if monitor is None:
+                monitor = steprunner.job_monitor(self.name, patientname)
+            reportpath = (
+                os.path.dirname(tmpdir.rstrip("/"))
+                + "/"
+                + patientname
+                + "_run_report.json"
+            )
+            for i, step in enumerate(steps):
+                if not isinstance(step.outputfile, str):
                     return "Error Parsing output file. It should be a string."
-
-                logger2.info(step.name)
-                args = (
-                    step.args.replace("patientname", tmpdir + patientname)
-                    .replace("reference", ref)
-                    .replace("samplename", samplename)
+                inputfile = self._stepinput(
+                    step, step is self.steps[0], fastq1, fastq2, stepprefix
                 )
-                cmdver = step.version.replace(".", "_")
-                javacmds = ["GATK", "picard", "SnpSift", "snpEff"]
-                if any(javacmd in step.command for javacmd in javacmds):
-                    cmd = (
-                        "java -jar -Xmx12G -Djava.io.tmpdir=%s " % "~/.tmp"
-                        + configuration.binPath
-                        + step.command
-                        + "/"
-                        + step.command
-                        + "_"
-                        + cmdver
-                        + ".jar "
-                        + step.subcommand
+                if step.scatter and (step.stream or chain):
+                    raise ValueError(f"Scattered step {step.name} can not be streamed")
+                if step.scatter:
+                    runs = self._scatterstep(
+                        step,
+                        inputfile,
+                        stepprefix,
+                        ref,
+                        samplename,
+                        resources.cores,
+                        monitor,
                     )
+                    shards = [run[0].name for run in runs[:-1]]
+                    for shard in shards:
+                        graph[shard] = graph[step.name]
+                    graph[step.name] = set(shards)
                 else:
-                    cmd = (
-                        configuration.binPath
-                        + step.command
-                        + "/"
-                        + step.command
-                        + "_"
-                        + cmdver
-                        + " "
-                        + step.subcommand
+                    cmd, stdout = self._stepcommand(
+                        step, inputfile, stepprefix, ref, samplename
                     )
-                if "HaplotypeCaller" in cmd:
-                    cmdstr = cmd + " " + args + " " + inputfile + " " + outputfile
-                else:
-                    cmdstr = cmd + " " + args + " " + " " + inputfile + " " + outputfile
-                    logger.info(f"Command is: {cmd}")
-                cmd = shlex.split(cmdstr)
-
-                logging.info("Subprocess: " + cmdstr)
-                logger2.info("Subprocess: " + cmdstr)
-                stdcmds = ["bwa", "bedtools", "snpEff", "SnpSift"]
-                logger.info(f"Command is: {cmd}")
-                try:
-                    if any(stdcmd in s for s in cmd for stdcmd in stdcmds):
-                        output = cmd[-1]
-                        del cmd[-1]
-                        with open(output, "w+") as out:
-                            cmdrun = subprocess.Popen(
-                                cmd,
-                                stderr=subprocess.PIPE,
-                                stdout=out,
-                                universal_newlines=True,
-                            )
-                    else:
-                        cmdrun = subprocess.Popen(
-                            cmd,
-                            stderr=subprocess.PIPE,
-                            stdout=subprocess.PIPE,
-                            universal_newlines=True,
-                        )
-                    out, err = cmdrun.communicate()
-                    if out is not None:
-                        logging.debug("Output: " + out.strip())
-                        logger2.debug("Output: " + out.strip())
-                    if err is not None:
-                        logging.debug("Stderr: " + err.strip())
-                        logger2.debug("Stderr: " + err.strip())
-                    if cmdrun.returncode != 0:
-                        logging.error(
-                            "Subprocess failed with error code: "
-                            + str(cmdrun.returncode)
-                        )
-                        logger2.error(
-                            "Subprocess failed with error code: "
-                            + str(cmdrun.returncode)
-                        )
-                        logging.error("Check log for more details")
-                        logger2.error("Check log for more details")
-                        exit(cmdrun.returncode)
-
-                except (OSError, subprocess.CalledProcessError) as exception:
-                    logging.debug("Subprocess failed")
-                    logging.debug("Exception ocurred: " + str(exception))
-                    logger2.debug("Subprocess failed")
-                    logger2.debug("Exception ocurred: " + str(exception))
-                    logging.info(
-                        "There was an error when running the pipeline. Please \
-                            check logs for more info"
+                    output = self._outputpath(step.outputfile, stepprefix)
+                    chain.append((step, cmd, stdout, output))
+                    # streamed steps run with the next one, once it is built
+                    if step.stream and i < len(steps) - 1:
+                        continue
+                    runs = [self._streamchain(chain, graph, monitor)]
+                    chain = []
+                for runstep, cmd, output, run in runs:
+                    runsteps.append(runstep)
+                    commands[runstep.name] = functools.partial(
+                        self._cachedrun,
+                        runstep,
+                        run,
+                        cmd,
+                        output,
+                        force,
+                        report,
+                        monitor,
                     )
-                    logger2.info(
-                        "There was an error when running the pipeline. Please \
-                            check logs for more info"
-                    )
-                    exit(1)
-                else:
-                    logging.info("Subprocess finished")
-                    logger2.info("Subprocess finished")
+            monitor.start([step.name for step in runsteps])
+            status = "failed"
+            try:
+                run_graph(
+                    runsteps,
+                    graph,
+                    lambda step: commands[step.name](),
+                    resources,
+                )
+                status = "completed"
+            except PipeStepError as error:
+                if error.reason == "cancelled":
+                    status = "cancelled"
+                logging.error(str(error))
+                logging.error("Check log for more details")
+                logger2.info(
+                    "There was an error when running the pipeline. Please \
+                        check logs for more info"
+                )
+                exit(error.exitcode)
+            finally:
+                runreport = report.write(reportpath, status)
+                monitor.finish(status)
             if configuration.testFlag:
                 if os.path.exists(tmpdir + patientname + "_MODApy.final.vcf"):
                     file = (
@@ -530,12 +1121,138 @@ class Pipeline(object):
                 shutil.rmtree(tmpdir)
             logger2.info("Pipeline completed!")
             logging.info("Pipeline completed!")
+            return runreport
         except Exception as error:
             logger2.info("Pipeline Failed!")
             logging.info("Pipeline Failed!")
             logger2.debug(f"Pipeline error: {error}", exc_info=True)
             logging.debug(f"Pipeline error: {error}", exc_info=True)
 
+    def runbatch(
+        self,
+        samples,
+        keeptmp=False,
+        max_samples=None,
+        force=False,
+        cores=None,
+        memory=None,
+        reportpath=None,
+    ):
+        """
+        Runs the pipeline on a batch of samples.
+
+        Samples run concurrently and their steps share the resources of the
+        node, so the steps of every sample are scheduled together up to its
+        limits. The FASTQ files and the reference are checked once for the
+        whole batch before any sample starts.
+
+        Parameters
+        ----------
+        samples : str or list of dict
+            Path to a sample sheet (see `read_samplesheet`), or its rows.
+        keeptmp : bool, optional
+            Keep the tmp files of each sample.
+        max_samples : int, optional
+            Samples in flight at the same time, by default the cores of the
+            node.
+        force : bool, optional
+            Run every step, even those whose output is up to date.
+        cores, memory : optional
+            Resources of the batch. By default, the resources of the node.
+        reportpath : str, optional
+            Path to the json batch report. By default, it is written in the
+            Pipelines results folder.
+
+        Returns
+        -------
+        dict
+            Batch report: status and wall time of each sample, and aggregate
+            throughput in samples per hour.
+        """
+        if isinstance(samples, str):
+            samples = read_samplesheet(samples)
+        ref = configuration.referencesPath + self.reference + "/" + self.reference
+        missing = [
+            x
+            for sample in samples
+            for x in (sample["FQ_1"], sample["FQ_2"])
+            if x and not os.path.exists(x)
+        ]
+        if not os.path.exists(ref + ".fa"):
+            missing.append(ref + ".fa")
+        if missing:
+            logger2.error("Batch files not found: %s" % ", ".join(missing))
+            raise FileNotFoundError(", ".join(missing))
+        if cores is None and memory is None:
+            resources = node_resources()
+        else:
+            resources = ResourceManager(
+                cores or int(configuration.cfg["GENERAL"]["cores"]), memory
+            )
+        if max_samples is None:
+            max_samples = resources.cores
+        pipedir = "".join(x for x in self.name if x.isalnum())
+        if reportpath is None:
+            reportpath = (
+                configuration.resultsPath
+                + "Pipelines/"
+                + pipedir
+                + "_batch_report.json"
+            )
+        logger2.info(f"Running {self.name} pipeline on a batch of {len(samples)}")
+
+        def runsample(sample):
+            start = time.time()
+            try:
+                report = self.runpipeline(
+                    sample["FQ_1"],
+                    sample["FQ_2"] or None,
+                    keeptmp=keeptmp,
+                    force=force,
+                    resources=resources,
+                    patientname=sample["sample"],
+                )
+            except SystemExit:
+                report = None
+            except Exception as error:
+                logger2.error(f"Sample {sample['sample']} raised: {error}")
+                logger2.debug("", exc_info=True)
+                report = None
+            # runpipeline returns an error message for some invalid pipelines
+            status = "completed" if isinstance(report, dict) else "failed"
+            logger2.info(f"Sample {sample['sample']} {status}")
+            return OrderedDict(
+                [
+                    ("sample", sample["sample"]),
+                    ("status", status),
+                    ("wall_seconds", round(time.time() - start, 3)),
+                ]
+            )
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, max_samples)) as pool:
+            results = list(pool.map(runsample, samples))
+        wall = time.time() - start
+        completed = sum(x["status"] == "completed" for x in results)
+        batch = OrderedDict(
+            [
+                ("pipeline", self.name),
+                ("samples", results),
+                ("completed", completed),
+                ("failed", len(results) - completed),
+                ("wall_seconds", round(wall, 3)),
+                ("samples_per_hour", round(completed * 3600 / max(wall, 1e-6), 2)),
+            ]
+        )
+        os.makedirs(os.path.dirname(reportpath) or ".", exist_ok=True)
+        with open(reportpath, "w") as f:
+            json.dump(batch, f, indent=2)
+        logger2.info(
+            "Batch completed: %i of %i samples, %.2f samples/hour"
+            % (completed, len(results), batch["samples_per_hour"])
+        )
+        return batch
+
     def pipelineinfo(self):
         """
         Method to print Pipeline Info
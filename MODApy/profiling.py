@@ -0,0 +1,191 @@
+"""
+Resource profiling of pipeline steps.
+
+The processes of each step are reaped with os.wait4, which returns the
+resource usage of that child only, so steps running concurrently are
+profiled separately. In process steps (e.g. VCF gathering) are profiled
+with the usage of their thread where the platform provides it.
+"""
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# ru_maxrss is in KB on Linux and in bytes on macOS
+MAXRSS_BYTES = 1 if sys.platform == "darwin" else 1024
+# ru_inblock and ru_oublock count 512 byte blocks
+BLOCK_BYTES = 512
+
+
+def wait_profiled(proc):
+    """
+    Waits for a subprocess.Popen process and returns its resource usage.
+
+    The return code of the process is set, so Popen does not wait for it
+    again.
+
+    Returns
+    -------
+    resource.struct_rusage
+        Resource usage of the process.
+    """
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = _exitcode(status)
+    return usage
+
+
+def _exitcode(status):
+    """
+    Decodes a wait status as Popen.returncode does: the exit code of the
+    process, or minus the signal that killed it.
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    return status
+
+
+def thread_usage():
+    """
+    Returns the resource usage of the calling thread, or None if the
+    platform can not tell it apart from the rest of the process.
+    """
+    if hasattr(resource, "RUSAGE_THREAD"):
+        return resource.getrusage(resource.RUSAGE_THREAD)
+    return None
+
+
+def usage_record(name, cmd, start, end, usage=None, returncode=0, threads=1):
+    """
+    Builds the profile of a step process.
+
+    Parameters
+    ----------
+    name : str
+        Step name.
+    cmd : list of str
+        Command line of the process.
+    start, end : float
+        Start and end time of the process (time.time()).
+    usage : resource.struct_rusage, optional
+        Resource usage of the process.
+    returncode : int, optional
+        Exit code of the process.
+    threads : int, optional
+        Threads declared by the step.
+
+    Returns
+    -------
+    dict
+        Wall, user and system time (seconds), CPU utilization (average busy
+        cores), peak RSS (MB) and block I/O (bytes) of the process.
+    """
+    record = {
+        "step": name,
+        "command": " ".join(cmd),
+        "start": start,
+        "end": end,
+        "wall_seconds": round(end - start, 3),
+        "threads": threads,
+        "returncode": returncode,
+    }
+    if usage is not None:
+        cpu = usage.ru_utime + usage.ru_stime
+        record.update(
+            {
+                "user_seconds": round(usage.ru_utime, 3),
+                "system_seconds": round(usage.ru_stime, 3),
+                "cpu_utilization": round(cpu / max(end - start, 1e-6), 2),
+                "max_rss_mb": round(usage.ru_maxrss * MAXRSS_BYTES / 1024**2, 1),
+                "read_bytes": usage.ru_inblock * BLOCK_BYTES,
+                "write_bytes": usage.ru_oublock * BLOCK_BYTES,
+            }
+        )
+    return record
+
+
+def usage_delta(before, after):
+    """
+    Returns the usage between two thread_usage() calls, as the fields used by
+    `usage_record`, or None if they are not available.
+    """
+    if before is None or after is None:
+        return None
+    return _Usage(
+        ru_utime=after.ru_utime - before.ru_utime,
+        ru_stime=after.ru_stime - before.ru_stime,
+        ru_maxrss=after.ru_maxrss,
+        ru_inblock=after.ru_inblock - before.ru_inblock,
+        ru_oublock=after.ru_oublock - before.ru_oublock,
+    )
+
+
+class _Usage(object):
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class RunReport(object):
+    """
+    Profiles of the steps of a pipeline run, written as a json report.
+    """
+
+    def __init__(self, pipeline, patient):
+        self.pipeline = pipeline
+        self.patient = patient
+        self.start = time.time()
+        self.steps = []
+        self._lock = threading.Lock()
+
+    def add(self, records):
+        with self._lock:
+            for record in records:
+                self.steps.append(record)
+                if "user_seconds" in record:
+                    logger.info(
+                        "Step %s: %.1fs wall, %.1fs cpu, %.1f MB max RSS"
+                        % (
+                            record["step"],
+                            record["wall_seconds"],
+                            record["user_seconds"] + record["system_seconds"],
+                            record["max_rss_mb"],
+                        )
+                    )
+
+    def skipped(self, name):
+        self.add([{"step": name, "skipped": True}])
+
+    def write(self, path, status):
+        """
+        Writes the report.
+
+        Parameters
+        ----------
+        path : str
+            Path to the json report.
+        status : str
+            Final status of the run (e.g. completed or failed).
+        """
+        end = time.time()
+        with self._lock:
+            report = {
+                "pipeline": self.pipeline,
+                "patient": self.patient,
+                "status": status,
+                "start": self.start,
+                "end": end,
+                "wall_seconds": round(end - self.start, 3),
+                "steps": sorted(self.steps, key=lambda x: x.get("start", 0)),
+            }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info("Run report written to %s" % path)
+        return report
@@ -0,0 +1,202 @@
+"""
+Summary tables of the Parquet variants DB that track the samples they were
+computed on.
+
+The samples are stored in the Parquet schema metadata of the table, so a
+table can be updated with the calls of new samples without rescanning the DB
+partitions. See `MODApy.cohortfreqs` and `MODApy.geneburden`.
+"""
+import abc
+import json
+import logging
+import os
+
+import pandas as pd
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+SAMPLES_METADATA_KEY = b"modapy_samples"
+
+
+def table_path(dbpath, suffix):
+    """
+    Returns the path of a table that goes along a Parquet DB.
+
+    Parameters
+    ----------
+    dbpath : str
+        Path to the Parquet variants DB (a SAMPLE partitioned dataset).
+    suffix : str
+        Suffix of the table, e.g. "_freqs.parquet".
+
+    Returns
+    -------
+    str
+        Path to the table, next to the DB.
+    """
+    return os.path.splitext(dbpath.rstrip("/"))[0] + suffix
+
+
+class SampleTable(pd.DataFrame, metaclass=abc.ABCMeta):
+    """
+    Base class of the summary tables of the Parquet variants DB.
+
+    Subclasses must implement the abstract methods that aggregate long format
+    calls into counts (`count_calls`), build the table from the counts
+    (`from_counts`) and combine the counts of new samples with theirs
+    (`merge_counts`). The samples ingested in the table
+    are tracked in the `samples` attribute.
+
+    Attributes
+    ----------
+    COLUMNS : list of str
+        Columns of the table.
+    CALL_COLS : list of str
+        Columns of the DB calls the table is computed from, read if present.
+    SORT_COLS : list of str
+        Columns the table is sorted by when written, so Parquet row group
+        statistics let queries on them skip most of the file.
+    DESCRIPTION : str
+        Name of the table in log messages.
+    """
+
+    _metadata = ["samples"]
+    COLUMNS = []
+    CALL_COLS = []
+    SORT_COLS = []
+    DESCRIPTION = "table"
+
+    @property
+    def _constructor(self):
+        return type(self)
+
+    @classmethod
+    def empty(cls):
+        """
+        Creates a table with no samples.
+        """
+        return cls.with_samples(pd.DataFrame(columns=cls.COLUMNS), [])
+
+    @classmethod
+    def with_samples(cls, df, samples):
+        """
+        Wraps a DataFrame as a table computed on `samples`.
+        """
+        table = df.pipe(cls)
+        table.samples = list(samples)
+        return table
+
+    @staticmethod
+    @abc.abstractmethod
+    def count_calls(calls):
+        """
+        Aggregates long format calls (one row per variant and SAMPLE) into the
+        counts the table is built from.
+        """
+
+    @classmethod
+    @abc.abstractmethod
+    def from_counts(cls, counts, samples):
+        """
+        Builds the table from counts and the list of samples the counts were
+        computed on.
+        """
+
+    @abc.abstractmethod
+    def merge_counts(self, counts):
+        """
+        Adds the counts of new samples to the counts of the table.
+        """
+
+    @classmethod
+    def from_parquetdb(cls, dbpath):
+        """
+        Builds the table scanning every partition of a Parquet DB.
+
+        Parameters
+        ----------
+        dbpath : str
+            Path to the Parquet variants DB.
+
+        Returns
+        -------
+        SampleTable
+        """
+        logger.info("Calculating %s from %s" % (cls.DESCRIPTION, dbpath))
+        names = pq.ParquetDataset(dbpath).schema.names
+        columns = [x for x in cls.CALL_COLS if x in names]
+        calls = pd.read_parquet(dbpath, engine="pyarrow", columns=columns)
+        calls["SAMPLE"] = calls["SAMPLE"].astype(str)
+        samples = sorted(calls["SAMPLE"].unique().tolist())
+        return cls.from_counts(cls.count_calls(calls), samples)
+
+    @classmethod
+    def read_table(cls, path, filters=None):
+        """
+        Reads a table, only the rows matching `filters` (see
+        `pyarrow.parquet.read_table`) if given.
+        """
+        if not os.path.exists(path):
+            logger.error("Path to %s table incorrect." % cls.DESCRIPTION)
+            raise FileNotFoundError(path)
+        table = pq.read_table(path, filters=filters)
+        metadata = table.schema.metadata or {}
+        return cls.with_samples(
+            table.to_pandas(),
+            json.loads(metadata.get(SAMPLES_METADATA_KEY, b"[]")),
+        )
+
+    def write(self, path, row_group_size=50000):
+        """
+        Writes the table sorted by SORT_COLS.
+
+        Parameters
+        ----------
+        path : str
+            Output path.
+        row_group_size : int, optional
+            Number of rows per Parquet row group. Smaller row groups make
+            point lookups read less data.
+        """
+        logger.info("Writing %s to %s" % (self.DESCRIPTION, path))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        df = pd.DataFrame(self).sort_values(self.SORT_COLS)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[SAMPLES_METADATA_KEY] = json.dumps(self.samples).encode()
+        table = table.replace_schema_metadata(metadata)
+        pq.write_table(table, path, row_group_size=row_group_size, compression="snappy")
+
+    def add_samples(self, calls):
+        """
+        Adds the calls of new samples to the table. Samples already in it are
+        skipped.
+
+        Parameters
+        ----------
+        calls : pandas.DataFrame
+            Long format calls of the new samples, as accepted by `count_calls`.
+
+        Returns
+        -------
+        SampleTable
+            A new, updated, table.
+        """
+        calls = calls.assign(SAMPLE=calls["SAMPLE"].astype(str))
+        already = set(calls["SAMPLE"].unique()) & set(self.samples)
+        if already:
+            logger.warning(
+                "Samples already in {}, skipping: {}".format(
+                    self.DESCRIPTION, sorted(already)
+                )
+            )
+            calls = calls[~calls["SAMPLE"].isin(already)]
+        newsamples = sorted(calls["SAMPLE"].unique().tolist())
+        if len(newsamples) == 0:
+            return self
+        logger.info("Updating {} with {}".format(self.DESCRIPTION, newsamples))
+        counts = self.merge_counts(self.count_calls(calls))
+        return self.from_counts(counts, self.samples + newsamples)
@@ -0,0 +1,158 @@
+"""
+Scatter-gather of pipeline steps by genomic interval.
+
+A scattered step runs once per shard of the reference, each shard restricted
+to its intervals, and the outputs of the shards are gathered back into the
+output of the step.
+"""
+import functools
+import logging
+import math
+import os
+
+import cyvcf2
+
+
+logger = logging.getLogger(__name__)
+
+SCATTER_MODES = ("chromosome", "chunks")
+
+
+def read_fai(faipath):
+    """
+    Reads the contigs of a reference from its samtools faidx index.
+
+    The index is read once per process and shared by every scattered step,
+    and read again if the file changes (e.g. the reference is reindexed).
+
+    Parameters
+    ----------
+    faipath : str
+        Path to the .fa.fai file.
+
+    Returns
+    -------
+    tuple of tuple
+        Name and length of each contig, in reference order.
+    """
+    if not os.path.exists(faipath):
+        logger.error("Reference index not found: %s" % faipath)
+        raise FileNotFoundError(faipath)
+    stat = os.stat(faipath)
+    return _read_fai(faipath, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=32)
+def _read_fai(faipath, mtime, size):
+    contigs = []
+    with open(faipath) as fai:
+        for line in fai:
+            fields = line.split("\t")
+            if len(fields) >= 2:
+                contigs.append((fields[0], int(fields[1])))
+    return tuple(contigs)
+
+
+def _group_contigs(contigs, count):
+    """
+    Groups consecutive contigs into at most `count` shards of whole contigs,
+    so the small contigs of a reference (unplaced, decoys) share shards while
+    the large ones keep a shard each.
+    """
+    size = math.ceil(sum(length for _, length in contigs) / count)
+    while True:
+        shards = []
+        current = []
+        used = 0
+        for name, length in contigs:
+            if current and used + length > size:
+                shards.append(current)
+                current = []
+                used = 0
+            current.append("%s:%i-%i" % (name, 1, length))
+            used += length
+        if current:
+            shards.append(current)
+        if len(shards) <= count:
+            return shards
+        size += math.ceil(size / 10)
+
+
+def scatter_intervals(contigs, mode="chromosome", count=None):
+    """
+    Splits the reference into shards of intervals.
+
+    Parameters
+    ----------
+    contigs : list of tuple
+        Name and length of each contig, as returned by `read_fai`.
+    mode : str, optional
+        "chromosome" for shards of whole contigs, "chunks" for `count` shards
+        of about the same number of bases (contigs are split or grouped as
+        needed).
+    count : int, optional
+        Number of shards in "chunks" mode. In "chromosome" mode, the maximum
+        number of shards: references with more contigs get consecutive
+        contigs grouped, and each contig gets its own shard if None.
+
+    Returns
+    -------
+    list of list of str
+        Intervals of each shard, as 1-based closed "contig:start-end" regions,
+        in reference order.
+    """
+    if mode == "chromosome":
+        if count and len(contigs) > count:
+            return _group_contigs(contigs, count)
+        return [["%s:%i-%i" % (name, 1, length)] for name, length in contigs]
+    elif mode != "chunks":
+        raise ValueError(
+            "Scatter mode must be one of %s, not %s" % (", ".join(SCATTER_MODES), mode)
+        )
+    if not count or count < 1:
+        raise ValueError("chunks scatter needs a positive shard count")
+    size = math.ceil(sum(length for _, length in contigs) / count)
+    shards = []
+    current = []
+    room = size
+    for name, length in contigs:
+        start = 1
+        while start <= length:
+            end = min(length, start + room - 1)
+            current.append("%s:%i-%i" % (name, start, end))
+            room -= end - start + 1
+            start = end + 1
+            if room == 0:
+                shards.append(current)
+                current = []
+                room = size
+    if current:
+        shards.append(current)
+    return shards
+
+
+def gather_vcfs(inputs, output):
+    """
+    Concatenates the VCFs of the shards of a step, in shard order.
+
+    The header is taken from the first shard. The output is bgzip compressed
+    if its name ends in .gz.
+
+    Parameters
+    ----------
+    inputs : list of str
+        Paths to the shard VCFs, in reference order.
+    output : str
+        Path to the gathered VCF.
+    """
+    logger.info("Gathering %i VCFs into %s" % (len(inputs), output))
+    first = cyvcf2.Reader(inputs[0])
+    writer = cyvcf2.Writer(output, first, mode="wz" if output.endswith(".gz") else "w")
+    try:
+        for path in inputs:
+            reader = first if path == inputs[0] else cyvcf2.Reader(path)
+            for variant in reader:
+                writer.write_record(variant)
+            reader.close()
+    finally:
+        writer.close()
@@ -0,0 +1,256 @@
+"""
+Dependency graph scheduling of pipeline steps.
+
+The steps of a pipeline form a DAG: a step is ready once every step it
+depends on has finished, and ready steps run concurrently as long as their
+declared threads and memory fit in the resources left on the node.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from MODApy import configuration
+
+
+logger = logging.getLogger(__name__)
+
+MEMORY_UNITS = {"K": 1 / 1024**2, "M": 1 / 1024, "G": 1, "T": 1024}
+
+
+def parse_memory(value):
+    """
+    Parses a memory amount into GB.
+
+    Parameters
+    ----------
+    value : int, float or str
+        Amount in GB, or a string with a K, M, G or T suffix (e.g. "12G",
+        "512M"). None or an empty string mean no memory requirement.
+
+    Returns
+    -------
+    float
+        Memory in GB.
+    """
+    if value is None or value == "":
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = str(value).strip().upper().rstrip("B")
+    if value and value[-1] in MEMORY_UNITS:
+        return float(value[:-1]) * MEMORY_UNITS[value[-1]]
+    return float(value)
+
+
+class ResourceManager(object):
+    """
+    Cores and memory (GB) of the node, shared by the steps running at the
+    same time, from one or several pipelines.
+
+    A step that asks for more than the whole node is still run, but only
+    when nothing else is running, so it can not block the pipelines.
+    The manager is thread safe, so concurrent runs of pipelines in the same
+    process can share it (see `node_resources`).
+    """
+
+    def __init__(self, cores, memory=None):
+        self.cores = max(1, int(cores))
+        self.memory = parse_memory(memory) or None
+        self.used_cores = 0
+        self.used_memory = 0.0
+        self.generation = 0
+        self._changed = threading.Condition()
+
+    def try_acquire(self, threads, memory=0.0):
+        """
+        Reserves `threads` cores and `memory` GB if they are available.
+
+        Returns
+        -------
+        bool
+            Whether the resources were reserved.
+        """
+        with self._changed:
+            idle = self.used_cores == 0 and self.used_memory == 0
+            if not idle:
+                if self.used_cores + threads > self.cores:
+                    return False
+                if self.memory is not None and self.used_memory + memory > self.memory:
+                    return False
+            self.used_cores += threads
+            self.used_memory += memory
+            return True
+
+    def release(self, threads, memory=0.0):
+        with self._changed:
+            self.used_cores -= threads
+            self.used_memory -= memory
+        self.notify()
+
+    def notify(self):
+        """Wakes up the schedulers waiting for a change."""
+        with self._changed:
+            self.generation += 1
+            self._changed.notify_all()
+
+    def wait(self, generation, timeout=None):
+        """
+        Waits until something changed after `generation` (resources released
+        or a step finished).
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.generation != generation, timeout)
+
+
+_node_resources = None
+_node_lock = threading.Lock()
+
+
+def node_resources():
+    """
+    Returns the resource manager of the node, shared by every pipeline run in
+    this process. It is sized from the cores and the optional memory key of
+    the GENERAL section of the config.
+    """
+    global _node_resources
+    with _node_lock:
+        if _node_resources is None:
+            general = configuration.cfg["GENERAL"]
+            _node_resources = ResourceManager(
+                int(general["cores"]), general.get("memory")
+            )
+        return _node_resources
+
+
+def _file_tokens(*values):
+    """
+    Returns the file names in the input, output or args of a step: the words
+    that are not options, and the values of KEY=VALUE words.
+    """
+    tokens = set()
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = [value]
+        for word in " ".join(value).split():
+            word = word.split("=", 1)[-1]
+            if word and not word.startswith("-"):
+                tokens.add(word)
+    return tokens
+
+
+def build_graph(steps):
+    """
+    Builds the dependency graph of pipeline steps.
+
+    A step depends on the steps listed in its `depends_on`, and on the earlier
+    steps that write a file it reads (found in its input and args). Steps
+    that do not declare `depends_on` also depend on the previous step, so
+    pipeline definitions without dependencies keep running sequentially.
+
+    Parameters
+    ----------
+    steps : list of PipeStep
+        Steps in definition order.
+
+    Returns
+    -------
+    OrderedDict
+        Names of the steps each step depends on, by step name.
+    """
+    graph = OrderedDict()
+    outputs = OrderedDict()
+    for i, step in enumerate(steps):
+        if step.name in graph:
+            raise ValueError("Duplicated step name: %s" % step.name)
+        deps = set()
+        if step.depends_on is None:
+            if i > 0:
+                deps.add(steps[i - 1].name)
+        else:
+            unknown = [x for x in step.depends_on if x not in graph]
+            if unknown:
+                raise ValueError(
+                    "Step %s depends on unknown or later steps: %s"
+                    % (step.name, ", ".join(unknown))
+                )
+            deps.update(step.depends_on)
+        reads = _file_tokens(step.inputfile, step.args)
+        for name, written in outputs.items():
+            if reads & written:
+                deps.add(name)
+        graph[step.name] = deps
+        outputs[step.name] = _file_tokens(step.outputfile)
+    return graph
+
+
+def run_graph(steps, graph, runner, resources):
+    """
+    Runs the steps in dependency order, concurrently within the resources.
+
+    Parameters
+    ----------
+    steps : list of PipeStep
+        Steps to run. Dependencies on steps not in the list are considered
+        already satisfied.
+    graph : dict
+        Dependencies of each step, as returned by `build_graph`.
+    runner : callable
+        Function called with each step to run it. It must raise an exception
+        if the step fails.
+    resources : ResourceManager
+        Cores and memory available to the steps, maybe shared with other
+        pipelines.
+
+    Raises
+    ------
+    Exception
+        The error of the first failed step, once the steps running with it have
+        finished. No new step is started after a failure.
+    """
+    pending = OrderedDict((step.name, step) for step in steps)
+    done = set(graph) - set(pending)
+    running = {}
+    failed = None
+
+    def run(step):
+        try:
+            return runner(step)
+        finally:
+            resources.release(step.threads, step.memory)
+
+    with ThreadPoolExecutor(max_workers=max(1, len(pending))) as pool:
+        while running or (pending and failed is None):
+            generation = resources.generation
+            if failed is None:
+                for name, step in list(pending.items()):
+                    if graph[name] <= done and resources.try_acquire(
+                        step.threads, step.memory
+                    ):
+                        logger.info("Starting step %s" % name)
+                        future = pool.submit(run, step)
+                        future.add_done_callback(lambda _: resources.notify())
+                        running[future] = step
+                        del pending[name]
+            finished = [future for future in running if future.done()]
+            if not running and not any(graph[x] <= done for x in pending):
+                raise RuntimeError(
+                    "Steps can not be scheduled: %s" % ", ".join(pending)
+                )
+            if not finished:
+                # wait for a step to finish or resources to be released
+                resources.wait(generation, timeout=5)
+            for future in finished:
+                step = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    logger.info("Finished step %s" % step.name)
+                    done.add(step.name)
+                else:
+                    logger.error("Step %s failed" % step.name)
+                    if failed is None:
+                        failed = error
+    if failed is not None:
+        raise failed
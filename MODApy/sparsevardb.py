@@ -0,0 +1,316 @@
+import logging
+import os
+
+from MODApy.utils import ZYG_HET, ZYG_HOM, ZYG_NOCALL, ZYG_UNKWN, encode_zygosity
+
+import numpy as np
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+VARIANT_COLS = ["CHROM", "POS", "REF", "ALT", "GENE_NAME", "HGVS.C", "HGVS.P"]
+# Columns of a VariantsDB that are not patients
+FREQ_COLS = ["FREQ", "ALLELE_FREQ"]
+COUNT_COLS = ["N_CARRIERS", "N_ALLELES"]
+# Allele dosage and DB string for each zygosity code
+DOSAGE = np.zeros(4, dtype=np.int8)
+DOSAGE[[ZYG_HET, ZYG_HOM]] = [1, 2]
+DECODE = np.empty(4, dtype=object)
+DECODE[[ZYG_NOCALL, ZYG_HET, ZYG_HOM, ZYG_UNKWN]] = [".", "HET", "HOM", "UNKWN"]
+
+
+class SparseVarDB(object):
+    """
+    Variants DB stored as a sparse zygosity matrix.
+
+    Calls are kept in CSR layout by variant: the calls of variant `i` are
+    `data[indptr[i]:indptr[i + 1]]`, made by the samples at the same positions
+    of `indices`. Only actual calls are stored, as int8 zygosity codes (see
+    `MODApy.utils.encode_zygosity`), so memory, disk usage and frequency
+    calculation are proportional to the number of calls instead of
+    variants x patients. Calls other than HOM or HET are stored as UNKWN.
+
+    On disk the DB is a directory with one .npy file per CSR array, which can
+    be memory mapped, plus the variant and sample index tables.
+    """
+
+    def __init__(self, variants, samples, indptr, indices, data):
+        """
+        Initializes a SparseVarDB object.
+
+        Parameters
+        ----------
+        variants : pandas.DataFrame
+            Variant index table, one row per variant with VARIANT_COLS columns.
+        samples : list of str
+            Sample names, one per column of the zygosity matrix.
+        indptr : numpy.ndarray
+            int64 array of len(variants) + 1 offsets into indices and data.
+        indices : numpy.ndarray
+            int32 array with the sample index of each call.
+        data : numpy.ndarray
+            int8 array with the zygosity code of each call.
+        """
+        self.variants = variants
+        self.samples = list(samples)
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    def __len__(self):
+        return len(self.variants)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    @classmethod
+    def empty(cls):
+        """
+        Creates a DB with no variants and no samples.
+        """
+        return cls(
+            pd.DataFrame(
+                {
+                    x: pd.Series(dtype="int64" if x == "POS" else object)
+                    for x in VARIANT_COLS
+                }
+            ),
+            [],
+            np.zeros(1, dtype=np.int64),
+            np.array([], dtype=np.int32),
+            np.array([], dtype=np.int8),
+        )
+
+    @classmethod
+    def from_variantsdb(cls, db, chunksize=100000):
+        """
+        Builds a SparseVarDB from a (wide) VariantsDB.
+
+        Parameters
+        ----------
+        db : VariantsDB
+            Variants DB, indexed by VARIANT_COLS with one column per patient.
+        chunksize : int, optional
+            Number of variants encoded at once, bounds the memory used by the
+            dense zygosity matrix of each chunk.
+
+        Returns
+        -------
+        SparseVarDB
+        """
+        samples = [x for x in db.columns if x not in FREQ_COLS + COUNT_COLS]
+        variants = db.index.to_frame(index=False)
+        counts = []
+        indices = []
+        data = []
+        for start in range(0, len(db), chunksize):
+            zigosity = encode_zygosity(
+                db[samples].iloc[start : start + chunksize].to_numpy(dtype=object)
+            )
+            rows, cols = np.nonzero(zigosity)
+            counts.append(np.bincount(rows, minlength=len(zigosity)))
+            indices.append(cols.astype(np.int32))
+            data.append(zigosity[rows, cols])
+        indptr = np.zeros(len(db) + 1, dtype=np.int64)
+        if counts:
+            np.cumsum(np.concatenate(counts), out=indptr[1:])
+            indices = np.concatenate(indices)
+            data = np.concatenate(data)
+        else:
+            indices = np.array([], dtype=np.int32)
+            data = np.array([], dtype=np.int8)
+        return cls(variants, samples, indptr, indices, data)
+
+    @classmethod
+    def from_sparsedb(cls, path, mmap=True):
+        """
+        Loads a SparseVarDB from disk.
+
+        Parameters
+        ----------
+        path : str
+            Directory the DB was saved to.
+        mmap : bool, optional
+            Memory map the CSR arrays instead of reading them.
+
+        Returns
+        -------
+        SparseVarDB
+        """
+        if not os.path.isdir(path):
+            logger.error("Path to sparse DB incorrect.")
+            raise FileNotFoundError(path)
+        mmap_mode = "r" if mmap else None
+        variants = pd.read_parquet(os.path.join(path, "variants.parquet"))
+        samples = pd.read_csv(os.path.join(path, "samples.csv"), dtype=str)["SAMPLE"]
+        return cls(
+            variants,
+            samples.tolist(),
+            np.load(os.path.join(path, "indptr.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, "indices.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, "data.npy"), mmap_mode=mmap_mode),
+        )
+
+    def to_sparsedb(self, path):
+        """
+        Saves the DB to the `path` directory.
+
+        Each file is written to a temporary file and then moved in place, so
+        a DB memory mapped from the same directory can be saved back.
+        """
+        logger.info("Writing sparse DB to %s" % path)
+        os.makedirs(path, exist_ok=True)
+
+        def save(name, writer):
+            tmp = os.path.join(path, "tmp." + name)
+            writer(tmp)
+            os.replace(tmp, os.path.join(path, name))
+
+        save("variants.parquet", lambda x: self.variants.to_parquet(x, index=False))
+        save(
+            "samples.csv",
+            lambda x: pd.Series(self.samples, name="SAMPLE").to_csv(x, index=False),
+        )
+        for name in ["indptr", "indices", "data"]:
+            array = np.asarray(getattr(self, name))
+            save(name + ".npy", lambda x: np.save(x, array))
+
+    def _call_rows(self):
+        """
+        Returns the variant (row) index of each stored call.
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.indptr))
+
+    def calcfreqs(self):
+        """
+        Calculates variant and allele frequencies from the stored calls.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The variant index table with ALLELE_FREQ, FREQ, N_ALLELES and
+            N_CARRIERS columns.
+        """
+        logger.info("Calculating Variant Frequencies")
+        nsamples = len(self.samples)
+        carriers = np.diff(self.indptr)
+        alleles = np.bincount(
+            self._call_rows(), weights=DOSAGE[self.data], minlength=len(self)
+        ).astype(np.int64)
+        freqs = self.variants.copy()
+        freqs["ALLELE_FREQ"] = alleles / (nsamples * 2)
+        freqs["FREQ"] = carriers / nsamples
+        freqs["N_ALLELES"] = alleles
+        freqs["N_CARRIERS"] = carriers
+        return freqs
+
+    def add_samples(self, names, calls, new_variants=None):
+        """
+        Adds the calls of new samples, as new last columns of the matrix.
+
+        The CSR arrays are rebuilt in a single pass: existing calls are moved
+        to their new offsets and the calls of the new samples are placed after
+        them in their rows, in sample order, so sample indices stay sorted
+        within each row. The cost is proportional to the number of stored
+        calls, not to variants x samples, and is paid once for all the new
+        samples.
+
+        Parameters
+        ----------
+        names : list of str
+            Sample names.
+        calls : list of tuple
+            Rows and int8 zygosity codes (two arrays) of the calls of each
+            sample. Rows refer to the variants once `new_variants` are
+            appended, and are unique within a sample.
+        new_variants : pandas.DataFrame, optional
+            Variants not in the DB yet, with VARIANT_COLS columns, appended as
+            new rows.
+
+        Returns
+        -------
+        SparseVarDB
+            A new DB, the arrays of this one are not modified.
+        """
+        variants = self.variants
+        if new_variants is not None and len(new_variants) > 0:
+            variants = pd.concat(
+                [variants, new_variants[VARIANT_COLS]], ignore_index=True
+            )
+        nvariants = len(variants)
+        rows = np.concatenate(
+            [np.zeros(0, dtype=np.int64)] + [np.asarray(x[0]) for x in calls]
+        ).astype(np.int64)
+        codes = np.concatenate(
+            [np.zeros(0, dtype=np.int8)] + [np.asarray(x[1]) for x in calls]
+        ).astype(np.int8)
+        samples = np.repeat(
+            np.arange(len(self.samples), len(self.samples) + len(names)),
+            [len(x[0]) for x in calls],
+        ).astype(np.int32)
+        called = codes != ZYG_NOCALL
+        order = np.lexsort((samples[called], rows[called]))
+        rows = rows[called][order]
+        codes = codes[called][order]
+        samples = samples[called][order]
+
+        old_counts = np.zeros(nvariants, dtype=np.int64)
+        old_counts[: len(self)] = np.diff(self.indptr)
+        new_counts = np.bincount(rows, minlength=nvariants)
+        indptr = np.zeros(nvariants + 1, dtype=np.int64)
+        np.cumsum(old_counts + new_counts, out=indptr[1:])
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        data = np.empty(indptr[-1], dtype=np.int8)
+        call_rows = self._call_rows()
+        offsets = indptr[call_rows] + (
+            np.arange(self.nnz, dtype=np.int64) - self.indptr[call_rows]
+        )
+        indices[offsets] = self.indices
+        data[offsets] = self.data
+        # rank of each new call among the new calls of its row
+        ranks = np.arange(len(rows)) - (np.cumsum(new_counts) - new_counts)[rows]
+        offsets = indptr[rows] + old_counts[rows] + ranks
+        indices[offsets] = samples
+        data[offsets] = codes
+        return type(self)(variants, self.samples + list(names), indptr, indices, data)
+
+    def get_carriers(self, rows):
+        """
+        Returns the samples carrying each of the given variants.
+
+        Parameters
+        ----------
+        rows : array-like of int
+            Positions of the variants in the variant index table.
+
+        Returns
+        -------
+        list of list of str
+        """
+        samples = np.asarray(self.samples, dtype=object)
+        return [
+            samples[self.indices[self.indptr[x] : self.indptr[x + 1]]].tolist()
+            for x in rows
+        ]
+
+    def to_dense(self):
+        """
+        Expands the calls to a wide DataFrame with one column per sample,
+        indexed by VARIANT_COLS, with "." for missing calls and the
+        frequencies and counts as first columns, as a VariantsDB holds them.
+        """
+        calls = np.full(
+            (len(self), len(self.samples)), DECODE[ZYG_NOCALL], dtype=object
+        )
+        calls[self._call_rows(), self.indices] = DECODE[self.data]
+        dense = pd.DataFrame(
+            calls,
+            index=pd.MultiIndex.from_frame(self.variants[VARIANT_COLS]),
+            columns=self.samples,
+        )
+        freqs = self.calcfreqs()
+        for col in ["N_CARRIERS", "N_ALLELES", "FREQ", "ALLELE_FREQ"]:
+            dense.insert(0, col, freqs[col].to_numpy())
+        return dense
@@ -0,0 +1,99 @@
+"""
+Fingerprints of pipeline steps, used to skip the steps whose output is current.
+
+When a step finishes, the fingerprint of its command line (which includes the
+path of the versioned tool) and of the files it reads is written to a json
+sidecar next to its output. On reruns, a step is skipped if its output exists
+and the fingerprint of its command and inputs still matches the sidecar.
+Reruns after a failure in a late step resume from the failed step.
+"""
+import hashlib
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_SUFFIX = ".fingerprint.json"
+# Inputs up to this size are fingerprinted by checksum, bigger ones (BAMs,
+# references) by size and mtime.
+CHECKSUM_MAX_SIZE = 16 * 1024**2
+
+
+def command_files(cmd, output=None):
+    """
+    Returns the existing files in a command line (tool, reference and
+    inputs), except its output.
+    """
+    files = []
+    for word in cmd:
+        word = word.split("=", 1)[-1]
+        if word != output and word not in files and os.path.isfile(word):
+            files.append(word)
+    return files
+
+
+def _file_state(path):
+    stat = os.stat(path)
+    if stat.st_size <= CHECKSUM_MAX_SIZE:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024**2), b""):
+                sha.update(block)
+        return {"size": stat.st_size, "sha256": sha.hexdigest()}
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def fingerprint(cmd, inputs):
+    """
+    Fingerprints a step from its command line and the state of its inputs.
+
+    Parameters
+    ----------
+    cmd : list of str
+        Command line of the step.
+    inputs : list of str
+        Paths to the input files of the step.
+
+    Returns
+    -------
+    dict
+        Command, state of each input and a sha256 digest of both.
+    """
+    record = {
+        "command": list(cmd),
+        "inputs": {path: _file_state(path) for path in inputs},
+    }
+    digest = hashlib.sha256(json.dumps(record, sort_keys=True).encode())
+    record["fingerprint"] = digest.hexdigest()
+    return record
+
+
+def sidecar_path(output):
+    return output + SIDECAR_SUFFIX
+
+
+def is_current(record, output):
+    """
+    Checks whether `output` exists and was made by a step with the same
+    fingerprint as `record`.
+    """
+    sidecar = sidecar_path(output)
+    if not (os.path.exists(output) and os.path.exists(sidecar)):
+        return False
+    try:
+        with open(sidecar) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        logger.warning("Ignoring unreadable fingerprint %s" % sidecar)
+        return False
+    return previous.get("fingerprint") == record["fingerprint"]
+
+
+def write_fingerprint(record, output):
+    """
+    Writes the fingerprint of the step that made `output` to its sidecar.
+    """
+    with open(sidecar_path(output), "w") as f:
+        json.dump(record, f, indent=2, sort_keys=True)
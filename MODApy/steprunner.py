@@ -0,0 +1,347 @@
+"""
+Asynchronous execution of the processes of pipeline steps.
+
+The processes of a step (several, when steps are streamed) are watched by an
+asyncio event loop that reads their stderr, and their stdout when it does
+not go to a file, as it is written. The output of verbose tools is logged
+line by line while they run instead of being held until they exit, and only
+the last lines of each stream are kept in memory, for error reports.
+
+Steps can declare a timeout, and are killed when they exceed it or when their
+run is cancelled. The state of the steps of a run is published by a
+RunMonitor, which also stores it in the meta of the rq job running the
+pipeline, so the API can poll it.
+"""
+import asyncio
+import collections
+import logging
+import os
+import signal
+import threading
+import time
+from collections import OrderedDict
+
+from MODApy import profiling
+
+from rq import get_current_job
+
+
+logger = logging.getLogger(__name__)
+
+# bytes read from a stream at a time, and longest line kept (longer lines
+# are truncated)
+CHUNK_SIZE = 64 * 1024
+MAX_LINE = 8 * 1024
+# lines of each stream kept for error reports
+TAIL_LINES = 50
+# seconds between checks of timeouts and cancellation
+POLL_INTERVAL = 1.0
+# seconds between SIGTERM and SIGKILL of a stopped step
+KILL_GRACE = 10.0
+DURATION_UNITS = {"S": 1, "M": 60, "H": 3600, "D": 86400}
+CANCEL_KEY = "modapy:cancel:%s"
+
+
+def parse_duration(value):
+    """
+    Parses a duration into seconds.
+
+    Parameters
+    ----------
+    value : int, float or str
+        Seconds, or a string with a s, m, h or d suffix (e.g. "90m", "2h").
+        None or an empty string mean no duration.
+
+    Returns
+    -------
+    float or None
+        Duration in seconds.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = str(value).strip().upper()
+    if value and value[-1] in DURATION_UNITS:
+        return float(value[:-1]) * DURATION_UNITS[value[-1]]
+    return float(value)
+
+
+def watch_processes(procs, on_line=None, timeout=None, cancelled=None):
+    """
+    Waits for running processes while their output is logged.
+
+    Parameters
+    ----------
+    procs : list of subprocess.Popen
+        Processes, started in their own session (start_new_session=True) with
+        stderr (and stdout, if it must be read) as binary pipes.
+    on_line : callable, optional
+        Called with the index of the process, the stream name ("stdout" or
+        "stderr") and each line of output, as it is written.
+    timeout : float, optional
+        Seconds after which the processes are killed.
+    cancelled : callable, optional
+        Polled while the processes run. The processes are killed when it
+        returns True.
+
+    Returns
+    -------
+    list of dict
+        Resource usage, end time and last stderr lines ("usage", "end" and
+        "tail") of each process.
+    str or None
+        "timeout" or "cancelled" if the processes were killed, None otherwise.
+    """
+    return asyncio.run(_watch(procs, on_line, timeout, cancelled))
+
+
+def _reap(proc):
+    usage = profiling.wait_profiled(proc)
+    return usage, time.time()
+
+
+def _signal(procs, signum):
+    # os.killpg rather than Popen.send_signal, which may reap the process
+    # before wait_profiled gets its usage. The whole group is signalled, so
+    # wrappers (e.g. gatk launching java) do not leave their tools running.
+    for proc in procs:
+        if proc.returncode is None:
+            try:
+                os.killpg(proc.pid, signum)
+            except ProcessLookupError:
+                pass
+
+
+async def _watch(procs, on_line, timeout, cancelled):
+    loop = asyncio.get_running_loop()
+    tails = [collections.deque(maxlen=TAIL_LINES) for _ in procs]
+    pumps = []
+    for i, proc in enumerate(procs):
+        for name in ("stdout", "stderr"):
+            pipe = getattr(proc, name)
+            # pipes between streamed steps are read by the next process
+            if pipe is not None and not pipe.closed:
+                tail = tails[i] if name == "stderr" else None
+                pumps.append(asyncio.ensure_future(_pump(pipe, i, name, on_line, tail)))
+    waits = [loop.run_in_executor(None, _reap, proc) for proc in procs]
+    deadline = None if timeout is None else time.monotonic() + timeout
+    reason = None
+    while not all(wait.done() for wait in waits):
+        await asyncio.wait(waits, timeout=POLL_INTERVAL)
+        if reason is not None or all(wait.done() for wait in waits):
+            continue
+        if deadline is not None and time.monotonic() > deadline:
+            reason = "timeout"
+        elif cancelled is not None and cancelled():
+            reason = "cancelled"
+        if reason is not None:
+            logger.warning("Stopping processes (%s)" % reason)
+            _signal(procs, signal.SIGTERM)
+            loop.call_later(KILL_GRACE, _signal, procs, signal.SIGKILL)
+    if pumps:
+        # children left behind by a tool may keep its pipes open
+        _, left = await asyncio.wait(pumps, timeout=KILL_GRACE)
+        for pump in left:
+            pump.cancel()
+    results = []
+    for wait, tail in zip(waits, tails):
+        usage, end = wait.result()
+        results.append({"usage": usage, "end": end, "tail": list(tail)})
+    return results, reason
+
+
+async def _pump(pipe, index, name, on_line, tail):
+    """
+    Reads a pipe in chunks and passes on its lines, so memory use is bounded
+    by CHUNK_SIZE whatever the volume of output.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=CHUNK_SIZE)
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe
+    )
+
+    def emit(line):
+        line = line[:MAX_LINE].decode(errors="replace").rstrip("\r")
+        if tail is not None:
+            tail.append(line)
+        if on_line is not None:
+            on_line(index, name, line)
+
+    partial = b""
+    # set once the start of a line longer than MAX_LINE has been passed on,
+    # the rest of the line is dropped up to its newline
+    discarding = False
+    try:
+        while True:
+            chunk = await reader.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            lines = (partial + chunk).split(b"\n")
+            partial = lines.pop()
+            if discarding:
+                if not lines:
+                    partial = b""
+                    continue
+                lines.pop(0)
+                discarding = False
+            if len(partial) > MAX_LINE:
+                lines.append(partial)
+                partial = b""
+                discarding = True
+            for line in lines:
+                emit(line)
+        if partial:
+            emit(partial)
+    finally:
+        transport.close()
+
+
+class RunMonitor(object):
+    """
+    State of the steps of a pipeline run, and cancellation requests for it.
+
+    Each change of state is an event, kept in a bounded list of recent events
+    and passed to `callback` as a snapshot of the run. The last output line of
+    each running step is also in the snapshots, which are published at most
+    every `interval` seconds for output alone.
+
+    Parameters
+    ----------
+    pipeline : str
+        Name of the pipeline.
+    patient : str
+        Name of the patient.
+    callback : callable, optional
+        Called with each snapshot (see `snapshot`).
+    cancel : callable, optional
+        Returns True once the run must be cancelled. Checked at most every
+        `interval` seconds.
+    interval : float, optional
+        Seconds between output snapshots and cancellation checks.
+    events : int, optional
+        Recent events kept.
+    """
+
+    def __init__(
+        self, pipeline, patient, callback=None, cancel=None, interval=2.0, events=100
+    ):
+        self.pipeline = pipeline
+        self.patient = patient
+        self.status = "running"
+        self.steps = OrderedDict()
+        self.output = {}
+        self.events = collections.deque(maxlen=events)
+        self.callback = callback
+        self.cancel = cancel
+        self.interval = interval
+        self._cancelled = False
+        self._checked = 0.0
+        self._published = 0.0
+        self._lock = threading.Lock()
+
+    def start(self, steps):
+        """Registers the steps of the run as pending."""
+        with self._lock:
+            for step in steps:
+                self.steps[step] = "pending"
+        self._publish(force=True)
+
+    def publish(self, step, status, **fields):
+        """
+        Records a change of state of a step (running, completed, skipped,
+        failed, timeout or cancelled).
+        """
+        event = dict(time=time.time(), step=step, status=status, **fields)
+        with self._lock:
+            self.steps[step] = status
+            self.events.append(event)
+            if status != "running":
+                self.output.pop(step, None)
+        self._publish(force=True)
+
+    def line(self, step, line):
+        """Records the last output line of a running step."""
+        with self._lock:
+            self.output[step] = line
+        self._publish()
+
+    def finish(self, status):
+        """Records the final status of the run."""
+        with self._lock:
+            self.status = status
+        self._publish(force=True)
+
+    def cancelled(self):
+        """Whether the run was cancelled."""
+        if self.cancel is None or self._cancelled:
+            return self._cancelled
+        now = time.monotonic()
+        if now - self._checked >= self.interval:
+            self._checked = now
+            self._cancelled = bool(self.cancel())
+        return self._cancelled
+
+    def snapshot(self):
+        """
+        Returns the state of the run: its status, the status of each step, the
+        last output line of the running steps and the recent events.
+        """
+        with self._lock:
+            done = sum(x in ("completed", "skipped") for x in self.steps.values())
+            return {
+                "pipeline": self.pipeline,
+                "patient": self.patient,
+                "status": self.status,
+                "completed": done,
+                "total": len(self.steps),
+                "steps": dict(self.steps),
+                "output": dict(self.output),
+                "events": list(self.events),
+            }
+
+    def _publish(self, force=False):
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._published < self.interval:
+            return
+        self._published = now
+        try:
+            self.callback(self.snapshot())
+        except Exception as error:
+            logger.warning("Progress could not be published: %s" % error)
+
+
+_job_lock = threading.Lock()
+
+
+def job_monitor(pipeline, patient):
+    """
+    Returns a RunMonitor for a pipeline run. If it runs in an rq job, its
+    snapshots are stored in the job meta under "progress" (by patient, so
+    batches keep every sample) and it is cancelled by `request_cancel`.
+    """
+    job = get_current_job()
+    if job is None:
+        return RunMonitor(pipeline, patient)
+
+    def store(snapshot):
+        with _job_lock:
+            job.meta.setdefault("progress", {})[patient] = snapshot
+            job.save_meta()
+
+    def cancel():
+        return bool(job.connection.exists(CANCEL_KEY % job.id))
+
+    return RunMonitor(pipeline, patient, callback=store, cancel=cancel)
+
+
+def request_cancel(connection, job_id, expire=7 * 86400):
+    """
+    Asks the pipelines running in an rq job to stop. The request is a
+    separate redis key, so the job can not overwrite it when it saves its
+    progress.
+    """
+    connection.set(CANCEL_KEY % job_id, 1, ex=expire)
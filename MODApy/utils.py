@@ -1,24 +1,84 @@
 import logging
 import os
 
+import numpy as np
+
+import pandas as pd
+
 logger = logging.getLogger(__name__)
 
+# int8 codes used to store zygosity in genotype matrices
+ZYG_NOCALL = 0
+ZYG_HET = 1
+ZYG_HOM = 2
+ZYG_UNKWN = 3
+
+# Accepted VCF extensions, plain, gzip or bgzip (BGZF) compressed
+VCF_EXTENSIONS = (".vcf", ".vcf.gz", ".vcf.bgz")
+
 
 class InvalidFileError(Exception):
     pass
 
 
 def checkFile(filePath, extension):
+    """
+    Checks that `filePath` exists and has the given extension.
+
+    Parameters
+    ----------
+    filePath : str
+        Path to the file.
+    extension : str or tuple of str
+        Accepted extension/s. Compound extensions (e.g. ".vcf.gz") are matched
+        against the end of the path, simple ones against its last extension.
+
+    Returns
+    -------
+    bool
+        True if the file is valid, InvalidFileError is raised otherwise.
+    """
+    extensions = (extension,) if isinstance(extension, str) else tuple(extension)
     if os.path.isfile(filePath):
         fileName, fileExtension = os.path.splitext(filePath)
-        if extension == fileExtension:
-            return True
+        for ext in extensions:
+            if ext.count(".") > 1:
+                if filePath.endswith(ext):
+                    return True
+            elif ext == fileExtension:
+                return True
     error = f"""{filePath} couldn't be found. "
-    Please check if the file exists and that its extension is {extension}"""
+    Please check if the file exists and that its extension is \
+{" or ".join(extensions)}"""
     logger.error(error)
     raise InvalidFileError(error)
 
 
+def is_bgzf(filePath):
+    """
+    Checks if a file is BGZF compressed (e.g. by bgzip), reading the gzip
+    header of its first block.
+
+    Parameters
+    ----------
+    filePath : str
+        Path to the file.
+
+    Returns
+    -------
+    bool
+        True for BGZF files, False for plain gzip or uncompressed files.
+    """
+    with open(filePath, "rb") as f:
+        header = f.read(16)
+    # gzip magic, deflate, FEXTRA flag and the "BC" extra subfield
+    return (
+        len(header) == 16
+        and header[:4] == b"\x1f\x8b\x08\x04"
+        and header[12:14] == b"BC"
+    )
+
+
 def aminoChange(value: str):
     """
     Given a string `value`, extract the amino acid change from the
@@ -58,3 +118,38 @@ def divide(x, y):
         return float(x) / y
     except Exception:
         return x
+
+
+def encode_zygosity(values, return_missing=False):
+    """
+    Encodes a matrix of zygosity strings as a matrix of int8 codes.
+
+    Parameters
+    ----------
+    values : array-like
+        Zygosity calls, as found in the patient columns of the variants DB
+        ("HOM", "HET", "UNKWN", "." or NaN).
+    return_missing : bool, optional
+        Also return a boolean mask of the missing (NaN/None) values.
+
+    Returns
+    -------
+    numpy.ndarray
+        int8 array with the same shape as `values`, holding ZYG_HOM, ZYG_HET,
+        ZYG_UNKWN for any other call, or ZYG_NOCALL for "." and missing
+        values.
+    numpy.ndarray
+        The missing values mask, only if `return_missing` is True.
+    """
+    values = np.asarray(values, dtype=object)
+    # Calls take a handful of distinct values, so the strings are hashed once
+    # and every cell is then encoded with a lookup table.
+    labels, uniques = pd.factorize(values.ravel())
+    codes = {".": ZYG_NOCALL, "HET": ZYG_HET, "HOM": ZYG_HOM}
+    lut = np.array(
+        [codes.get(x, ZYG_UNKWN) for x in uniques] + [ZYG_NOCALL], dtype=np.int8
+    )
+    zigosity = lut[labels].reshape(values.shape)
+    if return_missing:
+        return zigosity, (labels == -1).reshape(values.shape)
+    return zigosity
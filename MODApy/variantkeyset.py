@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+
+from MODApy.varkey import variant_keys
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Version of the key encoding, bumped when MODApy.varkey keys change
+KEYSET_VERSION = 1
+
+
+def default_keyset_path(dbpath):
+    """
+    Returns the path of the variant key set that goes along a variants DB.
+
+    Parameters
+    ----------
+    dbpath : str
+        Path to the variants DB.
+
+    Returns
+    -------
+    str
+        Path to the key set, next to the DB.
+    """
+    return os.path.splitext(dbpath.rstrip("/"))[0] + "_keys.npy"
+
+
+def _meta_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+class VariantKeySet(object):
+    """
+    Membership set of the variants in a variants DB.
+
+    Holds the sorted, unique, 64 bit keys (see `MODApy.varkey`)
+    of the DB variants, 8 bytes per variant. Saved as a .npy file, it is
+    memory mapped when loaded, so checking which variants of a report are in
+    the cohort touches only the pages binary search visits, without loading
+    the DB.
+
+    A JSON file saved next to the keys records the key encoding version and
+    a fingerprint of the DB files the keys were taken from, so a key set that
+    no longer matches its DB is not used (see `load_matching`).
+    """
+
+    def __init__(self, keys):
+        """
+        Initializes a VariantKeySet object.
+
+        Parameters
+        ----------
+        keys : numpy.ndarray
+            Sorted and unique uint64 variant keys.
+        """
+        self.keys = keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_variants(cls, variants):
+        """
+        Builds the key set of a DataFrame with CHROM, POS, REF and ALT columns.
+        """
+        return cls(np.unique(variant_keys(variants)))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads a key set saved with `save`.
+
+        Parameters
+        ----------
+        path : str
+            Path to the key set.
+        mmap : bool, optional
+            Memory map the keys instead of reading them.
+
+        Returns
+        -------
+        VariantKeySet
+        """
+        if not os.path.isfile(path):
+            logger.error("Path to variant key set incorrect.")
+            raise FileNotFoundError(path)
+        return cls(np.load(path, mmap_mode="r" if mmap else None))
+
+    @classmethod
+    def load_matching(cls, path, fingerprint, mmap=True):
+        """
+        Loads a key set only if it was saved with the current key encoding
+        and from the DB files `fingerprint` identifies.
+
+        Parameters
+        ----------
+        path : str
+            Path to the key set.
+        fingerprint : str
+            Fingerprint of the DB files, as passed to `save`.
+        mmap : bool, optional
+            Memory map the keys instead of reading them.
+
+        Returns
+        -------
+        VariantKeySet
+            None if there is no key set, or it does not match.
+        """
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(_meta_path(path)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            logger.warning("Variant key set %s has no valid metadata" % path)
+            return None
+        if meta.get("version") != KEYSET_VERSION:
+            logger.warning("Variant key set %s has an old key encoding" % path)
+            return None
+        if meta.get("fingerprint") != fingerprint:
+            logger.warning("Variant key set %s does not match its DB" % path)
+            return None
+        return cls.load(path, mmap=mmap)
+
+    def save(self, path, fingerprint=None):
+        """
+        Saves the key set to `path`, and its metadata (the key encoding version
+        and `fingerprint`, which identifies the DB files the keys were taken
+        from) to a JSON file next to it.
+        """
+        logger.info("Writing variant key set to %s" % path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # np.save appends .npy to paths without it
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, np.asarray(self.keys, dtype=np.uint64))
+        with open(_meta_path(path) + ".tmp", "w") as f:
+            json.dump({"version": KEYSET_VERSION, "fingerprint": fingerprint}, f)
+        os.replace(path + ".tmp", path)
+        os.replace(_meta_path(path) + ".tmp", _meta_path(path))
+
+    def contains(self, variants):
+        """
+        Checks which of the given variants are in the set.
+
+        Parameters
+        ----------
+        variants : pandas.DataFrame
+            DataFrame with CHROM, POS, REF and ALT columns.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean array, True for the variants in the set.
+        """
+        keys = variant_keys(variants)
+        if len(self.keys) == 0:
+            return np.zeros(len(keys), dtype=bool)
+        positions = np.searchsorted(self.keys, keys)
+        positions[positions == len(self.keys)] = 0
+        return np.asarray(self.keys[positions] == keys)
@@ -1,20 +1,191 @@
 import glob
+import hashlib
+import json
 import logging
+import multiprocessing as mp
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 from MODApy.cfg import configuration
+from MODApy.patientcatalog import get_catalog
+from MODApy.sparsevardb import (
+    COUNT_COLS,
+    DOSAGE,
+    FREQ_COLS,
+    VARIANT_COLS,
+    SparseVarDB,
+)
+from MODApy.utils import (
+    VCF_EXTENSIONS,
+    ZYG_HET,
+    ZYG_HOM,
+    ZYG_NOCALL,
+    encode_zygosity,
+)
+from MODApy.variantkeyset import VariantKeySet, default_keyset_path
+from MODApy.varkey import variant_keys
 from MODApy.vcfmgr import ParsedVCF
 
-import cyvcf2
-
 import numpy as np
 
 import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+VARIANT_KEYS = ["CHROM", "POS", "REF", "ALT"]
+DB_DTYPES = {
+    "CHROM": str,
+    "POS": "int64",
+    "REF": str,
+    "ALT": str,
+    "GENE_NAME": str,
+    "HGVS.C": str,
+    "HGVS.P": str,
+    "FREQ": "float64",
+    "ALLELE_FREQ": "float64",
+    "N_CARRIERS": "int64",
+    "N_ALLELES": "int64",
+}
+
+
+def _shard_files(dbpath, chroms=None):
+    """
+    Lists the per chromosome shards of a DB.
+
+    Shards are named after the DB file followed by the chromosome, e.g.
+    variantsDB1.csv or variantsDBX.csv for variantsDB.csv.
+
+    Parameters
+    ----------
+    dbpath : str
+        DB path.
+    chroms : list of str, optional
+        Chromosomes to keep. If None, all the shards are returned.
+
+    Returns
+    -------
+    list of str
+    """
+    prefix, ext = os.path.splitext(os.path.basename(dbpath))
+    pattern = os.path.join(os.path.dirname(dbpath), glob.escape(prefix) + "*" + ext)
+    if chroms is not None:
+        chroms = {str(x) for x in chroms}
+    shards = []
+    for f in sorted(glob.glob(pattern)):
+        chrom = os.path.splitext(os.path.basename(f))[0][len(prefix) :]
+        if chrom and (chroms is None or chrom in chroms):
+            shards.append(f)
+    return shards
+
+
+def _db_fingerprint(dbpath):
+    """
+    Fingerprints the files of a DB (the files of a sparse DB directory, or the
+    shards and manifest of the other formats) by name, size and modification
+    time.
+
+    Returns
+    -------
+    str
+        None if the DB has no files.
+    """
+    if os.path.isdir(dbpath):
+        files = sorted(glob.glob(os.path.join(dbpath, "*")))
+    else:
+        files = _shard_files(dbpath) + glob.glob(_manifest_path(dbpath))
+    if not files:
+        return None
+    digest = hashlib.sha1()
+    for f in files:
+        stat = os.stat(f)
+        digest.update(
+            "{}:{}:{}\n".format(
+                os.path.basename(f), stat.st_size, stat.st_mtime_ns
+            ).encode()
+        )
+    return digest.hexdigest()
+
 
-# TODO: FIND A MORE EFFICIENT WAY TO SUM EMPTY
+def _manifest_path(dbpath):
+    return dbpath.rsplit(".", maxsplit=1)[0] + "_manifest.json"
+
+
+def _checkpoint_path(dbpath):
+    return dbpath.rsplit(".", maxsplit=1)[0] + "_checkpoint.json"
+
+
+def _read_checkpoint(dbpath):
+    """
+    Reads the buildDB checkpoint of a DB, with the patients ingested in the
+    saved DB (name: vcf path) and the vcfs that could not be parsed.
+    """
+    if not os.path.isfile(_checkpoint_path(dbpath)):
+        return {"ingested": {}, "failed": {}}
+    with open(_checkpoint_path(dbpath)) as f:
+        return json.load(f)
+
+
+def _write_checkpoint(dbpath, checkpoint):
+    os.makedirs(os.path.dirname(os.path.abspath(dbpath)), exist_ok=True)
+    with open(_checkpoint_path(dbpath) + ".tmp", "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(_checkpoint_path(dbpath) + ".tmp", _checkpoint_path(dbpath))
+
+
+def _parse_patient(vcf):
+    """
+    Parses a patient vcf in a buildDB worker process.
+
+    Only the columns the DB needs are sent back to the merge process, and
+    parsing errors are returned instead of raised so a bad file does not stop
+    the build.
+
+    Returns
+    -------
+    tuple
+        vcf path, patient name, calls DataFrame (VARIANT_COLS and ZIGOSITY) and
+        error message, None if parsing succeeded.
+    """
+    try:
+        pvcf = ParsedVCF.from_vcf(vcf)
+        calls = pd.DataFrame(
+            pvcf[[x for x in VARIANT_COLS + ["ZIGOSITY"] if x in pvcf.columns]]
+        )
+        if "ZIGOSITY" not in calls.columns:
+            calls["ZIGOSITY"] = "UNKWN"
+        return vcf, pvcf.name, calls, None
+    # ParsedVCF.from_vcf exits on unreadable files
+    except (Exception, SystemExit) as e:
+        return vcf, None, None, "{}: {}".format(type(e).__name__, e)
+
+
+def _read_shards(reader, files):
+    """
+    Reads the DB shards concurrently, using up to the configured cores.
+    """
+    workers = min(len(files), int(configuration.cfg["GENERAL"]["cores"]))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return list(executor.map(reader, files))
+
+
+def _read_csv_shard(path, columns=None):
+    header = pd.read_csv(path, nrows=0).columns
+    if columns is not None:
+        header = [x for x in header if x in columns]
+    dtype = {k: v for k, v in DB_DTYPES.items() if k in header}
+    try:
+        return pd.read_csv(path, usecols=columns, dtype=dtype, engine="pyarrow")
+    # pyarrow is not installed (ImportError), or can not parse the shard or
+    # honour the options (ValueError, which pyarrow's ArrowInvalid and pandas'
+    # ParserError derive from)
+    except (ImportError, ValueError) as e:
+        logger.debug("Reading %s with the C parser: %s" % (path, e))
+        return pd.read_csv(path, usecols=columns, dtype=dtype)
+
+
+def _read_excel_shard(path, columns=None):
+    return pd.read_excel(path, usecols=columns, dtype=DB_DTYPES)
 
 
 class VariantsDB(pd.DataFrame):
@@ -23,13 +194,33 @@ class VariantsDB(pd.DataFrame):
         return VariantsDB
 
     @classmethod
-    def from_exceldb(cls, excelpath):
-        if os.path.exists(excelpath):
+    def from_exceldb(cls, excelpath, columns=None, chroms=None):
+        """
+        Loads a DB stored as one Excel file per chromosome.
+
+        Shards are read concurrently and key and frequency columns get their
+        dtypes while parsing.
+
+        Parameters
+        ----------
+        excelpath : str
+            DB path, shards are named after it (see `_shard_files`).
+        columns : list of str, optional
+            Columns to read. If None, all columns are read.
+        chroms : list of str, optional
+            Chromosomes to load. If None, the whole DB is loaded.
+
+        Returns
+        -------
+        VariantsDB
+            None if there are no shards to read.
+        """
+        if os.path.isdir(os.path.dirname(os.path.abspath(excelpath))):
             try:
-                files = [f for f in glob.glob(excelpath + "/*.xls*")]
+                files = _shard_files(excelpath, chroms)
                 if len(files) == 0:
                     return None
-                dfs = [pd.read_excel(x) for x in files]
+                dfs = _read_shards(partial(_read_excel_shard, columns=columns), files)
                 db = pd.concat(dfs, sort=True)
                 del files
                 del dfs
@@ -49,13 +240,33 @@ class VariantsDB(pd.DataFrame):
         return db
 
     @classmethod
-    def from_csvdb(cls, csvpath, columns=None):
-        if os.path.exists(csvpath):
+    def from_csvdb(cls, csvpath, columns=None, chroms=None):
+        """
+        Loads a DB stored as one CSV file per chromosome.
+
+        Shards are read concurrently and key and frequency columns get their
+        dtypes while parsing.
+
+        Parameters
+        ----------
+        csvpath : str
+            DB path, shards are named after it (see `_shard_files`).
+        columns : list of str, optional
+            Columns to read. If None, all columns are read.
+        chroms : list of str, optional
+            Chromosomes to load. If None, the whole DB is loaded.
+
+        Returns
+        -------
+        VariantsDB
+            None if there are no shards to read.
+        """
+        if os.path.isdir(os.path.dirname(os.path.abspath(csvpath))):
             try:
-                files = [f for f in glob.glob(csvpath + "/*.csv")]
+                files = _shard_files(csvpath, chroms)
                 if len(files) == 0:
                     return None
-                dfs = [pd.read_csv(x, usecols=columns) for x in files]
+                dfs = _read_shards(partial(_read_csv_shard, columns=columns), files)
                 db = pd.concat(dfs, sort=True)
                 del files
                 del dfs
@@ -75,186 +286,334 @@ class VariantsDB(pd.DataFrame):
         return db
 
     @classmethod
-    def buildDB(cls):
-        def patientLister(db=None):
-            vcfspath = []
-            for dirpath, dirnames, filenames in os.walk(configuration.patientPath):
-                for filename in [
-                    f for f in filenames if f.lower().endswith("final.vcf")
-                ]:
-                    vcfspath.append(os.path.join(dirpath, filename))
-            final_list = []
-            for idx in range(len(vcfspath)):
-                splitfn = vcfspath[idx].rsplit("/", maxsplit=1)[-1]
-                if "_MODApy" in splitfn:
-                    if not (any(splitfn in string for string in final_list)):
-                        final_list.append(vcfspath[idx])
-                else:
-                    if not (
-                        any(
-                            splitfn.strip(".final.vcf") in string
-                            for string in final_list
-                        )
-                    ):
-                        final_list.append(vcfspath[idx])
-            for x in final_list:
-                fn = x.rsplit("/", maxsplit=1)[-1]
-                if any(
-                    fn.strip(".final.vcf") + "_MODApy.final.vcf" in string
-                    for string in final_list
-                ):
-                    final_list.remove(x)
-            vcfspath = final_list
-            try:
-                vcfsnames = [cyvcf2.Reader(x).samples[0] for x in vcfspath]
-            except Exception as e:
-                logger.info(
-                    "No Sample name in one of the vcfs files. Using File Names Instead"
-                )
-                logger.debug(str(e))
-                vcfsnames = [
-                    x.rsplit("/", maxsplit=1)[-1].strip(".final.vcf") for x in vcfspath
-                ]
-
-            if db is not None:
-                addpatnames = [
-                    x
-                    for x in vcfsnames
-                    if (
-                        x not in db.columns
-                        and x + "_MODApy" not in db.columns
-                        and x.replace("_MODApy", "") not in db.columns
-                    )
-                ]
-                if len(addpatnames) >= 1:
-                    logger.info("Adding Patients: {}".format([x for x in addpatnames]))
-                else:
-                    logger.error("No Patients to Add")
-                    exit(1)
-                patientslist = [x for x in vcfspath for y in addpatnames if y in x]
-            else:
-                patientslist = vcfspath
-
-            return patientslist
-
-        def dbbuilder(patientslist, db=None):
-            logger.info("Parsing Patients")
-            pvcfs = ParsedVCF.mp_parser(*patientslist)
-            pvcfs = [
-                x[
-                    [
-                        "CHROM",
-                        "POS",
-                        "REF",
-                        "ALT",
-                        "ZIGOSITY",
-                        "GENE_NAME",
-                        "HGVS.C",
-                        "HGVS.P",
-                    ]
-                ]
-                for x in pvcfs
-            ]
-            for df in pvcfs:
-                if "ZIGOSITY" not in df.columns:
-                    df["ZIGOSITY"] = "UNKWN"
-            pvcfs = [
-                x.rename(columns={"ZIGOSITY": x.name})
-                for x in pvcfs
-                if "ZIGOSITY" in x.columns
-            ]
-            logger.info("Merging parsed patients toDB")
-            if db is not None:
-                db.drop(columns=["level_0", "index"], errors="ignore", inplace=True)
-                db = db.reset_index()
-                pvcfs.insert(0, db)
-                db.drop(columns=["level_0", "index"], inplace=True, errors="ignore")
-            pvcfs = [
-                x.set_index(
-                    [
-                        "CHROM",
-                        "POS",
-                        "REF",
-                        "ALT",
-                        "GENE_NAME",
-                        "HGVS.C",
-                        "HGVS.P",
-                    ]
-                )
-                for x in pvcfs
-            ]
-            tempdb1 = pd.concat(pvcfs, axis=1, join="outer")
-            tempdb1 = (
-                tempdb1.reset_index()
-                .groupby(["CHROM", "POS", "REF", "ALT"])
-                .agg(
-                    {
-                        "GENE_NAME": " | ".join,
-                        "HGVS.P": " | ".join,
-                        "HGVS.C": " | ".join,
-                    }
-                )
-                .reset_index()
+    def from_VarDB(cls, columns=None, chroms=None):
+        """
+        Loads the DB in the configured DB path, in the format given by its
+        extension (xlsx, csv, sparse or feather).
+
+        Parameters
+        ----------
+        columns : list of str, optional
+            Columns to read. Not supported by the sparse format.
+        chroms : list of str, optional
+            Chromosomes to load. Not supported by the sparse format.
+
+        Returns
+        -------
+        VariantsDB
+            None if the DB is empty. A sparse DB is not expanded, see
+            `from_sparsedb`.
+        """
+        dbformat = configuration.variantsDBPath.rsplit(".")[-1].lower()
+        dbpath = configuration.variantsDBPath
+        if dbformat == "xlsx":
+            return cls.from_exceldb(dbpath, columns=columns, chroms=chroms)
+        elif dbformat == "csv":
+            return cls.from_csvdb(dbpath, columns=columns, chroms=chroms)
+        elif dbformat == "sparse":
+            return cls.from_sparsedb(configuration.variantsDBPath)
+        elif dbformat == "feather":
+            return cls.from_featherdb(
+                configuration.variantsDBPath, columns=columns, chroms=chroms
             )
-            pvcfs = [
-                x.reset_index().drop(columns=["GENE_NAME", "HGVS.C", "HGVS.P"])
-                for x in pvcfs
-            ]
-            pvcfs.insert(0, tempdb1)
-            pvcfs = [x.set_index(["CHROM", "POS", "REF", "ALT"]) for x in pvcfs]
-            db = pd.concat(pvcfs, axis=1, join="outer")
-            del tempdb1
-            del pvcfs
-            colslist = ["GENE_NAME", "HGVS.C", "HGVS.P"]
-            for col in colslist:
-                db[col] = db[col].apply(lambda x: " | ".join(set(x.split(" | "))))
-            db = db.reset_index().set_index(
-                ["CHROM", "POS", "REF", "ALT", "GENE_NAME", "HGVS.C", "HGVS.P"]
+        else:
+            logger.error(
+                "configuration.variantsDBPath must be a xlsx, csv, sparse or "
+                "feather file"
             )
-            db.drop(
-                columns=["index", "0", "level_0"],
-                inplace=True,
-                errors="ignore",
+            exit(1)
+
+    @classmethod
+    def from_VarDB_hits(cls, variants, columns=None):
+        """
+        Loads the part of the configured DB needed to annotate `variants`.
+
+        The variant key set saved along the DB tells which variants are in
+        it, so only the chromosomes with hits are loaded, and nothing when all
+        the variants are novel. Without a key set, or if the DB files changed
+        since it was saved, the chromosomes of all the variants are loaded.
+
+        Parameters
+        ----------
+        variants : pandas.DataFrame
+            DataFrame with CHROM, POS, REF and ALT columns.
+        columns : list of str, optional
+            Columns to read.
+
+        Returns
+        -------
+        VariantsDB
+        """
+        keyset = VariantKeySet.load_matching(
+            default_keyset_path(configuration.variantsDBPath),
+            _db_fingerprint(configuration.variantsDBPath),
+        )
+        if keyset is not None:
+            hits = keyset.contains(variants)
+            logger.info(
+                "{} of {} variants found in DB".format(hits.sum(), len(variants))
             )
-            db.replace({".": np.nan}, inplace=True)
-            db = db.pipe(VariantsDB)
-            db = db.calcfreqs()
-            return db
+            if not hits.any():
+                return cls.empty()
+            chroms = variants["CHROM"][hits].unique()
+        else:
+            logger.info("No valid variant key set, checking every chromosome")
+            chroms = variants["CHROM"].unique()
+        db = cls.from_VarDB(columns=columns, chroms=chroms)
+        if db is None:
+            return cls.empty()
+        return db
+
+    @staticmethod
+    def read_manifest(dbpath=None):
+        """
+        Reads the manifest of a Feather DB, see `to_featherdb`.
 
+        Returns
+        -------
+        dict
+            None if the DB has no manifest.
+        """
+        if dbpath is None:
+            dbpath = configuration.variantsDBPath
+        if not os.path.isfile(_manifest_path(dbpath)):
+            return None
+        with open(_manifest_path(dbpath)) as f:
+            return json.load(f)
+
+    @classmethod
+    def from_featherdb(cls, dbpath=None, columns=None, chroms=None):
+        """
+        Loads a DB stored as one Feather file per chromosome.
+
+        Parameters
+        ----------
+        dbpath : str, optional
+            Path of the DB, defaults to the configured DB path.
+        columns : list of str, optional
+            Columns to read. If None, all columns are read.
+        chroms : list of str, optional
+            Chromosomes to load. If None, the whole DB is loaded.
+
+        Returns
+        -------
+        VariantsDB
+            None if the DB does not exist or there are no shards to read.
+        """
+        if dbpath is None:
+            dbpath = configuration.variantsDBPath
+        manifest = cls.read_manifest(dbpath)
+        if manifest is None:
+            return None
+        shards = manifest["shards"]
+        if chroms is not None:
+            shards = {k: v for k, v in shards.items() if k in {str(x) for x in chroms}}
+        if len(shards) == 0:
+            return None
+        dbdir = os.path.dirname(os.path.abspath(dbpath))
+        files = [os.path.join(dbdir, x["file"]) for x in shards.values()]
         try:
-            logger.info("Checking DB File")
-            if configuration.variantsDBPath.rsplit(".")[-1].lower() == "xlsx":
-                db = VariantsDB.from_exceldb(
-                    configuration.variantsDBPath.rsplit("/", maxsplit=1)[0]
-                )
-                patientslist = patientLister(db)
-            elif configuration.variantsDBPath.rsplit(".")[-1].lower() == "csv":
-                db = VariantsDB.from_csvdb(
-                    configuration.variantsDBPath.rsplit("/", maxsplit=1)[0]
+            dfs = _read_shards(partial(pd.read_feather, columns=columns), files)
+            db = pd.concat(dfs, ignore_index=True)
+            del dfs
+        except Exception as e:
+            logger.error("There was an error parsing Feather DB")
+            logger.debug("", exc_info=True)
+            logger.debug(str(e))
+            exit(1)
+        db.set_index(VARIANT_COLS, inplace=True)
+        db = db.pipe(VariantsDB)
+        return db
+
+    @classmethod
+    def from_sparsedb(cls, sparsepath):
+        """
+        Loads a sparse DB, see `MODApy.sparsevardb`.
+
+        The calls are not expanded to patient columns: the DB only has the
+        frequency columns and keeps the memory mapped SparseVarDB, which
+        carrier lookups, new patients and saving work on. Use `to_dense` to
+        get the patient columns.
+
+        Returns
+        -------
+        VariantsDB
+            None if the DB does not exist.
+        """
+        if not os.path.isdir(sparsepath):
+            return None
+        try:
+            sparse = SparseVarDB.from_sparsedb(sparsepath)
+        except Exception as e:
+            logger.error("There was an error parsing Sparse DB")
+            logger.debug("", exc_info=True)
+            logger.debug(str(e))
+            exit(1)
+        return cls._from_sparse(sparse)
+
+    @classmethod
+    def _from_sparse(cls, sparse):
+        """
+        Wraps a SparseVarDB as a VariantsDB with its frequency columns.
+        """
+        db = sparse.calcfreqs().set_index(VARIANT_COLS).pipe(VariantsDB)
+        object.__setattr__(db, "_sparse", (db.index, sparse))
+        return db
+
+    def _sparse_calls(self):
+        """
+        Returns the SparseVarDB holding the calls of the DB, None for a DB
+        with patient columns.
+
+        It is only valid for the DB it was attached to: any operation that
+        replaces the index (filtering, concatenation, ...) drops it.
+        """
+        cached = self.__dict__.get("_sparse")
+        if cached is not None and cached[0] is self.index:
+            return cached[1]
+        return None
+
+    @property
+    def patients(self):
+        """
+        Names of the patients in the DB.
+        """
+        sparse = self._sparse_calls()
+        if sparse is not None:
+            return list(sparse.samples)
+        return [
+            x
+            for x in self.columns
+            if x not in VARIANT_COLS + FREQ_COLS + COUNT_COLS + ["index", "level_0"]
+        ]
+
+    def to_dense(self):
+        """
+        Returns the DB with one column per patient, expanding the calls of a
+        sparse DB.
+        """
+        sparse = self._sparse_calls()
+        if sparse is None:
+            return self
+        return sparse.to_dense().pipe(VariantsDB)
+
+    @classmethod
+    def empty(cls, sparse=False):
+        """
+        Creates a DB with no variants and no patients.
+
+        Parameters
+        ----------
+        sparse : bool, optional
+            Keep the calls of the patients added to it in a SparseVarDB.
+        """
+        if sparse:
+            return cls._from_sparse(SparseVarDB.empty())
+        index = pd.MultiIndex.from_arrays([[]] * len(VARIANT_COLS), names=VARIANT_COLS)
+        db = pd.DataFrame(
+            {x: pd.Series(dtype="float64") for x in ["ALLELE_FREQ", "FREQ"]},
+            index=index,
+        )
+        return db.pipe(VariantsDB)
+
+    @classmethod
+    def buildDB(cls, checkpoint_every=None):
+        """
+        Builds the DB, or updates it, with every patient in the patients path
+        that is not in it yet.
+
+        Patient vcfs are parsed in a pool of worker processes and merged, in
+        the order of the patients list and in batches of `checkpoint_every`
+        patients, into the DB by this process. After each batch is merged the
+        DB is saved to the configured DB path along with a
+        checkpoint file (variantsDB_checkpoint.json) recording the vcf each
+        patient was ingested from and the vcfs that failed to parse. An
+        interrupted build resumes from the last saved DB, and vcfs that failed
+        are not retried until they are removed from the checkpoint.
+
+        Parameters
+        ----------
+        checkpoint_every : int, optional
+            Number of patients merged between DB saves, defaults to the
+            configured number of cores.
+
+        Returns
+        -------
+        VariantsDB
+        """
+
+        def patientLister(db=None):
+            catalog = get_catalog(configuration.patientPath)
+            if db is None:
+                return [x["path"] for x in catalog.patients()]
+            addpats = catalog.missing_from(db.patients)
+            if len(addpats) >= 1:
+                logger.info(
+                    "Adding Patients: {}".format([x["sample"] for x in addpats])
                 )
-                patientslist = patientLister(db)
             else:
-                logger.error("configuration.variantsDBPath must be a xlsx or csv file")
+                logger.error("No Patients to Add")
                 exit(1)
+            return [x["path"] for x in addpats]
+
+        try:
+            logger.info("Checking DB File")
+            db = VariantsDB.from_VarDB()
+            patientslist = patientLister(db)
         except Exception as e:
             logger.debug(str(e))
             exit()
-        sublists = [
-            patientslist[i : i + int(configuration.cfg["GENERAL"]["cores"])]
-            for i in range(
-                0, len(patientslist), int(configuration.cfg["GENERAL"]["cores"])
+        checkpoint = _read_checkpoint(configuration.variantsDBPath)
+        failed = [x for x in patientslist if x in checkpoint["failed"]]
+        if failed:
+            logger.warning(
+                "Skipping vcfs that failed in a previous build: {}".format(failed)
             )
-        ]
-        for lista in sublists:
-            db = dbbuilder(lista, db)
-            db.to_VarDBCSV()
+            patientslist = [x for x in patientslist if x not in failed]
+        if db is None:
+            dbformat = configuration.variantsDBPath.rsplit(".")[-1].lower()
+            db = cls.empty(sparse=dbformat == "sparse")
+        elif db._sparse_calls() is None:
+            db = db.drop(columns=["level_0", "index"], errors="ignore")
+            if "CHROM" in db.columns:
+                db = db.set_index(VARIANT_COLS)
+        if checkpoint_every is None:
+            checkpoint_every = int(configuration.cfg["GENERAL"]["cores"])
+        cores = min(int(configuration.cfg["GENERAL"]["cores"]), len(patientslist))
+        logger.info("Parsing {} patients".format(len(patientslist)))
+        batch = []
+        with mp.Pool(processes=max(cores, 1)) as pool:
+            parsed = pool.imap(_parse_patient, patientslist)
+            for n, (vcf, name, calls, error) in enumerate(parsed, start=1):
+                if error is not None:
+                    logger.error("Could not parse {}. {}".format(vcf, error))
+                    checkpoint["failed"][vcf] = error
+                elif name in db.patients or name in [x[0] for x in batch]:
+                    logger.warning("{} already in DB, skipping {}".format(name, vcf))
+                else:
+                    batch.append((name, calls))
+                    checkpoint["ingested"][name] = vcf
+                logger.info("Processed {} of {} patients".format(n, len(patientslist)))
+                if len(batch) >= checkpoint_every:
+                    db = db._add_calls(batch)
+                    db.to_VarDB()
+                    _write_checkpoint(configuration.variantsDBPath, checkpoint)
+                    batch = []
+        if batch:
+            db = db._add_calls(batch)
+            db.to_VarDB()
+        _write_checkpoint(configuration.variantsDBPath, checkpoint)
         return db
 
     def addPatientToDB(self, patient):
-        if patient.rsplit("/")[-1].strip(".final.vcf") in self.columns:
-            logger.error("Patient already is in DB")
-            exit(1)
         if isinstance(patient, str):
+            patname = patient.rsplit("/", maxsplit=1)[-1]
+            for ext in VCF_EXTENSIONS:
+                if patname.endswith(".final" + ext):
+                    patname = patname[: -len(".final" + ext)]
+            if patname in self.patients:
+                logger.error("Patient already is in DB")
+                exit(1)
             pvcf = ParsedVCF.from_vcf(patient)
         elif isinstance(patient, ParsedVCF):
             pvcf = patient
@@ -262,35 +621,263 @@ class VariantsDB(pd.DataFrame):
             logger.error("Patient must be either a path to vcf or a ParsedVCF object")
             logger.debug("", exc_info=True)
             exit(1)
-        pvcf = pvcf[
-            [
-                "CHROM",
-                "POS",
-                "REF",
-                "ALT",
-                "ZIGOSITY",
-                "GENE_NAME",
-                "HGVS.C",
-                "HGVS.P",
-            ]
-        ]
-        if "ZIGOSITY" not in pvcf.columns:
-            pvcf["ZIGOSITY"] = "UNKWN"
-        pvcf.rename(columns={"ZIGOSITY": pvcf.name}, inplace=True)
-        pvcf.set_index(
-            ["CHROM", "POS", "REF", "ALT", "GENE_NAME", "HGVS.C", "HGVS.P"],
-            inplace=True,
+        if pvcf.name in self.patients:
+            logger.error("Patient already is in DB")
+            exit(1)
+        calls = pd.DataFrame(
+            pvcf[[x for x in VARIANT_COLS + ["ZIGOSITY"] if x in pvcf.columns]]
         )
-        db = pd.concat([self, pvcf], axis=1, join="outer")
+        if "ZIGOSITY" not in calls.columns:
+            calls["ZIGOSITY"] = "UNKWN"
+        return self._add_calls([(pvcf.name, calls)])
+
+    def _variant_keys(self):
+        """
+        Returns the 64 bit key (see `MODApy.varkey`) of each variant in the DB,
+        read from the index or, if not indexed, from the columns.
+        """
+        if "CHROM" in self.columns:
+            variants = self[VARIANT_KEYS]
+        else:
+            variants = self.index.to_frame(index=False)
+        return variant_keys(variants)
+
+    def _key_index(self):
+        """
+        Returns the variant key index of the DB, as a tuple with the unique
+        variant keys, the DB rows sorted by key (rows of the same variant in
+        DB order) and the offset of the rows of each key in that order.
+
+        The index is built on first use and cached in the object, it is
+        rebuilt if the DB index is replaced.
+        """
+        cached = self.__dict__.get("_keyindex")
+        if cached is not None and cached[0] is self.index:
+            return cached[1:]
+        labels, keys = pd.factorize(self._variant_keys())
+        order = np.argsort(labels, kind="stable")
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=len(keys)), out=offsets[1:])
+        cached = (self.index, pd.Index(keys), order, offsets)
+        object.__setattr__(self, "_keyindex", cached)
+        return cached[1:]
+
+    def locate_variants(self, variants):
+        """
+        Finds the given variants in the DB using the variant key index.
+
+        Parameters
+        ----------
+        variants : pandas.DataFrame
+            DataFrame with CHROM, POS, REF and ALT columns.
+
+        Returns
+        -------
+        numpy.ndarray
+            Position of each variant in the DB, -1 for variants not in the DB.
+        """
+        keys, order, offsets = self._key_index()
+        rows = keys.get_indexer(variant_keys(variants))
+        found = rows >= 0
+        rows[found] = order[offsets[rows[found]]]
+        return rows
+
+    def locate_all_variants(self, variants):
+        """
+        Finds every DB row of the given variants (a variant has one row per
+        annotation, see VARIANT_COLS).
+
+        Parameters
+        ----------
+        variants : pandas.DataFrame
+            DataFrame with CHROM, POS, REF and ALT columns.
+
+        Returns
+        -------
+        numpy.ndarray
+            Position in `variants` of each match.
+        numpy.ndarray
+            DB row of each match.
+        """
+        keys, order, offsets = self._key_index()
+        labels = keys.get_indexer(variant_keys(variants))
+        which = np.flatnonzero(labels >= 0)
+        starts = offsets[labels[which]]
+        counts = offsets[labels[which] + 1] - starts
+        which = np.repeat(which, counts)
+        ranks = np.arange(len(which)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return which, order[np.repeat(starts, counts) + ranks]
+
+    def get_freqs(self, variants):
+        """
+        Returns the DB frequencies of the given variants.
+
+        Parameters
+        ----------
+        variants : pandas.DataFrame
+            DataFrame with CHROM, POS, REF and ALT columns.
+
+        Returns
+        -------
+        pandas.DataFrame
+            FREQ and ALLELE_FREQ of each variant, in the same order as
+            `variants`, NaN for variants not in the DB.
+        """
+        rows = self.locate_variants(variants)
+        found = rows >= 0
+        freqs = pd.DataFrame(np.nan, index=range(len(rows)), columns=FREQ_COLS)
+        for col in FREQ_COLS:
+            values = self[col].iloc[rows[found]]
+            freqs.loc[found, col] = pd.to_numeric(values, errors="coerce").to_numpy()
+        return freqs
+
+    def get_carriers(self, variants):
+        """
+        Returns the patients of the DB carrying each of the given variants.
+
+        Parameters
+        ----------
+        variants : pandas.DataFrame
+            DataFrame with CHROM, POS, REF and ALT columns.
+
+        Returns
+        -------
+        list of list of str
+            Carriers of each variant, in the same order as `variants`, empty
+            for variants not in the DB.
+        """
+        patients = np.array(self.patients, dtype=object)
+        rows = self.locate_variants(variants)
+        found = rows >= 0
+        carriers = [[] for _ in range(len(rows))]
+        if len(patients) == 0 or not found.any():
+            return carriers
+        sparse = self._sparse_calls()
+        if sparse is not None:
+            for i, x in zip(np.flatnonzero(found), sparse.get_carriers(rows[found])):
+                carriers[i] = x
+            return carriers
+        calls = self.iloc[rows[found]][patients].to_numpy(dtype=object)
+        carrying = encode_zygosity(calls) != ZYG_NOCALL
+        for i, mask in zip(np.flatnonzero(found), carrying):
+            carriers[i] = patients[mask].tolist()
+        return carriers
+
+    def _add_calls(self, patients):
+        """
+        Adds the calls of new patients to the DB, without recalculating the
+        frequencies of the whole DB.
+
+        The patients are merged at once: the variants that are not in the DB
+        yet are appended, one row per annotation, and the variant key index is
+        built once for the whole batch. The integer carrier and allele counts
+        of the DB (N_CARRIERS and N_ALLELES, counted from the calls once if the
+        DB does not have them) are incremented for every row of the variants
+        each patient carries, the patient columns are added in a single
+        concatenation and the frequencies are derived from the counts with the
+        new number of patients.
+
+        In a sparse DB the calls are added to the SparseVarDB, and the
+        frequencies are counted from its calls.
+
+        Parameters
+        ----------
+        patients : list of tuple
+            Name of the new patient column and calls of the patient (a
+            DataFrame with VARIANT_COLS and ZIGOSITY columns) of each patient,
+            in the order they are added.
+
+        Returns
+        -------
+        VariantsDB
+        """
+        names = [x[0] for x in patients]
+        logger.info("Adding %s to DB" % ", ".join(names))
+        calls = [x[1].drop_duplicates(VARIANT_COLS) for x in patients]
+        new = pd.concat([x[self.locate_variants(x) < 0] for x in calls])
+        new = new.drop_duplicates(VARIANT_COLS)[VARIANT_COLS]
+
+        sparse = self._sparse_calls()
+        if sparse is not None:
+            # only the variant key index of the extended DB is needed
+            variants = pd.concat([sparse.variants[VARIANT_COLS], new])
+            db = VariantsDB(index=pd.MultiIndex.from_frame(variants))
+        else:
+            db = self
+            if any(x not in db.columns for x in FREQ_COLS + COUNT_COLS):
+                db = db.calcfreqs()
+            newrows = pd.DataFrame(
+                ".", index=pd.MultiIndex.from_frame(new), columns=db.columns
+            )
+            newrows[FREQ_COLS] = 0.0
+            newrows[COUNT_COLS] = 0
+            db = pd.concat([db, newrows]).pipe(VariantsDB)
+
+        # The DB rows of each called variant, with the call of the patient
+        matches = []
+        for pcalls in calls:
+            first = ~pcalls.duplicated(VARIANT_KEYS).to_numpy()
+            which, rows = db.locate_all_variants(pcalls[first])
+            which = np.flatnonzero(first)[which]
+            matches.append((rows, pcalls["ZIGOSITY"].to_numpy(dtype=object)[which]))
+
+        if sparse is not None:
+            sparse = sparse.add_samples(
+                names, [(x, encode_zygosity(z)) for x, z in matches], new
+            )
+            return self._from_sparse(sparse)
+
+        carriers = db["N_CARRIERS"].to_numpy(dtype=np.int64).copy()
+        alleles = db["N_ALLELES"].to_numpy(dtype=np.int64).copy()
+        columns = {}
+        for name, (rows, zigosity) in zip(names, matches):
+            codes = encode_zygosity(zigosity)
+            carriers[rows] += codes != ZYG_NOCALL
+            alleles[rows] += DOSAGE[codes]
+            columns[name] = np.full(len(db), ".", dtype=object)
+            columns[name][rows] = zigosity
+        db = pd.concat([db, pd.DataFrame(columns, index=db.index)], axis=1)
         db = db.pipe(VariantsDB)
-        db = db.calcfreqs()
+        npatients = len(db.patients)
+        db["N_CARRIERS"] = carriers
+        db["N_ALLELES"] = alleles
+        db["FREQ"] = carriers / npatients
+        db["ALLELE_FREQ"] = alleles / (npatients * 2)
         return db
 
+    def to_VarDB(self):
+        """
+        Writes the DB to the configured DB path, in the format given by its
+        extension, along with its variant key set.
+        """
+        dbformat = configuration.variantsDBPath.rsplit(".")[-1].lower()
+        if dbformat == "sparse":
+            self.to_sparsedb()
+        elif dbformat == "feather":
+            self.to_featherdb()
+        elif dbformat == "xlsx":
+            self.to_VarDBXLS()
+        else:
+            self.to_VarDBCSV()
+        VariantKeySet(np.unique(self._variant_keys())).save(
+            default_keyset_path(configuration.variantsDBPath),
+            _db_fingerprint(configuration.variantsDBPath),
+        )
+
+    def _chrom_shards(self):
+        """
+        Splits the DB in one DataFrame per chromosome, sorted by position,
+        in a single groupby pass over a flat copy of the DB.
+        """
+        db = pd.DataFrame(self.to_dense()).reset_index()
+        db = db.drop(columns=["index", "level_0"], errors="ignore")
+        db["CHROM"] = db["CHROM"].astype(str)
+        db["POS"] = db["POS"].astype("int64")
+        for chrom, shard in db.groupby("CHROM", sort=True):
+            yield chrom, shard.sort_values("POS", kind="stable")
+
     def to_VarDBXLS(self):
         logger.info("Writing DB to Excel")
-        self.reset_index(inplace=True)
-        self["POS"] = self["POS"].astype(int)
-        self.sort_values(["CHROM", "POS"], inplace=True)
         os.makedirs(
             configuration.variantsDBPath.rsplit("/", maxsplit=1)[0], exist_ok=True
         )
@@ -300,11 +887,10 @@ class VariantsDB(pd.DataFrame):
         datasheet = workbook.add_worksheet("VariantSDB")
         output.sheets["VariantsDB"] = datasheet
         formatpos = workbook.add_format({"num_format": "###,###,###"})
-        self["POS"] = self["POS"].astype(int)
         datasheet.set_column("B:B", 15, formatpos)
-        for chrom in self["CHROM"].unique():
-            self[self["CHROM"] == chrom].to_excel(
-                vdbpath + str(chrom) + ".csv",
+        for chrom, shard in self._chrom_shards():
+            shard.to_excel(
+                vdbpath + chrom + ".xlsx",
                 index=False,
                 float_format="%.5f",
                 merge_cells=False,
@@ -313,53 +899,111 @@ class VariantsDB(pd.DataFrame):
         logger.info("Xlsx DB construction complete")
 
     def to_VarDBCSV(self):
+        """
+        Writes the DB as one CSV file per chromosome, next to the configured
+        DB path. Besides being a DB format, this is the human readable dump of
+        the binary formats.
+        """
         logger.info("Writing DB to CSV")
-        self.reset_index(inplace=True)
-        self["POS"] = self["POS"].astype(int)
-        self.sort_values(["CHROM", "POS"], inplace=True)
         vdbpath = configuration.variantsDBPath.rsplit(".", maxsplit=1)[0]
         os.makedirs(
             configuration.variantsDBPath.rsplit("/", maxsplit=1)[0], exist_ok=True
         )
-        for chrom in self["CHROM"].unique():
-            self[self["CHROM"] == chrom].to_csv(
-                vdbpath + str(chrom) + ".csv", index=False, float_format="%.5f"
-            )
+        for chrom, shard in self._chrom_shards():
+            shard.to_csv(vdbpath + chrom + ".csv", index=False, float_format="%.5f")
+        logger.info("DB construction complete")
+
+    def to_featherdb(self, dbpath=None):
+        """
+        Writes the DB as one Feather file per chromosome plus a JSON manifest.
+
+        Shards are named after `dbpath` followed by the chromosome, e.g.
+        variantsDB1.feather, and the manifest (variantsDB_manifest.json) lists
+        the shards, the number of variants in each, the DB columns and the
+        patients in the DB. Frequencies are stored at full precision. Shards
+        left from a previous save that are not in the new manifest are
+        removed.
+
+        Parameters
+        ----------
+        dbpath : str, optional
+            Path of the DB, defaults to the configured DB path.
+        """
+        if dbpath is None:
+            dbpath = configuration.variantsDBPath
+        logger.info("Writing DB to Feather")
+        base = dbpath.rsplit(".", maxsplit=1)[0]
+        os.makedirs(os.path.dirname(os.path.abspath(dbpath)), exist_ok=True)
+        shards = {}
+        columns = None
+        for chrom, shard in self._chrom_shards():
+            shardpath = base + chrom + ".feather"
+            shard.reset_index(drop=True).to_feather(shardpath)
+            shards[chrom] = {
+                "file": os.path.basename(shardpath),
+                "nvariants": len(shard),
+            }
+            columns = shard.columns.tolist()
+        manifest = {
+            "format": "feather",
+            "columns": columns,
+            "patients": self.patients,
+            "shards": shards,
+        }
+        with open(_manifest_path(dbpath) + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(_manifest_path(dbpath) + ".tmp", _manifest_path(dbpath))
+        # shards of chromosomes no longer in the DB
+        files = {x["file"] for x in shards.values()}
+        for shardpath in _shard_files(dbpath):
+            if os.path.basename(shardpath) not in files:
+                logger.info("Removing stale shard %s" % shardpath)
+                os.remove(shardpath)
+        logger.info("DB construction complete")
+
+    def to_sparsedb(self, sparsepath=None):
+        if sparsepath is None:
+            sparsepath = configuration.variantsDBPath
+        logger.info("Writing DB to Sparse DB")
+        sparse = self._sparse_calls()
+        if sparse is None:
+            sparse = SparseVarDB.from_variantsdb(self)
+        sparse.to_sparsedb(sparsepath)
         logger.info("DB construction complete")
 
     def calcfreqs(self):
+        sparse = self._sparse_calls()
+        if sparse is not None:
+            return self._from_sparse(sparse)
         logger.info("Calculating Variant Frequencies")
-        patients = self.columns.tolist()
-        if "FREQ" in patients:
-            patients.remove("FREQ")
-        if "ALLELE_FREQ" in patients:
-            patients.remove("ALLELE_FREQ")
-        self.replace({".": np.nan}, inplace=True)
-        self["FREQ"] = self[patients].notnull().sum(axis=1) / len(patients)
-        self["ALLELE_FREQ"] = self[patients].apply(
-            lambda x: ((x.str.contains("HOM") * 2 + x.str.contains("HET") * 1).sum())
-            / len(patients * 2),
-            axis=1,
+        patients = self.patients
+        npatients = len(patients)
+        values = self[patients].to_numpy(dtype=object)
+        zigosity, missing = encode_zygosity(values, return_missing=True)
+        carriers = (zigosity != ZYG_NOCALL).sum(axis=1)
+        alleles = (zigosity == ZYG_HOM).sum(axis=1) * 2 + (zigosity == ZYG_HET).sum(
+            axis=1
         )
-        cols = self.columns.tolist()
-        cols.remove("FREQ")
-        cols.remove("ALLELE_FREQ")
-        self = self[["ALLELE_FREQ", "FREQ"] + cols]
-        self.replace({np.nan: "."}, inplace=True)
-        self.pipe(VariantsDB)
-        return self
+        del zigosity
+        if missing.any():
+            values = values.copy()
+            values[missing] = "."
+        db = pd.DataFrame(values, index=self.index, columns=patients)
+        db.insert(0, "N_CARRIERS", carriers.astype(np.int64))
+        db.insert(0, "N_ALLELES", alleles.astype(np.int64))
+        db.insert(0, "FREQ", carriers / npatients)
+        db.insert(0, "ALLELE_FREQ", alleles / (npatients * 2))
+        db = db.pipe(VariantsDB)
+        return db
 
     def annotate_excel(self, df, fileName, annotate_patients=True):
         logger.info("Annotating Excel file")
         cols_to_drop = ["FREQ", "ALLELE_FREQ", "VARDB_FREQ"]
         df.drop(columns=[x for x in cols_to_drop if x in df.columns], inplace=True)
-        df = df.merge(
-            self.reset_index()[["CHROM", "POS", "REF", "ALT", "FREQ", "ALLELE_FREQ"]],
-            on=["CHROM", "POS", "REF", "ALT"],
-            how="left",
-        )
-        df.rename(columns={"FREQ": "VARDB_FREQ"}, inplace=True)
-        df["VARDB_FREQ"] = pd.to_numeric(df["VARDB_FREQ"], errors="coerce")
+        df = df.reset_index(drop=True)
+        freqs = self.get_freqs(df)
+        df["VARDB_FREQ"] = freqs["FREQ"]
+        df["ALLELE_FREQ"] = freqs["ALLELE_FREQ"]
         df["VARDB_FREQ"].round(6)
         if "_MODApy" in fileName:
             foldername = fileName.split("_MODApy")[0] + "_MODApy"
@@ -376,7 +1020,7 @@ class VariantsDB(pd.DataFrame):
         )
         if annotate_patients is True:
             patdf = self.annotate_patients_with_variants(df)
-            df = df.merge(patdf, on=["CHROM", "POS", "REF", "ALT"], how="left")
+            df["PATS_WITH_VARIANTS"] = patdf["PATS_WITH_VARIANTS"]
         firstcols = [
             "GENE_NAME",
             "AMINOCHANGE",
@@ -547,47 +1191,8 @@ class VariantsDB(pd.DataFrame):
 
     def annotate_patients_with_variants(self, paneldf, columns=None):
         if columns is None:
-            columns = ['CHROM', 'POS', 'REF', 'ALT']
+            columns = ["CHROM", "POS", "REF", "ALT"]
         logger.info("Annotating Patients with Variants")
-        patsdf = paneldf[columns].merge(
-            self.reset_index().drop(columns=['FREQ', 'ALLELE_FREQ']),
-            on=["CHROM", "POS", "REF", "ALT"],
-            how="left",
-        )
-        patsdf.drop(columns='index', inplace=True)
-        patsdf['PATS_WITH_VARIANTS'] = pd.Series(
-            list(
-                np.where(
-                    ~patsdf.drop(
-                        columns=[
-                            'CHROM',
-                            'POS',
-                            'REF',
-                            'ALT',
-                            'HGVS.C',
-                            'HGVS.P',
-                            'GENE_NAME',
-                        ]
-                    ).eq('.'),
-                    patsdf.drop(
-                        columns=[
-                            'CHROM',
-                            'POS',
-                            'REF',
-                            'ALT',
-                            'HGVS.C',
-                            'HGVS.P',
-                            'GENE_NAME',
-                        ]
-                    ).columns,
-                    'to_delete',
-                )
-            )
-        )
-        patsdf['PATS_WITH_VARIANTS'] = patsdf['PATS_WITH_VARIANTS'].apply(
-            lambda x: x.tolist()
-        )
-        patsdf['PATS_WITH_VARIANTS'] = patsdf['PATS_WITH_VARIANTS'].apply(
-            lambda row: [pat for pat in row if pat != 'to_delete']
-        )
-        return patsdf[columns + ['PATS_WITH_VARIANTS']]
+        patsdf = paneldf[columns].reset_index(drop=True)
+        patsdf["PATS_WITH_VARIANTS"] = self.get_carriers(paneldf)
+        return patsdf
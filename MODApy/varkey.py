@@ -0,0 +1,174 @@
+"""
+64 bit variant keys.
+
+SNVs and short indels are packed losslessly into a single uint64:
+
+    bit  63      fallback flag (0)
+    bits 58-62   chromosome code (1-22, X=23, Y=24, M/MT=25)
+    bits 30-57   position
+    bits 26-29   REF length
+    bits 22-25   ALT length
+    bits 0-21    REF + ALT bases, 2 bits per base (A, C, G, T), up to 11 bases
+
+so keys of packed variants sort by chromosome and position. Variants that do
+not fit (long or symbolic alleles, other contigs) get the fallback flag and a
+63 bit hash of the normalized CHROM, POS, REF and ALT instead; a fallback
+table can record them to decode their keys back.
+"""
+import logging
+
+import numpy as np
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+KEY_COLS = ["CHROM", "POS", "REF", "ALT"]
+FALLBACK_FLAG = np.uint64(1 << 63)
+MAX_BASES = 11
+MAX_POS = (1 << 28) - 1
+CHROM_CODES = {str(x): x for x in range(1, 23)}
+CHROM_CODES.update({"X": 23, "Y": 24, "M": 25, "MT": 25})
+CHROM_NAMES = {v: k for k, v in CHROM_CODES.items() if k != "M"}
+BASES = "ACGT"
+# 2 bit code of each base, by ASCII value (only valid where _VALID is True)
+_BASECODE = np.zeros(256, dtype=np.uint64)
+_VALID = np.zeros(256, dtype=bool)
+for _code, _base in enumerate(BASES):
+    _BASECODE[ord(_base)] = _code
+    _VALID[ord(_base)] = True
+
+
+def _normalize(variants):
+    chrom = pd.Series(variants["CHROM"]).astype(str).str.replace("^chr", "", regex=True)
+    return (
+        chrom.to_numpy(dtype=object),
+        pd.Series(variants["POS"]).astype("int64").to_numpy(),
+        pd.Series(variants["REF"]).astype(str).str.upper().to_numpy(dtype=object),
+        pd.Series(variants["ALT"]).astype(str).str.upper().to_numpy(dtype=object),
+    )
+
+
+def _hash_keys(chrom, pos, ref, alt):
+    keys = pd.DataFrame({"CHROM": chrom, "POS": pos, "REF": ref, "ALT": alt})
+    hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+    return (hashes >> np.uint64(1)) | FALLBACK_FLAG
+
+
+def encode_variants(variants, fallback=None):
+    """
+    Encodes variants into 64 bit keys.
+
+    CHROM is normalized (a "chr" prefix is dropped) and alleles are upper
+    cased, so the same variant gets the same key from any source.
+
+    Parameters
+    ----------
+    variants : pandas.DataFrame
+        DataFrame with CHROM, POS, REF and ALT columns.
+    fallback : dict, optional
+        Fallback table. If given, the variants that could not be packed are
+        added to it (key: (CHROM, POS, REF, ALT)), see `decode_keys`.
+
+    Returns
+    -------
+    numpy.ndarray
+        uint64 array with the key of each variant.
+    """
+    chrom, pos, ref, alt = _normalize(variants)
+    n = len(pos)
+    codes = pd.Series(chrom).map(CHROM_CODES).fillna(0).to_numpy(dtype=np.uint64)
+    reflen = pd.Series(ref, dtype=object).str.len().to_numpy(dtype=np.int64)
+    altlen = pd.Series(alt, dtype=object).str.len().to_numpy(dtype=np.int64)
+    alleles = (pd.Series(ref, dtype=object) + pd.Series(alt, dtype=object)).to_numpy(
+        dtype=object
+    )
+    packable = (
+        (codes > 0)
+        & (pos >= 0)
+        & (pos <= MAX_POS)
+        & (reflen >= 1)
+        & (altlen >= 1)
+        & (reflen + altlen <= MAX_BASES)
+    )
+    keys = np.zeros(n, dtype=np.uint64)
+    if packable.any():
+        # Fixed width byte matrix of the alleles, zero padded
+        bases = (
+            np.array(alleles[packable].tolist(), dtype="S%i" % MAX_BASES)
+            .view(np.uint8)
+            .reshape(-1, MAX_BASES)
+        )
+        width = (reflen + altlen)[packable]
+        used = np.arange(MAX_BASES) < width[:, None]
+        valid = (_VALID[bases] | ~used).all(axis=1)
+        shifts = np.arange(MAX_BASES - 1, -1, -1, dtype=np.uint64) * np.uint64(2)
+        packed = (np.where(used, _BASECODE[bases], 0).astype(np.uint64) << shifts).sum(
+            axis=1, dtype=np.uint64
+        )
+        keys[packable] = (
+            (codes[packable] << np.uint64(58))
+            | (pos[packable].astype(np.uint64) << np.uint64(30))
+            | (reflen[packable].astype(np.uint64) << np.uint64(26))
+            | (altlen[packable].astype(np.uint64) << np.uint64(22))
+            | packed
+        )
+        packable[np.flatnonzero(packable)[~valid]] = False
+    other = ~packable
+    if other.any():
+        keys[other] = _hash_keys(chrom[other], pos[other], ref[other], alt[other])
+        if fallback is not None:
+            for key, variant in zip(
+                keys[other], zip(chrom[other], pos[other], ref[other], alt[other])
+            ):
+                fallback[int(key)] = variant
+    return keys
+
+
+def decode_keys(keys, fallback=None):
+    """
+    Decodes 64 bit keys back into variants.
+
+    Parameters
+    ----------
+    keys : array-like of uint64
+        Variant keys.
+    fallback : dict, optional
+        Fallback table filled by `encode_variants`, used to decode the keys of
+        variants that could not be packed. Without it, their columns are None.
+
+    Returns
+    -------
+    pandas.DataFrame
+        CHROM, POS, REF and ALT of each key.
+    """
+    keys = np.asarray(keys, dtype=np.uint64)
+    variants = []
+    for key in keys.tolist():
+        if key & (1 << 63):
+            variant = (fallback or {}).get(key, (None, None, None, None))
+        else:
+            reflen = (key >> 26) & 0xF
+            altlen = (key >> 22) & 0xF
+            width = reflen + altlen
+            alleles = "".join(
+                BASES[(key >> (2 * (MAX_BASES - 1 - i))) & 0x3] for i in range(width)
+            )
+            variant = (
+                CHROM_NAMES[key >> 58],
+                (key >> 30) & MAX_POS,
+                alleles[:reflen],
+                alleles[reflen:],
+            )
+        variants.append(variant)
+    return pd.DataFrame(variants, columns=KEY_COLS)
+
+
+def variant_keys(variants):
+    """
+    Returns the 64 bit keys of `variants`, taken from its VARKEY column (added
+    by `ParsedVCF.from_vcf`) if it has one, encoded otherwise.
+    """
+    if "VARKEY" in variants.columns:
+        return variants["VARKEY"].to_numpy(dtype=np.uint64)
+    return encode_variants(variants)
@@ -2,7 +2,7 @@ import logging
 import os
 
 from MODApy import configuration, vcfmgr
-from MODApy.utils import checkFile
+from MODApy.utils import VCF_EXTENSIONS, checkFile
 
 
 logger = logging.getLogger()
@@ -10,7 +10,7 @@ logger = logging.getLogger()
 
 def single(patient, panel):
     try:
-        checkFile(patient, ".vcf")
+        checkFile(patient, VCF_EXTENSIONS)
         checkFile(panel, ".xlsx")
         logger.info("Running %s on patient %s" % (str(panel), str(patient)))
         result = vcfmgr.ParsedVCF.from_vcf(patient).panel(panel)
@@ -36,8 +36,8 @@ def single(patient, panel):
 
 def duos(patient1, patient2, VennPlace=None, Panel=None, Filter=[None]):
     try:
-        checkFile(patient1, ".vcf")
-        checkFile(patient2, ".vcf")
+        checkFile(patient1, VCF_EXTENSIONS)
+        checkFile(patient2, VCF_EXTENSIONS)
         logger.info("Running Duos Study on %s and %s" % (str(patient1), str(patient2)))
         pvcfs = vcfmgr.ParsedVCF.mp_parser(patient1, patient2)
         result = pvcfs[0].duos(pvcfs[1], VENNPLACE=VennPlace)
@@ -89,9 +89,9 @@ def duos(patient1, patient2, VennPlace=None, Panel=None, Filter=[None]):
 
 def trios(patient1, patient2, patient3, VennPlace=None, Filter=[None], Panel=None):
     try:
-        checkFile(patient1, ".vcf")
-        checkFile(patient2, ".vcf")
-        checkFile(patient3, ".vcf")
+        checkFile(patient1, VCF_EXTENSIONS)
+        checkFile(patient2, VCF_EXTENSIONS)
+        checkFile(patient3, VCF_EXTENSIONS)
         logger.info(
             "Running Trios Study on %s, %s and %s"
             % (str(patient1), str(patient2), str(patient3))
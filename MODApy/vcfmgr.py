@@ -6,7 +6,8 @@ import re
 from collections import OrderedDict
 
 from MODApy.cfg import configuration
-from MODApy.utils import aminoChange, divide
+from MODApy.utils import aminoChange, divide, is_bgzf
+from MODApy.varkey import KEY_COLS, encode_variants
 
 import cyvcf2
 
@@ -22,6 +23,566 @@ import pandas as pd
 matplotlib.use("agg")
 logger = logging.getLogger(__name__)
 
+# cyvcf2 missing (and vector end) values of Integer FORMAT fields
+FORMAT_INT_MISSING = np.iinfo(np.int32).min + 1
+
+
+def _open_vcf(vcf, samples=None, threads=None):
+    """
+    Opens a VCF (plain, gzip or bgzip compressed) with cyvcf2.
+
+    BGZF blocks are independent, so for bgzipped VCFs htslib decompresses them
+    with `threads` threads (the configured cores by default) while the records
+    are parsed.
+    """
+    if samples is None:
+        pVCF = cyvcf2.Reader(vcf)
+    else:
+        pVCF = cyvcf2.Reader(vcf, samples=list(samples))
+    if is_bgzf(vcf):
+        if threads is None:
+            threads = int(configuration.cfg["GENERAL"]["cores"])
+        if threads > 1:
+            logger.debug("Decompressing %s with %i threads" % (vcf, threads))
+            pVCF.set_threads(threads)
+    return pVCF
+
+
+def _read_vcf(vcf, samples=None, genotypes=False, threads=None):
+    """
+    Parse a VCF file and return a dictionary of variant information.
+
+    Parameters
+    ----------
+    vcf : str
+        The path to the VCF file to be parsed.
+    samples : list of str, optional
+        Samples to read. If None, every sample in the VCF is read.
+    genotypes : bool, optional
+        Also read the genotypes of every sample, see `_read_genotypes`.
+    threads : int, optional
+        BGZF decompression threads, see `_open_vcf`.
+
+    Returns
+    -------
+    pandas.DataFrame
+    A DataFrame containing variants data.
+    name : str
+        The name of the first sample in the VCF file, or the name of the
+        VCF file if no samples are present.
+    pVCF : cyvcf2.Reader
+        A cyvcf2.Reader object representing the VCF file.
+    calls : list of tuple
+        Genotypes of each variant (row) if `genotypes` is True, None otherwise.
+
+    Raises
+    ------
+    IOError
+        If the input VCF file cannot be found or opened.
+    """
+    logger.info("Parsing VCF File. %s" % vcf)
+    pVCF = _open_vcf(vcf, samples=samples, threads=threads)
+    try:
+        name = pVCF.samples[0]
+    except Exception:
+        name = vcf.split("/")[-1]
+    variants_dict = OrderedDict()
+    calls = OrderedDict() if genotypes else None
+    for variant in pVCF:
+        key = (
+            variant.CHROM,
+            str(variant.POS),
+            variant.REF,
+            ",".join(variant.ALT),
+        )
+        variants_dict[key] = {
+            "ID": variant.ID,
+            "QUAL": variant.QUAL,
+            "FILTER": variant.FILTER,
+        }
+        variants_dict[key].update({k: v for (k, v) in variant.INFO})
+        if genotypes:
+            calls[key] = _read_genotypes(variant)
+    df1 = pd.DataFrame.from_dict(variants_dict, orient="index")
+    del variants_dict
+    df1.index.names = ["CHROM", "POS", "REF", "ALT"]
+    df1.reset_index(inplace=True)
+    if genotypes:
+        calls = list(calls.values())
+    return df1, name, pVCF, calls
+
+
+def _read_genotypes(variant):
+    """
+    Reads the genotypes of every sample of a VCF record, in bulk, as numpy
+    arrays.
+
+    Parameters
+    ----------
+    variant : cyvcf2.Variant
+        The VCF record.
+
+    Returns
+    -------
+    tuple
+        The ALT alleles of the record and the (samples x ploidy) allele
+        indexes of the genotypes (negative for missing or padded alleles),
+        followed by the DP, GQ and (samples x alleles) AD FORMAT fields, None
+        for the fields the record lacks.
+    """
+    fields = []
+    for field in ["DP", "GQ", "AD"]:
+        values = variant.format(field)
+        if values is not None and field != "AD":
+            values = values[:, 0]
+        fields.append(values)
+    return (variant.ALT, variant.genotype.array()[:, :-1], *fields)
+
+
+def _format_values(values):
+    """
+    Formats FORMAT values as strings, with '.' for missing values.
+    """
+    if values.dtype.kind == "f":
+        missing = np.isnan(values)
+    else:
+        missing = values <= FORMAT_INT_MISSING
+    values = values.astype(str).astype(object)
+    values[missing] = "."
+    return values
+
+
+def _int_values(values):
+    """
+    Converts Integer FORMAT values to floats, with NaN for missing values, so
+    they can be stored as a nullable integer column.
+    """
+    if values.dtype.kind == "f":
+        return values.astype(np.float64)
+    values = values.astype(np.float64)
+    values[values <= FORMAT_INT_MISSING] = np.nan
+    return values
+
+
+def _genotype_calls(df, calls, samples):
+    """
+    Builds the long format calls of a multi sample VCF.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Parsed variants, one row per ALT allele, with the _SITE column holding
+        the index of the VCF record of each row in `calls`.
+    calls : list of tuple
+        Genotypes of each VCF record, see `_read_genotypes`.
+    samples : list of str
+        Sample names, in the order of the genotype arrays.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per variant and sample carrying it, with the variant columns
+        and SAMPLE, ZIGOSITY, FORMAT_DP, FORMAT_GQ (nullable integers) and
+        FORMAT_AD (REF,ALT depths) columns, sorted by sample.
+    """
+    samples = np.asarray(samples, dtype=object)
+    rows, carriers, zigosity, dp, gq, ad = [], [], [], [], [], []
+    for row, (site, alt) in enumerate(zip(df["_SITE"].astype(int), df["ALT"])):
+        alts, alleles, sitedp, sitegq, sitead = calls[site]
+        if alt not in alts:
+            continue
+        allele = alts.index(alt) + 1
+        copies = (alleles == allele).sum(axis=1)
+        carrier = np.flatnonzero(copies > 0)
+        if len(carrier) == 0:
+            continue
+        called = (alleles[carrier] >= 0).sum(axis=1)
+        rows.append(np.full(len(carrier), row))
+        carriers.append(carrier)
+        zigosity.append(np.where(copies[carrier] == called, "HOM", "HET"))
+        for values, out in [(sitedp, dp), (sitegq, gq)]:
+            if values is None:
+                out.append(np.full(len(carrier), np.nan))
+            else:
+                out.append(_int_values(values[carrier]))
+        if sitead is None:
+            ad.append(np.full(len(carrier), ".", dtype=object))
+        else:
+            ad.append(
+                _format_values(sitead[carrier, 0])
+                + ","
+                + _format_values(sitead[carrier, allele])
+            )
+    if len(rows) == 0:
+        long = df.iloc[:0].copy()
+        for col in ["SAMPLE", "ZIGOSITY", "FORMAT_AD"]:
+            long[col] = pd.Series(dtype=object)
+        for col in ["FORMAT_DP", "FORMAT_GQ"]:
+            long[col] = pd.Series(dtype="Int64")
+        return long.drop(columns="_SITE")
+    rows = np.concatenate(rows)
+    carriers = np.concatenate(carriers)
+    order = np.argsort(carriers, kind="stable")
+    long = df.iloc[rows[order]].reset_index(drop=True)
+    long["SAMPLE"] = samples[carriers[order]]
+    long["ZIGOSITY"] = np.concatenate(zigosity)[order]
+    long["FORMAT_DP"] = pd.array(np.concatenate(dp)[order], dtype="Int64")
+    long["FORMAT_GQ"] = pd.array(np.concatenate(gq)[order], dtype="Int64")
+    long["FORMAT_AD"] = np.concatenate(ad)[order]
+    return long.drop(columns="_SITE")
+
+
+def _parse_variants(df1, pVCF, name, prioritized=True):
+    """
+    Runs the parsing steps shared by single and multi sample VCFs on the
+    variants read by `_read_vcf`: alternate allele splitting, annotation
+    parsing and prioritization, column formatting and cleaning.
+    """
+    logger.info(f"Splitting alternate alleles for {name}...")
+    df1 = _split_alternate_alleles(df1)
+    logger.info(f"Handling annotations for {name}...")
+    df1 = _handle_annotations(df1, pVCF)
+    if prioritized is True:
+        logger.info(f"Prioritizing variants for {name}...")
+        df1 = _prioritize_variants(df1)
+    elif isinstance(prioritized, dict):
+        logger.info(
+            f"""Prioritizing variants for {name}...
+            with custom prioritization {prioritized}"""
+        )
+        df1 = _prioritize_variants(df1, prioritized)
+    df1 = _format_ann_columns(df1, pVCF)
+    logger.info(f"Formatting ANN columns for {name}...")
+    df1 = _clean_df(df1)
+    logger.info(f"Cleaning DataFrame for {name}...")
+    df1["VARKEY"] = encode_variants(df1)
+    return df1
+
+
+def _split_alternate_alleles(df):
+    """
+    Splits rows with multiple alternate alleles into separate rows.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The input DataFrame with the genotype data to be processed.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A DataFrame with the same columns as `df`, where rows with multiple
+        alternate alleles have been split into separate rows.
+    """
+    splitdf = df.loc[df["ALT"].str.contains(",")].copy()
+    if len(splitdf) > 0:
+        ALT = (
+            splitdf["ALT"]
+            .astype(str)
+            .str.split(",", n=1, expand=True)
+            .stack()
+            .rename("ALT")
+        )
+        ALT.index = ALT.index.droplevel(-1)
+        ALT = ALT.to_frame()
+        splitdf = splitdf.join(ALT, lsuffix="_x", rsuffix="_y")
+        del ALT
+        splitdf["ALT"] = splitdf["ALT_y"].combine_first(splitdf["ALT_x"])
+        splitdf.drop(columns=["ALT_y", "ALT_x"], inplace=True)
+        splitdf.reset_index(inplace=True)
+        splitdf.drop(columns="index", inplace=True)
+    odd = splitdf.iloc[::2].copy()
+    even = splitdf.iloc[1::2].copy()
+    splitlist = [
+        "ID",
+        "AC",
+        "AF",
+        "SAMPLES_AF",
+        "MLEAC",
+        "MLEAF",
+        "VARTYPE",
+        "dbSNPBuildID",
+    ]
+    splitlist = [x for x in splitlist if x in df.columns]
+    splitlist += [x for x in df.columns if x.startswith(("1000", "CLINVAR"))]
+    for col in splitlist:
+        odd[col] = odd[col].astype(str).str.split(",", n=1).str[0]
+        even[col] = even[col].apply(
+            lambda x: (
+                x if len(str(x).split(",")) <= 1 else str(x).split(",", maxsplit=1)[1]
+            )
+        )
+    splitdf = (
+        pd.concat([odd, even])
+        .sort_index()
+        .replace(to_replace=[r"\(", r"\)"], value="", regex=True)
+    )
+    del odd, even
+    splitdf = splitdf[["CHROM", "POS", "REF", "ALT"] + splitlist]
+    df = df.merge(splitdf, on=["CHROM", "POS", "REF"], how="left")
+    splitlist.append("ALT")
+    xlist = [x + "_x" for x in splitlist]
+    ylist = [y + "_y" for y in splitlist]
+    del splitdf
+    for col in splitlist:
+        df[col] = df[col + "_y"].combine_first(df[col + "_x"])
+    del splitlist
+    df.drop(columns=xlist + ylist, inplace=True)
+    del xlist, ylist
+    df["POS"] = df["POS"].astype(int)
+    return df
+
+
+def _handle_annotations(df, pVCF):
+    """
+    Parses the 'ANN' column in a pandas DataFrame and extracts functional
+    annotations as separate columns.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Input DataFrame with 'ANN' column containing functional annotations
+        separated by commas.
+    pVCF : cyvcf2.Reader
+        A cyvcf2.Reader object representing the VCF file.
+
+    Returns:
+    --------
+    pandas.DataFrame
+        A new DataFrame with functional annotations as separate columns,
+        joined with the original DataFrame.
+    """
+    if "ANN" in df.columns:
+        anndf = df["ANN"]
+        annhead = pVCF.get_header_type("ANN")["Description"].strip(
+            '"Functional annotations: \'"'
+        )
+        annheaderlist = [x.strip() for x in annhead.split("|")]
+        anndf = anndf.str.split(",", expand=True).stack()
+        anndf = anndf.str.split("|", expand=True)
+        anndf.columns = annheaderlist
+        df.drop(columns="ANN", inplace=True)
+        anndf.index = anndf.index.droplevel(1)
+        df = df.join(anndf, how="inner")
+        del anndf
+        del annhead
+        del annheaderlist
+    return df
+
+
+def _prioritize_variants(df, IMPACT_SEVERITY=None):
+    """
+    Sort variants in a pandas DataFrame according to their severity.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The DataFrame containing the variants to be sorted.
+    IMPACT_SEVERITY : dict, optional
+        A dictionary that maps each variant type to its severity score.
+        The keys of the dictionary should be the names of the variant types
+        (e.g., 'missense_variant'), and the values should be integers
+        representing the severity score. If not provided, the default values for
+        severity scores will be used.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A new DataFrame with the same columns as the input DataFrame, but with
+        the variants sorted by their severity.
+
+    Notes
+    -----
+    This function assumes that the input DataFrame has columns named 'CHROM',
+    'POS', 'REF', 'ALT', 'Annotation', and 'HGVS.c'. The 'Annotation' column
+    should contain the variant types
+    (e.g., 'missense_variant&splice_region_variant'), and the 'HGVS.c' column
+    should contain the HGVS coding sequence notation for each variant
+    (e.g., 'NM_001005353.2:c.43A>G'). Variants with a null HGVS notation will be
+    sorted to the end.
+    """
+    if IMPACT_SEVERITY is None:
+        IMPACT_SEVERITY = {
+            "exon_loss_variant": 1,
+            "frameshift_variant": 2,
+            "stop_gained": 3,
+            "stop_lost": 4,
+            "start_lost": 5,
+            "splice_acceptor_variant": 6,
+            "splice_donor_variant": 7,
+            "disruptive_inframe_deletion": 8,
+            "conservative_inframe_deletion": 9,
+            "inframe_insertion": 10,
+            "disruptive_inframe_insertion": 11,
+            "conservative_inframe_insertion": 12,
+            "inframe_deletion": 13,
+            "missense_variant": 14,
+            "splice_region_variant": 15,
+            "stop_retained_variant": 16,
+            "initiator_codon_variant": 17,
+            "synonymous_variant": 18,
+            "start_retained": 19,
+            "coding_sequence_variant": 20,
+            "5_prime_UTR_variant": 21,
+            "3_prime_UTR_variant": 22,
+            "5_prime_UTR_premature_start_codon_gain_variant": 23,
+            "intron_variant": 24,
+            "non_coding_exon_variant": 25,
+            "upstream_gene_variant": 26,
+            "downstream_gene_variant": 27,
+            "TF_binding_site_variant": 28,
+            "regulatory_region_variant": 29,
+            "intergenic_region": 30,
+            "transcript": 31,
+        }
+    if 'Annotation' in df.columns:
+        df["sorter"] = df["Annotation"].str.split("&").str[0].replace(IMPACT_SEVERITY)
+        df.loc[df["HGVS.c"].str.contains("null"), "HGVS.c"] = None
+        df["sorter2"] = [x[0] == x[1] for x in zip(df["ALT"], df["Allele"])]
+        df = df.sort_values(
+            by=["CHROM", "POS", "sorter2", "sorter"],
+            ascending=[True, True, False, True],
+        ).drop_duplicates(["CHROM", "POS", "REF", "ALT"])
+        df.drop(columns=["sorter", "sorter2"], inplace=True)
+    return df
+
+
+def _format_ann_columns(df, pVCF):
+    """
+    Formats the columns of a pandas DataFrame containing variant annotation
+    data.
+
+    Parameters
+    ----------
+    df : ParsedVCF (pandas.DataFrame extension)
+        A DataFrame containing variant annotation data.
+    pVCF : cyvcf2.Reader
+        A cyvcf2.Reader object representing the VCF file.
+
+    Returns
+    -------
+    ParsedVCF (pandas.DataFrame extension)
+        The input DataFrame with formatted columns.
+
+    Notes
+    -----
+    The function applies the following transformations to the input DataFrame:
+
+    - All column names are converted to uppercase.
+    - If the DataFrame contains a column named 'HGVS.P', a new column named
+    'AMINOCHANGE'
+    is added, which contains the result of calling the `aminoChange` function
+    on the 'HGVS.P'
+    column.
+    - If the DataFrame contains a column named 'HOM', its values are converted
+    from boolean to
+    categorical ('HOM' and 'HET'). The 'HET' column is dropped if present. The
+    column name is changed to 'ZIGOSITY'.
+    - If the DataFrame contains a column named 'ESP6500_MAF', new columns named
+    'ESP6500_MAF_EA', 'ESP6500_MAF_AA', and 'ESP6500_MAF_ALL' are added,
+    containing the values of the corresponding fields in the 'ESP6500_MAF'
+    column. The values are converted from strings to floats and divided by 100.
+    The 'ESP6500_MAF' column is dropped.
+    - If the DataFrame contains a column named 'ESP6500_PH', new columns named
+    'POLYPHEN_PRED' and 'POLYPHEN_SCORE' are added, containing the values of the
+    corresponding fields in the 'ESP6500_PH' column. The 'POLYPHEN_PRED' values
+    are cleaned up by removing trailing dots and commas. The 'POLYPHEN_SCORE'
+    values are split on commas and the first element is kept. The 'ESP6500_PH'
+    column is dropped.
+    - The columns named 'ANNOTATION', 'ANNOTATION_IMPACT', and 'ID' are renamed
+    to 'EFFECT', 'IMPACT', and 'RSID', respectively.
+    - Columns with numeric data (according to the VCF header) are converted to
+    floats or integers, as appropriate. The columns named 'ESP6500_MAF_EA',
+    'ESP6500_MAF_AA', and 'ESP6500_MAF_ALL' are also converted to floats.
+    - The DataFrame is rounded to 6 decimal places.
+    - If the DataFrame contains a column named 'CLINVAR_CLNSIG', its values are
+    replaced with their corresponding meanings according to the
+    `clinvartranslation` dictionary.
+
+    """
+    df.columns = df.columns.str.upper()
+    if "HGVS.P" in df.columns:
+        df["AMINOCHANGE"] = df["HGVS.P"].apply(aminoChange)
+    if "HOM" in df.columns:
+        df["HOM"] = df["HOM"].replace({True: "HOM", np.nan: "HET", None: "HET"})
+        df.drop(columns="HET", inplace=True, errors="ignore")
+        df.rename(columns={"HOM": "ZIGOSITY"}, inplace=True)
+    if "ESP6500_MAF" in df.columns:
+        df[["ESP6500_MAF_EA", "ESP6500_MAF_AA", "ESP6500_MAF_ALL"]] = df[
+            "ESP6500_MAF"
+        ].str.split(",", expand=True)
+        df["ESP6500_MAF_EA"] = df["ESP6500_MAF_EA"].apply(divide, args=(100,))
+        df["ESP6500_MAF_AA"] = df["ESP6500_MAF_AA"].apply(divide, args=(100,))
+        df["ESP6500_MAF_ALL"] = df["ESP6500_MAF_ALL"].apply(divide, args=(100,))
+        df.drop(columns=["ESP6500_MAF"], inplace=True)
+    if "ESP6500_PH" in df.columns:
+        df[["POLYPHEN_PRED", "POLYPHEN_SCORE"]] = df["ESP6500_PH"].str.split(
+            ":", n=1, expand=True
+        )
+        df["POLYPHEN_PRED"] = df["POLYPHEN_PRED"].str.strip(".").str.strip(".,")
+        df["POLYPHEN_SCORE"] = df["POLYPHEN_SCORE"].str.split(",").str[0]
+        df.drop(columns=["ESP6500_PH"], inplace=True)
+    df.rename(
+        columns={
+            "ANNOTATION": "EFFECT",
+            "ANNOTATION_IMPACT": "IMPACT",
+            "ID": "RSID",
+        },
+        inplace=True,
+        errors="ignore",
+    )
+    numcols = list()
+    for x in pVCF.header_iter():
+        if x.type == "INFO":
+            if x["Type"] in ["Float", "Integer"]:
+                numcols.append(x["ID"])
+    numcols += ["ESP6500_MAF_EA", "ESP6500_MAF_AA", "ESP6500_MAF_ALL"]
+    numcols = list(
+        set([x.upper() for x in numcols for y in df.columns if x.upper() == y])
+    )
+    df[numcols] = df[numcols].apply(pd.to_numeric, errors="coerce", axis=1)
+    df = df.round(6)
+
+    if "CLINVAR_CLNSIG" in df.columns:
+        clinvartranslation = {
+            "255": "other",
+            "0": "Uncertain significance",
+            "1": "not provided",
+            "2": "Benign",
+            "3": "Likely Benign",
+            "4": "Likely pathogenic",
+            "5": "Pathogenic",
+            "6": "drug response",
+            "7": "histocompatibility",
+        }
+        for k, v in clinvartranslation.items():
+            df["CLINVAR_CLNSIG"] = df["CLINVAR_CLNSIG"].str.replace(k, v)
+    return df
+
+
+def _clean_df(df):
+    """
+    Replace missing and empty values in the DataFrame with the '.' character.
+    Convert the 'POS' column to integer type.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Input DataFrame to be cleaned.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Cleaned DataFrame with replaced missing and empty values and 'POS'
+        column as integer.
+
+    """
+    df.replace(["nan", "", np.nan], ".", inplace=True)
+    df.replace(to_replace=[None], value=".", inplace=True, regex=True)
+    df = df.astype("str")
+    df["POS"] = df["POS"].astype(int)
+    return df
+
 
 class ParsedVCF(pd.DataFrame):
     """
@@ -63,423 +624,89 @@ class ParsedVCF(pd.DataFrame):
         return ParsedVCF
 
     @classmethod
-    def from_vcf(cls, vcf, prioritized=True):
+    def from_vcf(cls, vcf, prioritized=True, threads=None):
         """
         Method that creates a ParsedVCF1 (a DataFrame) from a vcf file
         Parameters
         ----------
         vcf
-            Path to the vcf to parse.
+            Path to the vcf to parse, plain or gzip/bgzip compressed.
+        threads
+            BGZF decompression threads. Defaults to the configured cores.
         """
+        logger.info(f"Reading {vcf}...")
+        df1, name, pVCF, _ = _read_vcf(vcf, threads=threads)
+        df1 = _parse_variants(df1, pVCF, name, prioritized)
+        df1 = df1.pipe(ParsedVCF)
+        df1.name = name
+        return df1
 
-        def read_vcf(vcf):
-            """
-            Parse a VCF file and return a dictionary of variant information.
-
-            Parameters
-            ----------
-            vcf : str
-                The path to the VCF file to be parsed.
-
-            Returns
-            -------
-            pandas.DataFrame
-            A DataFrame containing variants data.
-            name : str
-                The name of the first sample in the VCF file, or the name of the
-                VCF file if no samples are present.
-            pVCF : cyvcf2.Reader
-                A cyvcf2.Reader object representing the VCF file.
-
-            Raises
-            ------
-            IOError
-                If the input VCF file cannot be found or opened.
-            """
-            logger.info("Parsing VCF File. %s" % vcf)
-            pVCF = cyvcf2.Reader(vcf)
-            try:
-                name = pVCF.samples[0]
-            except Exception:
-                name = vcf.split("/")[-1]
-            variants_dict = OrderedDict()
-            for variant in pVCF:
-                variants_dict[
-                    variant.CHROM
-                    + "+"
-                    + str(variant.POS)
-                    + "+"
-                    + variant.REF
-                    + "+"
-                    + ",".join(variant.ALT)
-                ] = {
-                    "ID": variant.ID,
-                    "QUAL": variant.QUAL,
-                    "FILTER": variant.FILTER,
-                }
-                variants_dict[
-                    variant.CHROM
-                    + "+"
-                    + str(variant.POS)
-                    + "+"
-                    + variant.REF
-                    + "+"
-                    + ",".join(variant.ALT)
-                ].update({k: v for (k, v) in variant.INFO})
-            df1 = pd.DataFrame.from_dict(variants_dict, orient="index")
-            del variants_dict
-            df1.index = df1.index.str.split("+", expand=True)
-            df1.index.names = ["CHROM", "POS", "REF", "ALT"]
-            df1.reset_index(inplace=True)
-            return df1, name, pVCF
-
-        def split_alternate_alleles(df):
-            """
-            Splits rows with multiple alternate alleles into separate rows.
-
-            Parameters
-            ----------
-            df : pandas.DataFrame
-                The input DataFrame with the genotype data to be processed.
-
-            Returns
-            -------
-            pandas.DataFrame
-                A DataFrame with the same columns as `df`, where rows with multiple
-                alternate alleles have been split into separate rows.
-            """
-            splitdf = df.loc[df["ALT"].str.contains(",")].copy()
-            if len(splitdf) > 0:
-                ALT = (
-                    splitdf["ALT"]
-                    .astype(str)
-                    .str.split(",", n=1, expand=True)
-                    .stack()
-                    .rename("ALT")
-                )
-                ALT.index = ALT.index.droplevel(-1)
-                ALT = ALT.to_frame()
-                splitdf = splitdf.join(ALT, lsuffix="_x", rsuffix="_y")
-                del ALT
-                splitdf["ALT"] = splitdf["ALT_y"].combine_first(splitdf["ALT_x"])
-                splitdf.drop(columns=["ALT_y", "ALT_x"], inplace=True)
-                splitdf.reset_index(inplace=True)
-                splitdf.drop(columns="index", inplace=True)
-            odd = splitdf.iloc[::2].copy()
-            even = splitdf.iloc[1::2].copy()
-            splitlist = [
-                "ID",
-                "AC",
-                "AF",
-                "SAMPLES_AF",
-                "MLEAC",
-                "MLEAF",
-                "VARTYPE",
-                "dbSNPBuildID",
-            ]
-            splitlist = [x for x in splitlist if x in df.columns]
-            splitlist += [x for x in df.columns if x.startswith(("1000", "CLINVAR"))]
-            for col in splitlist:
-                odd[col] = odd[col].astype(str).str.split(",", n=1).str[0]
-                even[col] = even[col].apply(
-                    lambda x: (
-                        x
-                        if len(str(x).split(",")) <= 1
-                        else str(x).split(",", maxsplit=1)[1]
-                    )
-                )
-            splitdf = (
-                pd.concat([odd, even])
-                .sort_index()
-                .replace(to_replace=[r"\(", r"\)"], value="", regex=True)
-            )
-            del odd, even
-            splitdf = splitdf[["CHROM", "POS", "REF", "ALT"] + splitlist]
-            df = df.merge(splitdf, on=["CHROM", "POS", "REF"], how="left")
-            splitlist.append("ALT")
-            xlist = [x + "_x" for x in splitlist]
-            ylist = [y + "_y" for y in splitlist]
-            del splitdf
-            for col in splitlist:
-                df[col] = df[col + "_y"].combine_first(df[col + "_x"])
-            del splitlist
-            df.drop(columns=xlist + ylist, inplace=True)
-            del xlist, ylist
-            df["POS"] = df["POS"].astype(int)
-            return df
-
-        def handle_annotations(df, pVCF):
-            """
-            Parses the 'ANN' column in a pandas DataFrame and extracts functional
-            annotations as separate columns.
-
-            Parameters:
-            -----------
-            df : pandas.DataFrame
-                Input DataFrame with 'ANN' column containing functional annotations
-                separated by commas.
-            pVCF : cyvcf2.Reader
-                A cyvcf2.Reader object representing the VCF file.
-
-            Returns:
-            --------
-            pandas.DataFrame
-                A new DataFrame with functional annotations as separate columns,
-                joined with the original DataFrame.
-            """
-            if "ANN" in df.columns:
-                anndf = df["ANN"]
-                annhead = pVCF.get_header_type("ANN")["Description"].strip(
-                    '"Functional annotations: \'"'
-                )
-                annheaderlist = [x.strip() for x in annhead.split("|")]
-                anndf = anndf.str.split(",", expand=True).stack()
-                anndf = anndf.str.split("|", expand=True)
-                anndf.columns = annheaderlist
-                df.drop(columns="ANN", inplace=True)
-                anndf.index = anndf.index.droplevel(1)
-                df = df.join(anndf, how="inner")
-                del anndf
-                del annhead
-                del annheaderlist
-            return df
-
-        def prioritize_variants(df, IMPACT_SEVERITY=None):
-            """
-            Sort variants in a pandas DataFrame according to their severity.
-
-            Parameters
-            ----------
-            df : pandas.DataFrame
-                The DataFrame containing the variants to be sorted.
-            IMPACT_SEVERITY : dict, optional
-                A dictionary that maps each variant type to its severity score.
-                The keys of the dictionary should be the names of the variant types
-                (e.g., 'missense_variant'), and the values should be integers
-                representing the severity score. If not provided, the default values for
-                severity scores will be used.
-
-            Returns
-            -------
-            pandas.DataFrame
-                A new DataFrame with the same columns as the input DataFrame, but with
-                the variants sorted by their severity.
-
-            Notes
-            -----
-            This function assumes that the input DataFrame has columns named 'CHROM',
-            'POS', 'REF', 'ALT', 'Annotation', and 'HGVS.c'. The 'Annotation' column
-            should contain the variant types
-            (e.g., 'missense_variant&splice_region_variant'), and the 'HGVS.c' column
-            should contain the HGVS coding sequence notation for each variant
-            (e.g., 'NM_001005353.2:c.43A>G'). Variants with a null HGVS notation will be
-            sorted to the end.
-            """
-            if IMPACT_SEVERITY is None:
-                IMPACT_SEVERITY = {
-                    "exon_loss_variant": 1,
-                    "frameshift_variant": 2,
-                    "stop_gained": 3,
-                    "stop_lost": 4,
-                    "start_lost": 5,
-                    "splice_acceptor_variant": 6,
-                    "splice_donor_variant": 7,
-                    "disruptive_inframe_deletion": 8,
-                    "conservative_inframe_deletion": 9,
-                    "inframe_insertion": 10,
-                    "disruptive_inframe_insertion": 11,
-                    "conservative_inframe_insertion": 12,
-                    "inframe_deletion": 13,
-                    "missense_variant": 14,
-                    "splice_region_variant": 15,
-                    "stop_retained_variant": 16,
-                    "initiator_codon_variant": 17,
-                    "synonymous_variant": 18,
-                    "start_retained": 19,
-                    "coding_sequence_variant": 20,
-                    "5_prime_UTR_variant": 21,
-                    "3_prime_UTR_variant": 22,
-                    "5_prime_UTR_premature_start_codon_gain_variant": 23,
-                    "intron_variant": 24,
-                    "non_coding_exon_variant": 25,
-                    "upstream_gene_variant": 26,
-                    "downstream_gene_variant": 27,
-                    "TF_binding_site_variant": 28,
-                    "regulatory_region_variant": 29,
-                    "intergenic_region": 30,
-                    "transcript": 31,
-                }
-            if 'Annotation' in df.columns:
-                df["sorter"] = (
-                    df["Annotation"].str.split("&").str[0].replace(IMPACT_SEVERITY)
-                )
-                df.loc[df["HGVS.c"].str.contains("null"), "HGVS.c"] = None
-                df["sorter2"] = [x[0] == x[1] for x in zip(df["ALT"], df["Allele"])]
-                df = df.sort_values(
-                    by=["CHROM", "POS", "sorter2", "sorter"],
-                    ascending=[True, True, False, True],
-                ).drop_duplicates(["CHROM", "POS", "REF", "ALT"])
-                df.drop(columns=["sorter", "sorter2"], inplace=True)
-            return df
-
-        def format_ann_columns(df, pVCF):
-            """
-            Formats the columns of a pandas DataFrame containing variant annotation
-            data.
-
-            Parameters
-            ----------
-            df : ParsedVCF (pandas.DataFrame extension)
-                A DataFrame containing variant annotation data.
-            pVCF : cyvcf2.Reader
-                A cyvcf2.Reader object representing the VCF file.
-
-            Returns
-            -------
-            ParsedVCF (pandas.DataFrame extension)
-                The input DataFrame with formatted columns.
-
-            Notes
-            -----
-            The function applies the following transformations to the input DataFrame:
-
-            - All column names are converted to uppercase.
-            - If the DataFrame contains a column named 'HGVS.P', a new column named
-            'AMINOCHANGE'
-            is added, which contains the result of calling the `aminoChange` function
-            on the 'HGVS.P'
-            column.
-            - If the DataFrame contains a column named 'HOM', its values are converted
-            from boolean to
-            categorical ('HOM' and 'HET'). The 'HET' column is dropped if present. The
-            column name is changed to 'ZIGOSITY'.
-            - If the DataFrame contains a column named 'ESP6500_MAF', new columns named
-            'ESP6500_MAF_EA', 'ESP6500_MAF_AA', and 'ESP6500_MAF_ALL' are added,
-            containing the values of the corresponding fields in the 'ESP6500_MAF'
-            column. The values are converted from strings to floats and divided by 100.
-            The 'ESP6500_MAF' column is dropped.
-            - If the DataFrame contains a column named 'ESP6500_PH', new columns named
-            'POLYPHEN_PRED' and 'POLYPHEN_SCORE' are added, containing the values of the
-            corresponding fields in the 'ESP6500_PH' column. The 'POLYPHEN_PRED' values
-            are cleaned up by removing trailing dots and commas. The 'POLYPHEN_SCORE'
-            values are split on commas and the first element is kept. The 'ESP6500_PH'
-            column is dropped.
-            - The columns named 'ANNOTATION', 'ANNOTATION_IMPACT', and 'ID' are renamed
-            to 'EFFECT', 'IMPACT', and 'RSID', respectively.
-            - Columns with numeric data (according to the VCF header) are converted to
-            floats or integers, as appropriate. The columns named 'ESP6500_MAF_EA',
-            'ESP6500_MAF_AA', and 'ESP6500_MAF_ALL' are also converted to floats.
-            - The DataFrame is rounded to 6 decimal places.
-            - If the DataFrame contains a column named 'CLINVAR_CLNSIG', its values are
-            replaced with their corresponding meanings according to the
-            `clinvartranslation` dictionary.
-
-            """
-            df.columns = df.columns.str.upper()
-            if "HGVS.P" in df.columns:
-                df["AMINOCHANGE"] = df["HGVS.P"].apply(aminoChange)
-            if "HOM" in df.columns:
-                df["HOM"] = df["HOM"].replace({True: "HOM", np.nan: "HET", None: "HET"})
-                df.drop(columns="HET", inplace=True, errors="ignore")
-                df.rename(columns={"HOM": "ZIGOSITY"}, inplace=True)
-            if "ESP6500_MAF" in df.columns:
-                df[["ESP6500_MAF_EA", "ESP6500_MAF_AA", "ESP6500_MAF_ALL"]] = df[
-                    "ESP6500_MAF"
-                ].str.split(",", expand=True)
-                df["ESP6500_MAF_EA"] = df["ESP6500_MAF_EA"].apply(divide, args=(100,))
-                df["ESP6500_MAF_AA"] = df["ESP6500_MAF_AA"].apply(divide, args=(100,))
-                df["ESP6500_MAF_ALL"] = df["ESP6500_MAF_ALL"].apply(divide, args=(100,))
-                df.drop(columns=["ESP6500_MAF"], inplace=True)
-            if "ESP6500_PH" in df.columns:
-                df[["POLYPHEN_PRED", "POLYPHEN_SCORE"]] = df["ESP6500_PH"].str.split(
-                    ":", n=1, expand=True
-                )
-                df["POLYPHEN_PRED"] = df["POLYPHEN_PRED"].str.strip(".").str.strip(".,")
-                df["POLYPHEN_SCORE"] = df["POLYPHEN_SCORE"].str.split(",").str[0]
-                df.drop(columns=["ESP6500_PH"], inplace=True)
-            df.rename(
-                columns={
-                    "ANNOTATION": "EFFECT",
-                    "ANNOTATION_IMPACT": "IMPACT",
-                    "ID": "RSID",
-                },
-                inplace=True,
-                errors="ignore",
-            )
-            numcols = list()
-            for x in pVCF.header_iter():
-                if x.type == "INFO":
-                    if x["Type"] in ["Float", "Integer"]:
-                        numcols.append(x["ID"])
-            numcols += ["ESP6500_MAF_EA", "ESP6500_MAF_AA", "ESP6500_MAF_ALL"]
-            numcols = list(
-                set([x.upper() for x in numcols for y in df.columns if x.upper() == y])
-            )
-            df[numcols] = df[numcols].apply(pd.to_numeric, errors="coerce", axis=1)
-            df = df.round(6)
-
-            if "CLINVAR_CLNSIG" in df.columns:
-                clinvartranslation = {
-                    "255": "other",
-                    "0": "Uncertain significance",
-                    "1": "not provided",
-                    "2": "Benign",
-                    "3": "Likely Benign",
-                    "4": "Likely pathogenic",
-                    "5": "Pathogenic",
-                    "6": "drug response",
-                    "7": "histocompatibility",
-                }
-                for k, v in clinvartranslation.items():
-                    df["CLINVAR_CLNSIG"] = df["CLINVAR_CLNSIG"].str.replace(k, v)
-            return df
-
-        def clean_df(df):
-            """
-            Replace missing and empty values in the DataFrame with the '.' character.
-            Convert the 'POS' column to integer type.
-
-            Parameters
-            ----------
-            df : pandas.DataFrame
-                Input DataFrame to be cleaned.
-
-            Returns
-            -------
-            pandas.DataFrame
-                Cleaned DataFrame with replaced missing and empty values and 'POS'
-                column as integer.
-
-            """
-            df.replace(["nan", "", np.nan], ".", inplace=True)
-            df.replace(to_replace=[None], value=".", inplace=True, regex=True)
-            df = df.astype("str")
-            df["POS"] = df["POS"].astype(int)
-            return df
+    @classmethod
+    def multisample_calls(cls, vcf, samples=None, prioritized=True):
+        """
+        Parses a multi sample (e.g. joint called) VCF into long format calls.
+
+        Variant annotations are parsed once for the whole VCF. Zygosity comes
+        from the genotype of each sample, which also provides its DP, GQ and AD
+        (REF,ALT) FORMAT fields.
+
+        Parameters
+        ----------
+        vcf : str
+            Path to the vcf to parse.
+        samples : list of str, optional
+            Samples to parse. If None, every sample in the VCF is parsed.
+        prioritized : bool or dict, optional
+            Prioritization of the variant annotations, as in `from_vcf`.
 
+        Returns
+        -------
+        ParsedVCF
+            One row per variant and sample carrying it, with a SAMPLE column
+            and FORMAT_DP, FORMAT_GQ and FORMAT_AD columns, sorted by sample.
+        """
         logger.info(f"Reading {vcf}...")
-        df1, name, pVCF = read_vcf(vcf)
-        logger.info(f"Splitting alternate alleles for {name}...")
-        df1 = split_alternate_alleles(df1)
-        logger.info(f"Handling annotations for {name}...")
-        df1 = handle_annotations(df1, pVCF)
-        if prioritized is True:
-            logger.info(f"Prioritizing variants for {name}...")
-            df1 = prioritize_variants(df1)
-        elif isinstance(prioritized, dict):
-            logger.info(
-                f"""Prioritizing variants for {name}...
-                with custom prioritization {prioritized}"""
-            )
-            df1 = prioritize_variants(df1, prioritized)
-        df1 = format_ann_columns(df1, pVCF)
-        logger.info(f"Formatting ANN columns for {name}...")
-        df1 = clean_df(df1)
-        logger.info(f"Cleaning DataFrame for {name}...")
-        df1 = df1.pipe(ParsedVCF)
+        df1, _, pVCF, calls = _read_vcf(vcf, samples=samples, genotypes=True)
+        if len(pVCF.samples) == 0:
+            logger.error("VCF has no samples to parse: %s" % vcf)
+            raise ValueError("VCF has no samples: %s" % vcf)
+        name = vcf.split("/")[-1]
+        df1["_SITE"] = np.arange(len(df1))
+        df1 = _parse_variants(df1, pVCF, name, prioritized)
+        logger.info(f"Extracting genotypes of {len(pVCF.samples)} samples...")
+        df1 = _genotype_calls(df1, calls, pVCF.samples).pipe(ParsedVCF)
         df1.name = name
         return df1
 
+    @classmethod
+    def from_multisample_vcf(cls, vcf, samples=None, prioritized=True):
+        """
+        Parses a multi sample VCF into one ParsedVCF per sample, without
+        splitting it into single sample files first.
+
+        Parameters
+        ----------
+        vcf : str
+            Path to the vcf to parse.
+        samples : list of str, optional
+            Samples to parse. If None, every sample in the VCF is parsed.
+        prioritized : bool or dict, optional
+            Prioritization of the variant annotations, as in `from_vcf`.
+
+        Returns
+        -------
+        OrderedDict
+            ParsedVCF of each sample, named after it, in the VCF sample order.
+            Samples that carry no variant are left out.
+        """
+        calls = cls.multisample_calls(vcf, samples=samples, prioritized=prioritized)
+        pvcfs = OrderedDict()
+        for sample, pvcf in calls.groupby("SAMPLE", sort=False):
+            pvcf = pvcf.drop(columns="SAMPLE").reset_index(drop=True).pipe(ParsedVCF)
+            pvcf.name = sample
+            pvcfs[sample] = pvcf
+        return pvcfs
+
     @classmethod
     def mp_parser(
         cls, *vcfs, cores=int(configuration.cfg["GENERAL"]["cores"]), prioritized=True
@@ -517,12 +744,17 @@ class ParsedVCF(pd.DataFrame):
                     cores = mp.cpu_count()
                 if cores > 1:
                     if len(vcfs) <= cores - 1:
-                        pool = mp.Pool(processes=len(vcfs))
+                        processes = len(vcfs)
                     else:
-                        pool = mp.Pool(processes=cores - 1)
+                        processes = cores - 1
                 else:
-                    pool = mp.Pool(processes=cores)
-                parameters = zip(vcfs, itertools.repeat(prioritized))
+                    processes = cores
+                pool = mp.Pool(processes=processes)
+                # share the cores between the parsers for BGZF decompression
+                threads = max(1, cores // processes)
+                parameters = zip(
+                    vcfs, itertools.repeat(prioritized), itertools.repeat(threads)
+                )
                 pvcfs = pool.starmap(cls.from_vcf, parameters)
                 pool.close()
                 pool.join()
@@ -776,14 +1008,33 @@ class ParsedVCF(pd.DataFrame):
             left = self
             right = pvcf2
 
-        # Hago el merge
-        mergedVCF = left.merge(
-            right,
-            on=["CHROM", "POS", "REF", "ALT"],
-            how="outer",
-            suffixes=("_" + self.name, "_" + pvcf2.name),
-            indicator=indicator,
-        )
+        # Hago el merge, sobre VARKEY si los dos lo tienen
+        if "VARKEY" in left.columns and "VARKEY" in right.columns:
+            mergedVCF = left.merge(
+                right.drop(columns=KEY_COLS),
+                on="VARKEY",
+                how="outer",
+                suffixes=("_" + self.name, "_" + pvcf2.name),
+                indicator=indicator,
+            )
+            # completo CHROM, POS, REF y ALT de las variantes que solo estan en right
+            rightonly = (mergedVCF[indicator] == "right_only").to_numpy()
+            if rightonly.any():
+                rightkeys = right[KEY_COLS + ["VARKEY"]].drop_duplicates("VARKEY")
+                rightkeys = rightkeys.set_index("VARKEY").reindex(
+                    mergedVCF.loc[rightonly, "VARKEY"]
+                )
+                for col in KEY_COLS:
+                    mergedVCF.loc[rightonly, col] = rightkeys[col].to_numpy()
+            mergedVCF["POS"] = mergedVCF["POS"].astype(int)
+        else:
+            mergedVCF = left.merge(
+                right,
+                on=KEY_COLS,
+                how="outer",
+                suffixes=("_" + self.name, "_" + pvcf2.name),
+                indicator=indicator,
+            )
         mergedVCF[indicator] = mergedVCF[indicator].astype(str)
         # columnas que deberían ser iguales y columnas que podrían ser distintas
         name_to_match = f'_{self.name}\\b'
@@ -1201,12 +1452,15 @@ class ParsedVCF(pd.DataFrame):
 
     def vcf_to_parquet(self, outpath, partition_cols=None, append=False):
         """
-        Save the dataframe as a parquet file
+        Save the dataframe as a parquet file, with the name of the ParsedVCF as
+        SAMPLE unless it already holds the calls of several samples (see
+        `multisample_calls`).
         """
         logger.info("Saving dataframe as parquet file")
         try:
             os.makedirs(outpath.rsplit("/", maxsplit=1)[0], exist_ok=True)
-            self['SAMPLE'] = str(self.name)
+            if "SAMPLE" not in self.columns:
+                self['SAMPLE'] = str(self.name)
             self.to_parquet(
                 outpath,
                 engine="pyarrow",
@@ -0,0 +1,43 @@
+"""
+Benchmarks of the variants DB: cohort frequencies and Parquet DB ingest.
+"""
+import itertools
+import os
+
+import pytest
+
+from MODApy.parquetvardb import ParquetVarDB
+from MODApy.variantsdb import VariantsDB
+
+from calcfreqs_benchmark import synthetic_vardb
+
+
+@pytest.mark.benchmark(group="calcfreqs")
+@pytest.mark.parametrize("nvariants,npatients", [(1000, 1000), (5000, 1000)])
+def bench_calcfreqs(benchmark, nvariants, npatients):
+    benchmark.pedantic(
+        VariantsDB.calcfreqs,
+        setup=lambda: ((synthetic_vardb(nvariants, npatients),), {}),
+        rounds=3,
+    )
+
+
+@pytest.mark.benchmark(group="parquetdb")
+def bench_buildDB(benchmark, synthetic_data, tmp_path):
+    patientpath = os.path.dirname(synthetic_data["patients"][0]) + "/"
+    dbpaths = (str(tmp_path / ("db%i" % x)) for x in itertools.count())
+    benchmark.pedantic(
+        ParquetVarDB.buildDB,
+        setup=lambda: ((), {"patientPath": patientpath, "dbpath": next(dbpaths)}),
+        rounds=3,
+    )
+
+
+@pytest.mark.benchmark(group="parquetdb")
+def bench_add_multisample_vcf(benchmark, synthetic_data, tmp_path):
+    dbpaths = (str(tmp_path / ("db%i" % x)) for x in itertools.count())
+    benchmark.pedantic(
+        ParquetVarDB.add_multisample_vcf,
+        setup=lambda: ((synthetic_data["cohort"], next(dbpaths)), {}),
+        rounds=3,
+    )
@@ -0,0 +1,140 @@
+"""
+Benchmarks of the VCF parsing and analysis hot paths of MODApy.vcfmgr.
+
+from_vcf is timed as a whole and stage by stage, each stage on the output of
+the previous one so regressions can be traced to a single step.
+"""
+import pytest
+
+from MODApy import vcfmgr
+from MODApy.vcfmgr import ParsedVCF
+
+
+@pytest.fixture(scope="module")
+def stages(synthetic_data):
+    """Input of each from_vcf stage, for the first synthetic patient."""
+    df, name, pVCF, _ = vcfmgr._read_vcf(synthetic_data["patients"][0])
+    inputs = {"split": df}
+    inputs["annotations"] = vcfmgr._split_alternate_alleles(df.copy())
+    inputs["prioritize"] = vcfmgr._handle_annotations(
+        inputs["annotations"].copy(), pVCF
+    )
+    inputs["format"] = vcfmgr._prioritize_variants(inputs["prioritize"].copy())
+    inputs["clean"] = vcfmgr._format_ann_columns(inputs["format"].copy(), pVCF)
+    return inputs, pVCF
+
+
+def _copying(df, *args):
+    """pedantic setup that hands each round a fresh copy of `df`."""
+    return lambda: ((df.copy(),) + args, {})
+
+
+def _copy_pvcf(pvcf):
+    """Copy of a ParsedVCF that keeps its name."""
+    copy = pvcf.copy()
+    copy.name = pvcf.name
+    return copy
+
+
+@pytest.mark.benchmark(group="from_vcf")
+def bench_from_vcf(benchmark, synthetic_data):
+    benchmark(ParsedVCF.from_vcf, synthetic_data["patients"][0])
+
+
+@pytest.mark.benchmark(group="from_vcf stages")
+def bench_read_vcf(benchmark, synthetic_data):
+    benchmark(vcfmgr._read_vcf, synthetic_data["patients"][0])
+
+
+@pytest.mark.benchmark(group="from_vcf stages")
+def bench_split_alternate_alleles(benchmark, stages):
+    inputs, _ = stages
+    benchmark.pedantic(
+        vcfmgr._split_alternate_alleles, setup=_copying(inputs["split"]), rounds=5
+    )
+
+
+@pytest.mark.benchmark(group="from_vcf stages")
+def bench_handle_annotations(benchmark, stages):
+    inputs, pVCF = stages
+    benchmark.pedantic(
+        vcfmgr._handle_annotations,
+        setup=_copying(inputs["annotations"], pVCF),
+        rounds=5,
+    )
+
+
+@pytest.mark.benchmark(group="from_vcf stages")
+def bench_prioritize_variants(benchmark, stages):
+    inputs, _ = stages
+    benchmark.pedantic(
+        vcfmgr._prioritize_variants, setup=_copying(inputs["prioritize"]), rounds=5
+    )
+
+
+@pytest.mark.benchmark(group="from_vcf stages")
+def bench_format_ann_columns(benchmark, stages):
+    inputs, pVCF = stages
+    benchmark.pedantic(
+        vcfmgr._format_ann_columns, setup=_copying(inputs["format"], pVCF), rounds=5
+    )
+
+
+@pytest.mark.benchmark(group="from_vcf stages")
+def bench_clean_df(benchmark, stages):
+    inputs, _ = stages
+    benchmark.pedantic(vcfmgr._clean_df, setup=_copying(inputs["clean"]), rounds=5)
+
+
+@pytest.mark.benchmark(group="from_vcf")
+def bench_mp_parser(benchmark, synthetic_data):
+    benchmark.pedantic(
+        ParsedVCF.mp_parser, args=tuple(synthetic_data["patients"]), rounds=3
+    )
+
+
+@pytest.mark.benchmark(group="from_vcf")
+def bench_multisample_calls(benchmark, synthetic_data):
+    benchmark.pedantic(
+        ParsedVCF.multisample_calls, args=(synthetic_data["cohort"],), rounds=3
+    )
+
+
+@pytest.mark.benchmark(group="analysis")
+def bench_duos(benchmark, parsed_patients):
+    pvcf1, pvcf2 = parsed_patients[:2]
+    benchmark.pedantic(
+        lambda pvcf1, pvcf2: pvcf1.duos(pvcf2),
+        setup=lambda: ((_copy_pvcf(pvcf1), _copy_pvcf(pvcf2)), {}),
+        rounds=5,
+    )
+
+
+@pytest.mark.benchmark(group="analysis")
+def bench_trios(benchmark, parsed_patients):
+    pvcf1, pvcf2, pvcf3 = parsed_patients[:3]
+    benchmark.pedantic(
+        lambda pvcf1, pvcf2, pvcf3: pvcf1.duos(pvcf2).duos(pvcf3),
+        setup=lambda: (tuple(_copy_pvcf(x) for x in (pvcf1, pvcf2, pvcf3)), {}),
+        rounds=5,
+    )
+
+
+@pytest.mark.benchmark(group="analysis")
+def bench_panel(benchmark, synthetic_data, parsed_patients):
+    pvcf = parsed_patients[0]
+    benchmark.pedantic(
+        lambda pvcf: pvcf.panel(synthetic_data["panel"]),
+        setup=lambda: ((_copy_pvcf(pvcf),), {}),
+        rounds=5,
+    )
+
+
+@pytest.mark.benchmark(group="output")
+def bench_vcf_to_excel(benchmark, parsed_patients, tmp_path):
+    pvcf = parsed_patients[0]
+    benchmark.pedantic(
+        lambda pvcf: pvcf.vcf_to_excel(str(tmp_path / "pat1.xlsx")),
+        setup=lambda: ((_copy_pvcf(pvcf),), {}),
+        rounds=3,
+    )
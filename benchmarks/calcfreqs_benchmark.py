@@ -0,0 +1,86 @@
+"""
+Benchmark of VariantsDB.calcfreqs over synthetic wide DBs.
+
+Compares the vectorized implementation against the previous row-wise one for
+1k/5k variants x 1k/5k patients. With MODApy installed (pip install -e .),
+run from the repository root with:
+
+    python benchmarks/calcfreqs_benchmark.py
+"""
+import itertools
+import time
+
+from MODApy.variantsdb import VariantsDB
+
+import numpy as np
+
+import pandas as pd
+
+
+SHAPES = list(itertools.product([1000, 5000], [1000, 5000]))
+
+
+def synthetic_vardb(nvariants, npatients, carrier_rate=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    calls = rng.choice(
+        np.array([".", "HET", "HOM"], dtype=object),
+        size=(nvariants, npatients),
+        p=[1 - carrier_rate, carrier_rate * 0.7, carrier_rate * 0.3],
+    )
+    index = pd.MultiIndex.from_arrays(
+        [
+            np.repeat("1", nvariants),
+            np.arange(nvariants) + 1,
+            np.repeat("A", nvariants),
+            np.repeat("T", nvariants),
+            np.repeat("GENE", nvariants),
+            np.repeat(".", nvariants),
+            np.repeat(".", nvariants),
+        ],
+        names=["CHROM", "POS", "REF", "ALT", "GENE_NAME", "HGVS.C", "HGVS.P"],
+    )
+    columns = ["PAT%05d" % x for x in range(npatients)]
+    return pd.DataFrame(calls, index=index, columns=columns).pipe(VariantsDB)
+
+
+def calcfreqs_rowwise(db):
+    """Previous implementation, kept as the benchmark reference."""
+    patients = db.columns.tolist()
+    db.replace({".": np.nan}, inplace=True)
+    db["FREQ"] = db[patients].notnull().sum(axis=1) / len(patients)
+    db["ALLELE_FREQ"] = db[patients].apply(
+        lambda x: ((x.str.contains("HOM") * 2 + x.str.contains("HET") * 1).sum())
+        / len(patients * 2),
+        axis=1,
+    )
+    cols = db.columns.tolist()
+    cols.remove("FREQ")
+    cols.remove("ALLELE_FREQ")
+    db = db[["ALLELE_FREQ", "FREQ"] + cols]
+    db.replace({np.nan: "."}, inplace=True)
+    return db
+
+
+def timed(func, db):
+    start = time.perf_counter()
+    result = func(db)
+    return time.perf_counter() - start, result
+
+
+def main():
+    print(
+        "%10s %10s %12s %12s %8s" % ("variants", "patients", "rowwise", "vector", "x")
+    )
+    for nvariants, npatients in SHAPES:
+        old, expected = timed(calcfreqs_rowwise, synthetic_vardb(nvariants, npatients))
+        new, result = timed(VariantsDB.calcfreqs, synthetic_vardb(nvariants, npatients))
+        np.testing.assert_allclose(result["FREQ"], expected["FREQ"])
+        np.testing.assert_allclose(result["ALLELE_FREQ"], expected["ALLELE_FREQ"])
+        print(
+            "%10i %10i %11.3fs %11.3fs %7.1fx"
+            % (nvariants, npatients, old, new, old / new)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Fixtures of the benchmark suite.
+
+The synthetic data is generated once in benchmarks/.data and reused across
+runs. Its scale is taken from the MODAPY_BENCH_SCALE environment variable
+(small, exome or genome, small by default).
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+
+BENCH_PATH = Path(__file__).parent
+sys.path.insert(0, str(BENCH_PATH.parent / "tests" / "scripts"))
+
+from generate_test_data import generate_synthetic_data  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def output_in_tmp_path(tmp_path, monkeypatch):
+    """Runs each benchmark from its tmp_path, so the plots and reports written
+    to the working directory (e.g. venn.png) do not end up in the repo."""
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture(scope="session")
+def bench_scale():
+    return os.environ.get("MODAPY_BENCH_SCALE", "small")
+
+
+@pytest.fixture(scope="session")
+def synthetic_data(bench_scale):
+    return generate_synthetic_data(str(BENCH_PATH / ".data"), scale=bench_scale)
+
+
+@pytest.fixture(scope="session")
+def parsed_patients(synthetic_data):
+    """Parsed synthetic patients, shared by the session. Benchmarks that
+    modify their inputs must run on copies."""
+    from MODApy.vcfmgr import ParsedVCF
+
+    return [ParsedVCF.from_vcf(x) for x in synthetic_data["patients"]]
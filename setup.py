@@ -36,6 +36,7 @@ setuptools.setup(
     install_requires=[
         "pandas>=1.3.0,<2.0.0",
         "numpy",
+        "pyarrow",
         "configparser",
         "argparse",
         "Cython",
@@ -53,6 +54,7 @@ setuptools.setup(
         "rq",
         "uvicorn",
     ],
+    extras_require={"coverage": ["pysam"], "bench": ["pytest-benchmark"]},
     entry_points={
         # Command line scripts
         "console_scripts": ["MODApy=MODApy.cmd_line:main"]
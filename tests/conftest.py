@@ -1,12 +1,40 @@
+import logging
+import os
 import pickle
 from pathlib import Path
 
+from MODApy import pipeline
+
 import pytest
 
 
 TEST_DATA_PATH = Path("tests/test_data/")
 
 
+@pytest.fixture(scope="session", autouse=True)
+def log_files(tmp_path_factory):
+    """
+    Points the file handlers of the MODApy loggers to a temporary directory,
+    so test runs do not write to the MODApy/logs of the checkout.
+    """
+    logdir = tmp_path_factory.mktemp("logs")
+    handlers = [
+        x
+        for x in logging.getLogger().handlers + pipeline.logger2.handlers
+        if isinstance(x, logging.FileHandler)
+    ]
+    saved = []
+    for handler in handlers:
+        path = str(logdir / os.path.basename(handler.baseFilename))
+        stream = open(path, "a", encoding=handler.encoding)
+        saved.append((handler, handler.baseFilename, handler.setStream(stream)))
+        handler.baseFilename = path
+    yield logdir
+    for handler, filename, stream in saved:
+        handler.setStream(stream).close()
+        handler.baseFilename = filename
+
+
 @pytest.fixture(scope="session")
 def test_data_path():
     return TEST_DATA_PATH
@@ -1,9 +1,58 @@
+import argparse
+import os
 import pickle
 
 from MODApy import vcfanalysis, vcfmgr
 
+import numpy as np
+
 import pandas as pd
 
+# Number of variant sites of the synthetic data sets
+SCALES = {"small": 2000, "exome": 60000, "genome": 4500000}
+CHROMS = [str(x) for x in range(1, 23)] + ["X"]
+EFFECTS = [
+    ("missense_variant", "MODERATE", 0.25),
+    ("synonymous_variant", "LOW", 0.2),
+    ("intron_variant", "MODIFIER", 0.3),
+    ("3_prime_UTR_variant", "MODIFIER", 0.1),
+    ("splice_region_variant", "LOW", 0.05),
+    ("stop_gained", "HIGH", 0.04),
+    ("frameshift_variant", "HIGH", 0.03),
+    ("upstream_gene_variant", "MODIFIER", 0.03),
+]
+ANN_FIELDS = (
+    "Allele | Annotation | Annotation_Impact | Gene_Name | Gene_ID | Feature_Type | "
+    "Feature_ID | Transcript_BioType | Rank | HGVS.c | HGVS.p | cDNA.pos / cDNA.length"
+    " | CDS.pos / CDS.length | AA.pos / AA.length | Distance | ERRORS / WARNINGS / INFO"
+)
+HEADER_FIELDS = [
+    ("FORMAT", "GT", "1", "String", "Genotype"),
+    ("FORMAT", "AD", ".", "Integer", "Allelic depths for the ref and alt alleles"),
+    ("FORMAT", "DP", "1", "Integer", "Approximate read depth"),
+    ("FORMAT", "GQ", "1", "Integer", "Genotype Quality"),
+    ("INFO", "AC", "A", "Integer", "Allele count in genotypes"),
+    ("INFO", "SAMPLES_AF", "A", "Float", "Allele Frequency"),
+    ("INFO", "AN", "1", "Integer", "Total number of alleles in called genotypes"),
+    ("INFO", "DP", "1", "Integer", "Approximate read depth"),
+    ("INFO", "MQ", "1", "Float", "RMS Mapping Quality"),
+    ("INFO", "QD", "1", "Float", "Variant Confidence/Quality by Depth"),
+    ("INFO", "VARTYPE", "A", "Flag", "Variant types {SNP,MNP,INS,DEL,Mixed}"),
+    ("INFO", "SNP", "0", "Flag", "Variant is a SNP"),
+    ("INFO", "INS", "0", "Flag", "Variant is an insertion"),
+    ("INFO", "DEL", "0", "Flag", "Variant is an deletion"),
+    ("INFO", "HOM", "0", "Flag", "Variant is homozygous"),
+    ("INFO", "HET", "0", "Flag", "Variant is heterozygous"),
+    ("INFO", "dbSNPBuildID", "1", "Integer", "First dbSNP Build for RS"),
+    ("INFO", "ANN", ".", "String", "Functional annotations: '%s' " % ANN_FIELDS),
+    ("INFO", "1000Gp3_AF", "A", "Float", "Estimated allele frequency"),
+    ("INFO", "CLINVAR_CLNSIG", ".", "String", "Variant Clinical Significance"),
+    ("INFO", "ESP6500_MAF", ".", "String", "Minor Allele Frequency in percent"),
+]
+VCF_HEADER = "##fileformat=VCFv4.1\n" + "".join(
+    '##%s=<ID=%s,Number=%s,Type=%s,Description="%s">\n' % x for x in HEADER_FIELDS
+)
+
 
 def generate_parsed_vcf_data():
     """Generate a pickled ParsedVCF object from a VCF file."""
@@ -51,8 +100,219 @@ def generate_trios_data():
         pickle.dump(df, f)
 
 
+def synthetic_sites(nvariants, seed=0):
+    """
+    Generate the variant sites of a synthetic annotated cohort.
+
+    Sites are spread over the autosomes and X in position order, about 20 per
+    gene, with a mix of SNVs, deletions, insertions and multiallelic sites, and
+    one to three SnpEff annotations each.
+    """
+    rng = np.random.default_rng(seed)
+    chroms = np.sort(rng.choice(len(CHROMS), size=nvariants))
+    pos = np.zeros(nvariants, dtype=np.int64)
+    for chrom in np.unique(chroms):
+        inchrom = chroms == chrom
+        pos[inchrom] = np.sort(
+            rng.choice(np.arange(10000, 150000000), inchrom.sum(), replace=False)
+        )
+    bases = np.array(list("ACGT"))
+    ref = bases[rng.integers(0, 4, nvariants)].astype(object)
+    alt = bases[(rng.integers(1, 4, nvariants) + rng.integers(0, 4, nvariants)) % 4]
+    alt = np.where(alt == ref, "T", alt).astype(object)
+    alt = np.where(alt == ref, "G", alt).astype(object)
+    kind = rng.choice(
+        ["SNP", "DEL", "INS", "MULTI"], nvariants, p=[0.85, 0.07, 0.05, 0.03]
+    )
+    ref[kind == "DEL"] = ref[kind == "DEL"] + "AG"
+    alt[kind == "INS"] = alt[kind == "INS"] + "CT"
+    alt[kind == "MULTI"] = alt[kind == "MULTI"] + ",A" + ref[kind == "MULTI"]
+    effects = rng.choice(len(EFFECTS), nvariants, p=[x[2] for x in EFFECTS])
+    return pd.DataFrame(
+        {
+            "CHROM": np.array(CHROMS)[chroms],
+            "POS": pos,
+            "REF": ref,
+            "ALT": alt,
+            "KIND": kind,
+            "GENE": ["GENE%05d" % x for x in np.arange(nvariants) // 20],
+            "EFFECT": effects,
+            "NANN": rng.integers(1, 4, nvariants),
+            "AF": rng.random(nvariants).round(4),
+        }
+    )
+
+
+def _info(site, zigosity=None):
+    effect, impact, _ = EFFECTS[site.EFFECT]
+    alts = site.ALT.split(",")
+    ann = ",".join(
+        "%s|%s|%s|%s|%s|transcript|NM_%06d.%i|protein_coding|2/10|c.%iA>T|"
+        "p.Ala%iVal|||||"
+        % (
+            a,
+            effect,
+            impact,
+            site.GENE,
+            site.GENE,
+            site.POS % 999983,
+            t + 1,
+            site.POS % 3000,
+            site.POS % 1000,
+        )
+        for a in alts
+        for t in range(site.NANN)
+    )
+    vartype = "SNP" if site.KIND in ("SNP", "MULTI") else site.KIND
+    info = [
+        "AC=%s" % ",".join(["1"] * len(alts)),
+        "SAMPLES_AF=%s" % ",".join(["0.500"] * len(alts)),
+        "AN=2",
+        "DP=%i" % (20 + site.POS % 80),
+        "MQ=60.00",
+        "QD=%.2f" % (2 + (site.POS % 3000) / 100),
+        vartype,
+    ]
+    if zigosity is not None:
+        info.append(zigosity)
+    info += [
+        "VARTYPE=%s" % vartype,
+        "dbSNPBuildID=%i" % (100 + site.POS % 50),
+        "ANN=" + ann,
+        "1000Gp3_AF=%s" % ",".join([str(site.AF)] * len(alts)),
+    ]
+    if site.EFFECT == 0:
+        info += ["CLINVAR_CLNSIG=%i" % (site.POS % 6), "ESP6500_MAF=1.5,2.0,1.7"]
+    return ";".join(info)
+
+
+def write_synthetic_vcf(path, sites, samples=("SAMPLE",), carrier_rate=0.6, seed=0):
+    """
+    Write a synthetic annotated VCF with the given sites.
+
+    Single sample VCFs hold the sites the sample carries (about `carrier_rate`
+    of them) with HOM/HET INFO flags, as the pipeline outputs. Multi sample
+    VCFs hold every site with a genotype for each sample, as joint called
+    cohorts.
+    """
+    rng = np.random.default_rng(seed)
+    ncalls = (len(sites), len(samples))
+    carried = rng.random(ncalls) < carrier_rate
+    hom = rng.random(ncalls) < 0.35
+    depth = rng.integers(10, 100, ncalls)
+    with open(path, "w") as f:
+        f.write(VCF_HEADER)
+        for chrom in CHROMS:
+            f.write("##contig=<ID=chr%s>\n" % chrom)
+        f.write(
+            "\t".join(
+                ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO"]
+                + ["FORMAT"]
+                + list(samples)
+            )
+            + "\n"
+        )
+        for i, site in enumerate(sites.itertuples(index=False)):
+            if len(samples) == 1 and not carried[i, 0]:
+                continue
+            gts = []
+            for j in range(len(samples)):
+                gt = "0/0"
+                if carried[i, j]:
+                    gt = "1/1" if hom[i, j] else "0/1"
+                alt = depth[i, j] // 2 if gt == "0/1" else depth[i, j]
+                if gt == "0/0":
+                    alt = 0
+                ad = ",".join(
+                    [str(depth[i, j] - alt), str(alt)] + ["0"] * site.ALT.count(",")
+                )
+                gts.append("%s:%s:%i:%i" % (gt, ad, depth[i, j], 20 + depth[i, j] % 80))
+            zigosity = None
+            if len(samples) == 1:
+                zigosity = "HOM" if hom[i, 0] else "HET"
+            f.write(
+                "\t".join(
+                    [
+                        "chr" + site.CHROM,
+                        str(site.POS),
+                        "rs%i" % (i + 1) if i % 3 else ".",
+                        site.REF,
+                        site.ALT,
+                        "%.2f" % (50 + site.POS % 2000),
+                        "PASS",
+                        _info(site, zigosity),
+                        "GT:AD:DP:GQ",
+                    ]
+                    + gts
+                )
+                + "\n"
+            )
+    return path
+
+
+def write_synthetic_panel(path, sites, ngenes=100):
+    """Write a panel xlsx with the first `ngenes` genes of the sites."""
+    genes = sites["GENE"].unique()[:ngenes]
+    pd.DataFrame({"GeneSymbol": genes}).to_excel(
+        path, sheet_name="GeneList", index=False
+    )
+    return path
+
+
+def generate_synthetic_data(outdir, scale="small", npatients=3, seed=0):
+    """
+    Generate a synthetic data set: `npatients` single sample VCFs drawn from
+    the same sites (so duos and trios share variants), a multi sample VCF of
+    all of them and a gene panel.
+
+    Files already generated with the same scale and seed are reused.
+
+    Returns
+    -------
+    dict
+        Paths of the "patients" VCFs, the "cohort" VCF and the "panel".
+    """
+    outdir = os.path.join(outdir, "%s_%i" % (scale, seed))
+    os.makedirs(outdir, exist_ok=True)
+    paths = {
+        "patients": [
+            os.path.join(outdir, "pat%i.final.vcf" % (x + 1)) for x in range(npatients)
+        ],
+        "cohort": os.path.join(outdir, "cohort.vcf"),
+        "panel": os.path.join(outdir, "panel.xlsx"),
+    }
+    if all(os.path.exists(x) for x in paths["patients"] + [paths["cohort"]]):
+        return paths
+    sites = synthetic_sites(SCALES[scale], seed=seed)
+    for i, path in enumerate(paths["patients"]):
+        write_synthetic_vcf(path, sites, samples=["PAT%i" % (i + 1)], seed=seed + i)
+    write_synthetic_vcf(
+        paths["cohort"],
+        sites,
+        samples=["PAT%i" % (x + 1) for x in range(npatients)],
+        seed=seed,
+    )
+    write_synthetic_panel(paths["panel"], sites)
+    return paths
+
+
 if __name__ == "__main__":
-    generate_parsed_vcf_data()
-    generate_single_data()
-    generate_duos_data()
-    generate_trios_data()
+    parser = argparse.ArgumentParser(description="Generate MODApy test data")
+    parser.add_argument(
+        "--synthetic",
+        choices=list(SCALES),
+        help="Generate a synthetic data set of this scale instead of the pickles",
+    )
+    parser.add_argument(
+        "--outdir",
+        default="../../benchmarks/.data",
+        help="Output folder of the synthetic data set",
+    )
+    args = parser.parse_args()
+    if args.synthetic:
+        print(generate_synthetic_data(args.outdir, scale=args.synthetic))
+    else:
+        generate_parsed_vcf_data()
+        generate_single_data()
+        generate_duos_data()
+        generate_trios_data()
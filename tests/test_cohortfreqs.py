@@ -0,0 +1,71 @@
+from MODApy.cohortfreqs import CohortFreqs, default_freqs_path
+from MODApy.sampletable import SampleTable
+
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture
+def calls():
+    return pd.DataFrame(
+        {
+            "CHROM": ["1", "1", "1", "2", "1", "2", "2"],
+            "POS": [100, 100, 200, 50, 100, 50, 50],
+            "REF": ["A", "A", "C", "G", "A", "G", "G"],
+            "ALT": ["T", "T", "G", "A", "T", "A", "A"],
+            "ZIGOSITY": ["HOM", "HOM", "HET", "HET", "HET", "HOM", "HOM"],
+            "SAMPLE": ["P1", "P1", "P1", "P1", "P2", "P2", "P2"],
+        }
+    )
+
+
+def test_from_parquetdb(calls, tmp_path):
+    dbpath = str(tmp_path / "vardb.parquet")
+    calls.to_parquet(dbpath, engine="pyarrow", partition_cols=["SAMPLE"])
+    freqs = CohortFreqs.from_parquetdb(dbpath)
+    assert freqs.samples == ["P1", "P2"]
+    freqs = freqs.set_index(["CHROM", "POS"])
+    assert freqs.loc[("1", 100), "N_CARRIERS"] == 2
+    assert freqs.loc[("1", 100), "N_HOM"] == 1
+    assert freqs.loc[("1", 100), "ALLELE_FREQ"] == pytest.approx(0.75)
+    assert freqs.loc[("1", 200), "FREQ"] == pytest.approx(0.5)
+    assert freqs.loc[("2", 50), "ALLELE_FREQ"] == pytest.approx(0.75)
+
+
+def test_add_samples_matches_full_build(calls, tmp_path):
+    full = CohortFreqs.from_counts(CohortFreqs.count_calls(calls), ["P1", "P2"])
+    incremental = CohortFreqs.empty()
+    incremental = incremental.add_samples(calls[calls["SAMPLE"] == "P1"])
+    incremental = incremental.add_samples(calls[calls["SAMPLE"] == "P2"])
+    # Samples already in the table are not counted twice
+    incremental = incremental.add_samples(calls[calls["SAMPLE"] == "P2"])
+    assert incremental.samples == ["P1", "P2"]
+    pd.testing.assert_frame_equal(pd.DataFrame(incremental), pd.DataFrame(full))
+
+
+def test_write_and_read_region(calls, tmp_path):
+    path = str(tmp_path / "vardb_freqs.parquet")
+    freqs = CohortFreqs.from_counts(CohortFreqs.count_calls(calls), ["P1", "P2"])
+    freqs.write(path, row_group_size=1)
+    region = CohortFreqs.read(path, chrom="1", start=150, end=250)
+    assert region.samples == ["P1", "P2"]
+    assert region["POS"].tolist() == [200]
+    annotated = freqs.get_freqs(
+        pd.DataFrame({"CHROM": [2, 3], "POS": [50, 1], "REF": "G", "ALT": "A"})
+    )
+    assert annotated["N_CARRIERS"].iloc[0] == 2
+    assert annotated["FREQ"].isna().iloc[1]
+
+
+def test_default_freqs_path():
+    assert default_freqs_path("/data/db.parquet/") == "/data/db_freqs.parquet"
+    assert default_freqs_path("/data/v1.2/db") == "/data/v1.2/db_freqs.parquet"
+
+
+def test_sampletable_requires_counts():
+    class Table(SampleTable):
+        COLUMNS = ["CHROM"]
+
+    with pytest.raises(TypeError):
+        Table.empty()
@@ -0,0 +1,168 @@
+import os
+import sys
+
+import numpy as np
+
+from MODApy import cmd_line, coverage
+
+import pandas as pd
+
+import pytest
+
+
+EXONS = [
+    ("chr1", 100, 120, "GENA_1"),
+    ("chr1", 150, 160, "GENA_2"),
+    ("chr2", 10, 20, "GENB_1"),
+]
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 1000])
+def test_histogram_stats_matches_describe(size):
+    depths = np.random.default_rng(size).integers(0, 60, size)
+    expected = pd.Series(depths).describe().drop("count").values
+    stats = coverage.histogram_stats(np.bincount(depths))
+    assert np.allclose(stats, expected, equal_nan=True)
+
+
+def test_block_depth():
+    depth = coverage.block_depth([(5, 15), (8, 12), (0, 100), (20, 30)], 10, 20)
+    assert depth.tolist() == [3, 3, 2, 2, 2, 1, 1, 1, 1, 1]
+
+
+def test_targets():
+    assert coverage.restrict_targets(EXONS, [("chr1", 110, 155)]) == [
+        ("chr1", 110, 120, "GENA_1"),
+        ("chr1", 150, 155, "GENA_2"),
+    ]
+    blocks = coverage.target_blocks(EXONS, max_gap=30)
+    assert [x[:3] for x in blocks] == [("chr1", 100, 160), ("chr2", 10, 20)]
+    blocks = coverage.target_blocks(EXONS, max_gap=30, block_size=30)
+    assert [x[:3] for x in blocks] == [
+        ("chr1", 100, 120),
+        ("chr1", 150, 160),
+        ("chr2", 10, 20),
+    ]
+
+
+def test_target_coverage(tmp_path):
+    pysam = pytest.importorskip("pysam")
+    header = {"HD": {"VN": "1.6", "SO": "coordinate"}}
+    header["SQ"] = [{"SN": "chr1", "LN": 1000}, {"SN": "chr2", "LN": 1000}]
+    bam = str(tmp_path / "sample.bam")
+    with pysam.AlignmentFile(bam, "wb", header=header) as out:
+        for i, (contig, start) in enumerate([(0, 95), (0, 110), (1, 0)]):
+            read = pysam.AlignedSegment()
+            read.query_name = "read%i" % i
+            read.query_sequence = "A" * 20
+            read.reference_id = contig
+            read.reference_start = start
+            read.cigarstring = "20M"
+            read.mapping_quality = 60
+            out.write(read)
+    pysam.index(bam)
+    bed = str(tmp_path / "exons.bed")
+    with open(bed, "w") as f:
+        for exon in EXONS:
+            f.write("%s\t%i\t%i\t%s\n" % exon)
+    genes, exons = coverage.target_coverage(bam, bed)
+    # GENA_1: 100-115 covered once, 110-115 twice, 115-120 once
+    depths = pd.Series([1] * 10 + [2] * 5 + [1] * 5)
+    expected = depths.describe().drop("count")
+    assert np.allclose(exons.loc[("GENA_1", "chr1")].values, expected.values)
+    assert exons.loc[("GENA_2", "chr1")]["max"] == 0
+    assert exons.loc[("GENB_1", "chr2")]["mean"] == 1
+    assert list(genes.index) == [("GENA", "chr1"), ("GENB", "chr2")]
+    expected = pd.concat([depths, pd.Series([0] * 10)]).describe().drop("count")
+    assert np.allclose(genes.loc[("GENA", "chr1")].values, expected.values)
+
+
+# Fake bedtools: genomecov prints the "BAM" (a bedgraph) and intersect clips
+# the intervals of -a to those of -b. Both warn on stderr.
+BEDTOOLS = """#!%s
+import sys
+args = sys.argv[1:]
+sys.stderr.write("warning: fake bedtools\\n")
+
+
+def read(path):
+    with open(path) as f:
+        return [line.rstrip("\\n").split("\\t") for line in f]
+
+
+if args[0] == "genomecov":
+    sys.stdout.write(open(args[args.index("-ibam") + 1]).read())
+else:
+    a = read(args[args.index("-a") + 1])
+    b = read(args[args.index("-b") + 1])
+    for x in a:
+        for y in b:
+            start = max(int(x[1]), int(y[1]))
+            end = min(int(x[2]), int(y[2]))
+            if x[0] == y[0] and start < end:
+                row = [x[0], str(start), str(end)] + x[3:]
+                print("\\t".join(row + (y if "-wb" in args else [])))
+""" % (
+    sys.executable
+)
+BEDGRAPH = [
+    ("chr1", 0, 105, 0),
+    ("chr1", 105, 115, 2),
+    ("chr1", 115, 155, 1),
+    ("chr1", 155, 1000, 0),
+    ("chr2", 0, 1000, 3),
+]
+
+
+@pytest.fixture
+def bedtools(tmp_path, monkeypatch):
+    bindir = tmp_path / "bin"
+    os.makedirs(bindir)
+    with open(bindir / "bedtools", "w") as f:
+        f.write(BEDTOOLS)
+    os.chmod(bindir / "bedtools", 0o755)
+    monkeypatch.setenv("PATH", str(bindir) + os.pathsep + os.environ["PATH"])
+    exons = str(tmp_path / "exons.bed")
+    with open(exons, "w") as f:
+        for exon in EXONS:
+            f.write("%s\t%i\t%i\t%s\n" % exon)
+    bams = []
+    for name in ("s1", "s2"):
+        bams.append(str(tmp_path / (name + ".bam")))
+        with open(bams[-1], "w") as f:
+            for interval in BEDGRAPH:
+                f.write("%s\t%i\t%i\t%i\n" % interval)
+    return bams, exons
+
+
+def test_main_bedtools(bedtools, tmp_path):
+    bams, exons = bedtools
+    panel = str(tmp_path / "panels" / "panel.bed")
+    os.makedirs(tmp_path / "panels")
+    with open(panel, "w") as f:
+        f.write("chr1\t100\t160\n")
+    missing = str(tmp_path / "missing.bam")
+    failed = coverage.main(bams + [missing], exons, panel, engine="bedtools")
+    assert list(failed) == [missing]
+    for bam in bams:
+        prefix = coverage.report_prefix(bam, panel)
+        assert prefix.endswith("_genomecov_panel_with_genes")
+        with open(prefix + ".cov") as f:
+            assert "warning" not in f.read()
+        genes = pd.read_csv(prefix + "_coverage_per_gene.csv", index_col=[0, 1])
+        # GENA: segments of depth 1 (100-105 is 0), 2, 1, 1 and 0
+        expected = pd.Series([0, 2, 1, 1, 0]).describe().drop("count")
+        assert list(genes.index) == [("GENA", "chr1")]
+        assert np.allclose(genes.loc[("GENA", "chr1")].values, expected.values)
+        exons_report = pd.read_csv(prefix + "_coverage_per_exon.csv", index_col=[0, 1])
+        assert list(exons_report.index) == [("GENA_1", "chr1"), ("GENA_2", "chr1")]
+
+
+@pytest.mark.parametrize("failed,code", [({}, 0), ({"s1.bam": "error"}, 1)])
+def test_coverageStats_exit_status(monkeypatch, failed, code):
+    monkeypatch.setattr(coverage, "main", lambda *args, **kwargs: failed)
+    argv = ["MODApy", "coverageStats", "exons.bed", "s1.bam"]
+    monkeypatch.setattr(cmd_line, "argv", argv)
+    with pytest.raises(SystemExit) as error:
+        cmd_line.Parser()
+    assert error.value.code == code
@@ -0,0 +1,57 @@
+from MODApy.geneburden import GeneBurden, default_burden_path
+
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture
+def calls():
+    return pd.DataFrame(
+        {
+            "CHROM": ["1", "1", "1", "2", "1", "2"],
+            "POS": [100, 100, 200, 50, 100, 50],
+            "REF": ["A", "A", "C", "G", "A", "G"],
+            "ALT": ["T", "T", "G", "A", "T", "A"],
+            "GENE_NAME": ["G1", "G1", "G1", "G2", "G1", "G2"],
+            "IMPACT": ["MODIFIER", "HIGH", "LOW", "HIGH", "HIGH", None],
+            "ZIGOSITY": ["HOM", "HOM", "HET", "HET", "HET", "HOM"],
+            "SAMPLE": ["P1", "P1", "P1", "P1", "P2", "P2"],
+        }
+    )
+
+
+def test_count_calls_keeps_most_severe_impact(calls):
+    counts = GeneBurden.count_calls(calls).set_index(
+        ["GENE_NAME", "SAMPLE", "IMPACT", "ZIGOSITY"]
+    )["N_VARIANTS"]
+    assert counts.to_dict() == {
+        ("G1", "P1", "HIGH", "HOM"): 1,
+        ("G1", "P1", "LOW", "HET"): 1,
+        ("G2", "P1", "HIGH", "HET"): 1,
+        ("G1", "P2", "HIGH", "HET"): 1,
+        ("G2", "P2", "UNKNOWN", "HOM"): 1,
+    }
+
+
+def test_add_samples_write_and_query(calls, tmp_path):
+    full = GeneBurden.from_counts(GeneBurden.count_calls(calls), ["P1", "P2"])
+    incremental = GeneBurden.empty()
+    for sample in ["P1", "P2", "P2"]:
+        incremental = incremental.add_samples(calls[calls["SAMPLE"] == sample])
+    assert incremental.samples == ["P1", "P2"]
+    pd.testing.assert_frame_equal(pd.DataFrame(incremental), pd.DataFrame(full))
+    path = str(tmp_path / "vardb_burden.parquet")
+    full.write(path, row_group_size=1)
+    burden = GeneBurden.read(path, genes=["G2"])
+    assert burden["GENE_NAME"].unique().tolist() == ["G2"]
+    result = burden.query("G2", impacts=["HIGH"])
+    assert result["N_SAMPLES"] == 2
+    assert result["CARRIERS"] == ["P1"]
+    assert result["COUNTS"] == [
+        {"SAMPLE": "P1", "IMPACT": "HIGH", "ZIGOSITY": "HET", "N_VARIANTS": 1}
+    ]
+
+
+def test_default_burden_path():
+    assert default_burden_path("/data/v1.2/db") == "/data/v1.2/db_burden.parquet"
@@ -0,0 +1,65 @@
+import gzip
+import os
+
+from MODApy import patientcatalog
+from MODApy.patientcatalog import PatientCatalog
+
+import pytest
+
+HEADER = (
+    "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t%s\n"
+)
+
+
+@pytest.fixture
+def patients(tmp_path):
+    for folder, name, sample in [
+        ("P1", "P1", "S1"),
+        ("P1", "P1_MODApy", "S1"),
+        ("P2", "P2", "S2"),
+        ("P2/old", "P2", "S2"),
+    ]:
+        os.makedirs(tmp_path / folder, exist_ok=True)
+        (tmp_path / folder / (name + ".final.vcf")).write_text(HEADER % sample)
+    (tmp_path / "P2" / "P2.vcf").write_text(HEADER % "S2")
+    return tmp_path
+
+
+def test_patients_deduplicated(patients):
+    catalog = PatientCatalog(str(patients)).scan()
+    assert len(catalog) == 4
+    assert [(x["name"], x["sample"]) for x in catalog.patients()] == [
+        ("P1_MODApy", "S1"),
+        ("P2", "S2"),
+    ]
+    assert catalog.patients()[1]["path"] == str(patients / "P2" / "P2.final.vcf")
+    assert [x["name"] for x in catalog.missing_from(["S1_MODApy"])] == ["P2"]
+
+
+def test_rescan_reads_only_changed_files(patients, monkeypatch):
+    PatientCatalog(str(patients)).scan()
+    read = []
+    monkeypatch.setattr(
+        patientcatalog,
+        "read_sample_name",
+        lambda path: read.append(path) or "S3",
+    )
+    (patients / "P3.final.vcf").write_text(HEADER % "S3")
+    catalog = PatientCatalog(str(patients)).scan()
+    assert read == [str(patients / "P3.final.vcf")]
+    assert len(catalog.patients()) == 3
+
+
+def test_compressed_patients(patients):
+    with gzip.open(patients / "P3.final.vcf.gz", "wt") as f:
+        f.write(HEADER % "S3")
+    catalog = PatientCatalog(str(patients)).scan()
+    assert len(catalog) == 5
+    assert catalog.patients()[-1]["name"] == "P3"
+    assert catalog.patients()[-1]["sample"] == "S3"
+    assert patientcatalog.patient_suffixes(".final.vcf") == (
+        ".final.vcf.bgz",
+        ".final.vcf.gz",
+        ".final.vcf",
+    )
+    assert patientcatalog.patient_suffixes(".final.parquet") == (".final.parquet",)
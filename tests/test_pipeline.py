@@ -0,0 +1,511 @@
+import json
+import os
+import sys
+
+import pytest
+
+from MODApy import configuration
+from MODApy.pipeline import (
+    EXIT_CANCELLED,
+    EXIT_TIMEOUT,
+    PipeStep,
+    PipeStepError,
+    Pipeline,
+)
+from MODApy.scatter import read_fai, scatter_intervals
+from MODApy.steprunner import RunMonitor
+
+
+# Fake tools: bwa writes the concatenation of its inputs to stdout, copy
+# copies its input to its output file ("-" for stdin/stdout) and call writes a
+# VCF with a variant at the start of each -L interval. slow logs and hangs
+TOOLS = {
+    "slow": '#!/bin/sh\necho started >&2\nsleep 30',
+    "bwa": '#!/bin/sh\nshift\ncat "$@"',
+    "copy": '#!/bin/sh\n[ "$2" = - ] && set -- "$1" /dev/stdin "$3"\n'
+    '[ "$3" = - ] && set -- "$1" "$2" /dev/stdout\ncat "$2" > "$3"',
+    "call": """#!%s
+import sys
+args = sys.argv[2:]
+regions = [args[i + 1] for i, x in enumerate(args) if x == "-L"]
+with open(args[-1], "w") as out:
+    out.write("##fileformat=VCFv4.2\\n")
+    out.write("##contig=<ID=chr1,length=1000>\\n")
+    out.write("##contig=<ID=chr2,length=500>\\n")
+    out.write("##contig=<ID=chr3,length=300>\\n")
+    out.write("#CHROM\\tPOS\\tID\\tREF\\tALT\\tQUAL\\tFILTER\\tINFO\\n")
+    for region in regions:
+        chrom, span = region.split(":")
+        pos = span.split("-")[0]
+        out.write("\\t".join([chrom, pos, ".", "A", "T", ".", "PASS", "."]) + "\\n")
+"""
+    % sys.executable,
+}
+CONTIGS = [("chr1", 1000), ("chr2", 500), ("chr3", 300)]
+
+
+@pytest.fixture
+def fastqs(tmp_path, monkeypatch):
+    bindir = tmp_path / "bin"
+    for tool, script in TOOLS.items():
+        os.makedirs(bindir / tool)
+        with open(bindir / tool / (tool + "_1"), "w") as f:
+            f.write(script + "\n")
+        os.chmod(bindir / tool / (tool + "_1"), 0o755)
+    paths = []
+    for x in ("1", "2"):
+        paths.append(str(tmp_path / ("PAT_%s.fastq" % x)))
+        with open(paths[-1], "w") as f:
+            f.write("@read%s\n" % x)
+    monkeypatch.setattr(configuration, "binPath", str(bindir) + "/")
+    monkeypatch.setattr(configuration, "resultsPath", str(tmp_path) + "/")
+    monkeypatch.setattr(configuration, "testFlag", False)
+    os.makedirs(tmp_path / "ref")
+    with open(tmp_path / "ref" / "ref.fa.fai", "w") as f:
+        for contig, length in CONTIGS:
+            f.write("%s\t%i\t0\t60\t61\n" % (contig, length))
+    monkeypatch.setattr(configuration, "referencesPath", str(tmp_path) + "/")
+    return paths
+
+
+def _step(name, command, inputfile, outputfile, **kwargs):
+    step = dict(
+        name=name,
+        command=command,
+        subcommand=name,
+        version="1",
+        input=inputfile,
+        output=outputfile,
+        args="",
+    )
+    step.update(kwargs)
+    return step
+
+
+def _pipeline(*steps):
+    return Pipeline._buildpipe(
+        {
+            "INFO": {
+                "name": "Test Pipe",
+                "url": "",
+                "description": "",
+                "reference": "ref",
+                "required_files": [],
+            },
+            "STEPS": {str(i): step for i, step in enumerate(steps, 1)},
+        }
+    )
+
+
+def _tmpdir(fastqs):
+    return os.path.join(os.path.dirname(fastqs[0]), "Pipelines/PAT/TestPipe/tmp/")
+
+
+def test_runpipeline_dag(fastqs):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.sam"),
+        _step("sort", "copy", "patientname.sam", "patientname.bam", depends_on=[]),
+        _step("qc", "copy", "patientname.sam", "patientname.qc", depends_on=[]),
+        _step(
+            "call",
+            "copy",
+            "patientname.bam",
+            "patientname.vcf",
+            depends_on=["sort"],
+            threads=2,
+            memory="4G",
+        ),
+    )
+    assert pipe.steps[3].threads == 2
+    assert pipe.steps[3].memory == 4
+    pipe.runpipeline(fastqs[0], fastqs[1], keeptmp=True, cores=2)
+    for ext in ("sam", "bam", "qc", "vcf"):
+        with open(_tmpdir(fastqs) + "PAT." + ext) as f:
+            assert f.read() == "@read1\n@read2\n"
+
+
+def test_runpipeline_step_failure(fastqs):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.sam"),
+        _step("sort", "copy", "patientname.missing", "patientname.bam"),
+        _step("call", "copy", "patientname.bam", "patientname.vcf"),
+    )
+    with pytest.raises(SystemExit) as error:
+        pipe.runpipeline(fastqs[0], fastqs[1], keeptmp=True)
+    assert error.value.code != 0
+    assert not os.path.exists(_tmpdir(fastqs) + "PAT.vcf")
+
+
+def test_scatter_intervals():
+    assert scatter_intervals(CONTIGS) == [
+        ["chr1:1-1000"],
+        ["chr2:1-500"],
+        ["chr3:1-300"],
+    ]
+    assert scatter_intervals(CONTIGS, "chunks", 2) == [
+        ["chr1:1-900"],
+        ["chr1:901-1000", "chr2:1-500", "chr3:1-300"],
+    ]
+    with pytest.raises(ValueError):
+        scatter_intervals(CONTIGS, "genes")
+
+
+def test_read_fai_rereads_changed_index(tmp_path):
+    fai = tmp_path / "ref.fa.fai"
+    fai.write_text("chr1\t1000\t0\t60\t61\n")
+    assert read_fai(str(fai)) == (("chr1", 1000),)
+    fai.write_text("chr1\t1000\t0\t60\t61\nchr2\t500\t0\t60\t61\n")
+    os.utime(fai, ns=(0, 10**9))
+    assert read_fai(str(fai)) == (("chr1", 1000), ("chr2", 500))
+
+
+def test_scatter_intervals_groups_small_contigs():
+    assert scatter_intervals(CONTIGS, "chromosome", 3) == [
+        ["chr1:1-1000"],
+        ["chr2:1-500"],
+        ["chr3:1-300"],
+    ]
+    assert scatter_intervals(CONTIGS, "chromosome", 2) == [
+        ["chr1:1-1000"],
+        ["chr2:1-500", "chr3:1-300"],
+    ]
+    contigs = CONTIGS + [("chrUn%i" % i, 10) for i in range(100)]
+    shards = scatter_intervals(contigs, "chromosome", 4)
+    assert len(shards) <= 4
+    assert shards[0] == ["chr1:1-1000"]
+    assert [x.split(":")[0] for shard in shards for x in shard] == [
+        name for name, _ in contigs
+    ]
+
+
+def test_scatterstep_samtools(fastqs, tmp_path):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.bam", scatter="chromosome")
+    )
+    step = pipe.steps[0]
+    ref = str(tmp_path / "ref" / "ref.fa")
+    runs = pipe._scatterstep(step, fastqs[0], str(tmp_path / "PAT"), ref, "PAT", 2)
+    assert len(runs) == 3
+    assert runs[-1][1][:2] == ["samtools", "merge"]
+    os.makedirs(tmp_path / "bin" / "samtools")
+    (tmp_path / "bin" / "samtools" / "samtools").write_text("")
+    runs = pipe._scatterstep(step, fastqs[0], str(tmp_path / "PAT"), ref, "PAT", 2)
+    assert runs[-1][1][0] == str(tmp_path / "bin" / "samtools" / "samtools")
+    step.scatter = {"by": "chromosome", "version": "1.9"}
+    runs = pipe._scatterstep(step, fastqs[0], str(tmp_path / "PAT"), ref, "PAT", 2)
+    assert runs[-1][1][0] == str(tmp_path / "bin" / "samtools" / "samtools_1_9")
+
+
+@pytest.mark.parametrize(
+    "scatter,positions",
+    [
+        ("chromosome", [("chr1", 1), ("chr2", 1), ("chr3", 1)]),
+        (
+            {"by": "chunks", "count": 2},
+            [("chr1", 1), ("chr1", 901), ("chr2", 1), ("chr3", 1)],
+        ),
+    ],
+)
+def test_runpipeline_scatter_gather(fastqs, scatter, positions):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.bam"),
+        _step("call", "call", "patientname.bam", "patientname.vcf", scatter=scatter),
+        _step("annotate", "copy", "patientname.vcf", "patientname.final.vcf"),
+    )
+    pipe.runpipeline(fastqs[0], fastqs[1], keeptmp=True, cores=2)
+    with open(_tmpdir(fastqs) + "PAT.final.vcf") as f:
+        records = [x.split("\t")[:2] for x in f if not x.startswith("#")]
+    assert [(chrom, int(pos)) for chrom, pos in records] == positions
+
+
+def test_runpipeline_skips_up_to_date_steps(fastqs):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.sam"),
+        _step("sort", "copy", "patientname.sam", "patientname.bam"),
+        _step("call", "copy", "patientname.bam", "patientname.vcf"),
+    )
+    tmpdir = _tmpdir(fastqs)
+
+    def mtimes():
+        return [os.stat(tmpdir + "PAT." + x).st_mtime_ns for x in ("sam", "bam", "vcf")]
+
+    pipe.runpipeline(fastqs[0], fastqs[1], keeptmp=True)
+    assert os.path.exists(tmpdir + "PAT.vcf.fingerprint.json")
+    first = mtimes()
+    pipe.runpipeline(fastqs[0], fastqs[1], keeptmp=True)
+    assert mtimes() == first
+    # a changed intermediate only reruns the steps after it
+    with open(tmpdir + "PAT.bam", "w") as f:
+        f.write("changed\n")
+    pipe.runpipeline(fastqs[0], fastqs[1], keeptmp=True)
+    assert mtimes()[0] == first[0]
+    with open(tmpdir + "PAT.vcf") as f:
+        assert f.read() == "changed\n"
+    pipe.runpipeline(fastqs[0], fastqs[1], keeptmp=True, force=True)
+    assert mtimes()[0] != first[0]
+    with open(tmpdir + "PAT.vcf") as f:
+        assert f.read() == "@read1\n@read2\n"
+
+
+def test_runpipeline_streams_steps(fastqs):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.sam", stream=True),
+        _step("sort", "copy", "patientname.sam", "patientname.bam", stream="true"),
+        _step("call", "copy", "patientname.bam", "patientname.vcf"),
+        _step("stats", "copy", "patientname.vcf", "patientname.txt"),
+    )
+    pipe.runpipeline(fastqs[0], fastqs[1], keeptmp=True)
+    tmpdir = _tmpdir(fastqs)
+    assert not os.path.exists(tmpdir + "PAT.sam")
+    assert not os.path.exists(tmpdir + "PAT.bam")
+    for ext in ("vcf", "txt"):
+        with open(tmpdir + "PAT." + ext) as f:
+            assert f.read() == "@read1\n@read2\n"
+
+
+def test_runpipeline_stream_failure(fastqs):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.sam", stream=True),
+        _step("sort", "copy", "patientname.sam", "patientname.bam"),
+    )
+    with pytest.raises(SystemExit) as error:
+        pipe.runpipeline(fastqs[0], fastqs[1] + ".missing", keeptmp=True)
+    assert error.value.code != 0
+
+
+@pytest.mark.parametrize(
+    "steps",
+    [
+        [_step("sort", "copy", "patientname.missing", "patientname.bam")],
+        [
+            _step("sort", "copy", "patientname.sam", "patientname.bam"),
+            _step("stats", "copy", "patientname.sam", "patientname.txt"),
+        ],
+        [
+            _step("sort", "copy", "patientname.sam", "patientname.bam"),
+            _step(
+                "stats",
+                "copy",
+                "patientname.bam",
+                "patientname.txt",
+                depends_on="align",
+            ),
+        ],
+    ],
+)
+def test_runpipeline_invalid_stream(fastqs, steps):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.sam", stream=True),
+        *steps,
+    )
+    assert pipe.runpipeline(fastqs[0], fastqs[1], keeptmp=True) is None
+    assert not os.path.exists(_tmpdir(fastqs) + "PAT.bam")
+
+
+def test_stepcommand_resources(tmp_path):
+    prefix = str(tmp_path / "PAT")
+    step = PipeStep(
+        "call",
+        "GATK",
+        "HaplotypeCaller",
+        "4.1",
+        "-I patientname.bam",
+        "-O patientname.vcf",
+        "-R reference",
+        threads=4,
+        memory="6G",
+        heap="4G",
+        tmpdir="patientname_javatmp",
+        threads_arg="--native-pair-hmm-threads",
+    )
+    assert step.memory == 6
+    cmd, stdout = Pipeline._stepcommand(
+        step, "-I " + prefix + ".bam", prefix, "ref", ""
+    )
+    assert cmd[:4] == [
+        "java",
+        "-jar",
+        "-Xmx4096M",
+        "-Djava.io.tmpdir=" + prefix + "_javatmp",
+    ]
+    assert os.path.isdir(prefix + "_javatmp")
+    assert cmd[cmd.index("--native-pair-hmm-threads") + 1] == "4"
+    assert stdout is None
+    # without heap, java tools keep the previous default
+    step = PipeStep("sort", "picard", "SortSam", "2", "", "O=out.bam", "")
+    cmd, _ = Pipeline._stepcommand(step, "I=in.bam", prefix, "ref", "")
+    assert cmd[2] == "-Xmx12G"
+
+
+def _report(fastqs):
+    path = os.path.join(
+        os.path.dirname(fastqs[0]), "Pipelines/PAT/TestPipe/PAT_run_report.json"
+    )
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_runpipeline_run_report(fastqs):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.sam", stream=True),
+        _step("sort", "copy", "patientname.sam", "patientname.bam"),
+        _step(
+            "call", "call", "patientname.bam", "patientname.vcf", scatter="chromosome"
+        ),
+    )
+    pipe.runpipeline(fastqs[0], fastqs[1])
+    report = _report(fastqs)
+    assert report["status"] == "completed"
+    assert report["patient"] == "PAT"
+    steps = {x["step"]: x for x in report["steps"]}
+    assert sorted(steps) == [
+        "align",
+        "call",
+        "call.000",
+        "call.001",
+        "call.002",
+        "sort",
+    ]
+    for name in ("align", "sort", "call.000"):
+        assert steps[name]["returncode"] == 0
+        assert steps[name]["wall_seconds"] >= 0
+        assert steps[name]["max_rss_mb"] > 0
+        assert "write_bytes" in steps[name]
+    assert steps["call"]["command"].startswith("gather_vcfs")
+    # the tmp dir is removed, but the report is kept
+    assert not os.path.exists(_tmpdir(fastqs))
+
+
+def test_runpipeline_run_report_failure(fastqs):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.sam"),
+        _step("sort", "copy", "patientname.missing", "patientname.bam"),
+    )
+    with pytest.raises(SystemExit):
+        pipe.runpipeline(fastqs[0], fastqs[1], keeptmp=True)
+    with pytest.raises(SystemExit):
+        pipe.runpipeline(fastqs[0], fastqs[1], keeptmp=True)
+    report = _report(fastqs)
+    assert report["status"] == "failed"
+    assert report["steps"][0] == {"step": "align", "skipped": True}
+    assert report["steps"][1]["step"] == "sort"
+    assert report["steps"][1]["returncode"] != 0
+
+
+def test_runbatch(fastqs, tmp_path):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.sam"),
+        _step("call", "copy", "patientname.sam", "patientname.vcf"),
+    )
+    # bwa can not read a directory, so the BAD sample fails
+    os.makedirs(tmp_path / "bad.fastq")
+    open(tmp_path / "ref" / "ref.fa", "w").close()
+    with open(tmp_path / "samples.tsv", "w") as f:
+        f.write("sample\tFQ_1\tFQ_2\n")
+        f.write("S1\tPAT_1.fastq\tPAT_2.fastq\n")
+        f.write("S2\tPAT_2.fastq\t\n")
+        f.write("BAD\tbad.fastq\t\n")
+    report = pipe.runbatch(str(tmp_path / "samples.tsv"), keeptmp=True, cores=2)
+    assert [(x["sample"], x["status"]) for x in report["samples"]] == [
+        ("S1", "completed"),
+        ("S2", "completed"),
+        ("BAD", "failed"),
+    ]
+    assert report["completed"] == 2
+    assert report["failed"] == 1
+    assert report["samples_per_hour"] > 0
+    tmpdir = str(tmp_path / "Pipelines/%s/TestPipe/tmp/%s.vcf")
+    with open(tmpdir % ("S1", "S1")) as f:
+        assert f.read() == "@read1\n@read2\n"
+    with open(tmpdir % ("S2", "S2")) as f:
+        assert f.read() == "@read2\n"
+    with open(tmp_path / "Pipelines/TestPipe_batch_report.json") as f:
+        assert json.load(f) == report
+    with pytest.raises(FileNotFoundError):
+        pipe.runbatch([{"sample": "X", "FQ_1": "missing.fastq", "FQ_2": ""}])
+
+
+def test_runbatch_sample_errors(fastqs, tmp_path, monkeypatch):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.sam"),
+        _step("call", "copy", "patientname.sam", "patientname.vcf"),
+    )
+    open(tmp_path / "ref" / "ref.fa", "w").close()
+    runpipeline = pipe.runpipeline
+
+    def failing(*args, patientname=None, **kwargs):
+        if patientname == "RAISES":
+            raise OSError("disk full")
+        if patientname == "MESSAGE":
+            return "Error Parsing output file. It should be a string."
+        return runpipeline(*args, patientname=patientname, **kwargs)
+
+    monkeypatch.setattr(pipe, "runpipeline", failing)
+    samples = [
+        {"sample": name, "FQ_1": fastqs[0], "FQ_2": ""}
+        for name in ("RAISES", "S1", "MESSAGE")
+    ]
+    report = pipe.runbatch(samples, keeptmp=True, cores=2)
+    assert [(x["sample"], x["status"]) for x in report["samples"]] == [
+        ("RAISES", "failed"),
+        ("S1", "completed"),
+        ("MESSAGE", "failed"),
+    ]
+    assert report["completed"] == 1
+    assert os.path.exists(tmp_path / "Pipelines/TestPipe_batch_report.json")
+
+
+def test_runpipeline_step_timeout(fastqs):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.sam"),
+        _step("hang", "slow", "patientname.sam", "patientname.bam", timeout="1s"),
+    )
+    snapshots = []
+    monitor = RunMonitor(pipe.name, "PAT", callback=snapshots.append)
+    with pytest.raises(SystemExit) as error:
+        pipe.runpipeline(fastqs[0], fastqs[1], keeptmp=True, monitor=monitor)
+    assert error.value.code == EXIT_TIMEOUT
+    assert pipe.steps[1].timeout == 1
+    assert snapshots[-1]["status"] == "failed"
+    assert snapshots[-1]["steps"] == {"align": "completed", "hang": "timeout"}
+    assert [x["status"] for x in snapshots[-1]["events"]] == [
+        "running",
+        "completed",
+        "running",
+        "timeout",
+    ]
+    assert _report(fastqs)["steps"][1]["wall_seconds"] < 15
+
+
+def test_pipesteperror_exitcode():
+    step = PipeStep("align", "bwa", "mem", "1", "", "", "")
+    assert PipeStepError(step, 2).exitcode == 2
+    assert PipeStepError(step, -9).exitcode == 137
+    assert PipeStepError(step, 0).exitcode == 1
+    assert PipeStepError(step, -9, "timeout").exitcode == EXIT_TIMEOUT
+    assert PipeStepError(step, 1, "cancelled").exitcode == EXIT_CANCELLED
+
+
+def test_runpipeline_cancel(fastqs):
+    pipe = _pipeline(
+        _step("align", "bwa", ["fq1", "fq2"], "patientname.sam"),
+        _step("hang", "slow", "patientname.sam", "patientname.bam"),
+        _step("call", "copy", "patientname.bam", "patientname.vcf"),
+    )
+    lines = []
+    start = []
+
+    def cancel():
+        start.append(None)
+        return len(start) > 2
+
+    monitor = RunMonitor(pipe.name, "PAT", cancel=cancel, interval=0)
+    monitor.line = lambda step, line: lines.append((step, line))
+    with pytest.raises(SystemExit) as error:
+        pipe.runpipeline(fastqs[0], fastqs[1], keeptmp=True, monitor=monitor)
+    assert error.value.code == EXIT_CANCELLED
+    assert monitor.status == "cancelled"
+    assert monitor.steps["hang"] == "cancelled"
+    assert monitor.steps["call"] == "pending"
+    assert ("hang", "started") in lines
+    assert _report(fastqs)["status"] == "cancelled"
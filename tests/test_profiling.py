@@ -0,0 +1,16 @@
+import signal
+import subprocess
+import sys
+
+from MODApy import profiling
+
+
+def test_wait_profiled_returncode():
+    proc = subprocess.Popen([sys.executable, "-c", "import sys; sys.exit(3)"])
+    profiling.wait_profiled(proc)
+    assert proc.returncode == 3
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    proc.send_signal(signal.SIGTERM)
+    usage = profiling.wait_profiled(proc)
+    assert proc.returncode == -signal.SIGTERM
+    assert usage.ru_utime >= 0
@@ -0,0 +1,123 @@
+import threading
+import time
+
+import pytest
+
+from MODApy.pipeline import PipeStep
+from MODApy.scheduler import ResourceManager, build_graph, parse_memory, run_graph
+
+
+def _step(name, inputfile="", outputfile="", args="", **kwargs):
+    return PipeStep(name, "tool", "", "1", inputfile, outputfile, args, **kwargs)
+
+
+def test_parse_memory():
+    assert parse_memory(None) == 0
+    assert parse_memory(4) == 4
+    assert parse_memory("12G") == 12
+    assert parse_memory("512M") == 0.5
+    assert parse_memory("1T") == 1024
+
+
+def test_build_graph_sequential_without_depends_on():
+    steps = [_step("a"), _step("b"), _step("c")]
+    graph = build_graph(steps)
+    assert graph == {"a": set(), "b": {"a"}, "c": {"b"}}
+
+
+def test_build_graph_declared_and_inferred():
+    steps = [
+        _step("align", ["fq1", "fq2"], "patientname.sam", depends_on=[]),
+        _step("sort", "patientname.sam", "patientname.bam", depends_on=[]),
+        _step("qc", "", "patientname.qc", depends_on="align"),
+        _step("call", "", "-O patientname.vcf", "-I patientname.bam", depends_on=[]),
+        _step("stats", "INPUT=patientname.vcf", "patientname.txt"),
+    ]
+    graph = build_graph(steps)
+    assert graph["align"] == set()
+    assert graph["sort"] == {"align"}
+    assert graph["qc"] == {"align"}
+    assert graph["call"] == {"sort"}
+    assert graph["stats"] == {"call"}
+
+
+def test_build_graph_unknown_dependency():
+    with pytest.raises(ValueError):
+        build_graph([_step("a", depends_on=["b"]), _step("b")])
+
+
+def test_run_graph_runs_independent_steps_concurrently():
+    steps = [
+        _step("a", depends_on=[]),
+        _step("b", depends_on=[]),
+        _step("c", depends_on=["a", "b"]),
+    ]
+    barrier = threading.Barrier(2, timeout=5)
+    order = []
+
+    def runner(step):
+        if step.name in ("a", "b"):
+            barrier.wait()
+        order.append(step.name)
+
+    run_graph(steps, build_graph(steps), runner, ResourceManager(2))
+    assert order[-1] == "c"
+
+
+def test_run_graph_respects_budget():
+    steps = [_step(x, depends_on=[], threads=2, memory="8G") for x in "abcd"]
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def runner(step):
+        with lock:
+            running.append(step.name)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(step.name)
+
+    run_graph(steps, build_graph(steps), runner, ResourceManager(8, "16G"))
+    assert max(peak) == 2
+
+
+def test_run_graph_stops_after_failure():
+    steps = [_step("a"), _step("b")]
+    ran = []
+
+    def runner(step):
+        ran.append(step.name)
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        run_graph(steps, build_graph(steps), runner, ResourceManager(2))
+    assert ran == ["a"]
+
+
+def test_run_graph_shares_node_resources():
+    resources = ResourceManager(2)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def runner(step):
+        with lock:
+            running.append(step.name)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(step.name)
+
+    def sample(prefix):
+        steps = [_step(prefix + x, depends_on=[]) for x in "abc"]
+        run_graph(steps, build_graph(steps), runner, resources)
+
+    samples = [threading.Thread(target=sample, args=(x,)) for x in ("s1", "s2")]
+    for thread in samples:
+        thread.start()
+    for thread in samples:
+        thread.join()
+    assert len(peak) == 6
+    assert max(peak) == 2
+    assert resources.used_cores == 0
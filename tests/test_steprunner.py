@@ -0,0 +1,72 @@
+import subprocess
+import sys
+
+from MODApy import steprunner
+
+
+def _popen(code):
+    return subprocess.Popen(
+        [sys.executable, "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+
+
+def test_watch_processes_streams_lines(monkeypatch):
+    monkeypatch.setattr(steprunner, "MAX_LINE", 100)
+    monkeypatch.setattr(steprunner, "TAIL_LINES", 3)
+    code = (
+        "import sys\n"
+        "for i in range(1000):\n"
+        "    print('line %i' % i, file=sys.stderr)\n"
+        "print('x' * 250)\n"
+    )
+    lines = []
+    results, reason = steprunner.watch_processes(
+        [_popen(code)], lambda i, stream, line: lines.append((stream, line))
+    )
+    assert reason is None
+    assert results[0]["tail"] == ["line 997", "line 998", "line 999"]
+    assert results[0]["usage"].ru_maxrss > 0
+    stderr = [line for stream, line in lines if stream == "stderr"]
+    assert stderr == ["line %i" % i for i in range(1000)]
+    # long lines are truncated to MAX_LINE
+    assert [line for stream, line in lines if stream == "stdout"] == ["x" * 100]
+
+
+def test_watch_processes_long_line_across_reads(monkeypatch):
+    monkeypatch.setattr(steprunner, "MAX_LINE", 100)
+    code = (
+        "import sys, time\n"
+        "sys.stdout.write('x' * 150)\n"
+        "sys.stdout.flush()\n"
+        "time.sleep(0.3)\n"
+        "sys.stdout.write('y' * 50)\n"
+        "sys.stdout.flush()\n"
+        "time.sleep(0.3)\n"
+        "sys.stdout.write('\\nnext\\n')\n"
+    )
+    lines = []
+    results, reason = steprunner.watch_processes(
+        [_popen(code)], lambda i, stream, line: lines.append((stream, line))
+    )
+    assert reason is None
+    assert [line for stream, line in lines if stream == "stdout"] == [
+        "x" * 100,
+        "next",
+    ]
+
+
+def test_watch_processes_timeout():
+    proc = _popen("import time\ntime.sleep(30)")
+    results, reason = steprunner.watch_processes([proc], timeout=0.5)
+    assert reason == "timeout"
+    assert proc.returncode < 0
+
+
+def test_parse_duration():
+    assert steprunner.parse_duration(None) is None
+    assert steprunner.parse_duration(90) == 90
+    assert steprunner.parse_duration("90m") == 5400
+    assert steprunner.parse_duration("2h") == 7200
@@ -2,7 +2,7 @@ import logging
 import os
 import unittest
 
-from MODApy.utils import InvalidFileError, checkFile
+from MODApy.utils import VCF_EXTENSIONS, InvalidFileError, checkFile
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +47,21 @@ class TestCheckFile(unittest.TestCase):
         with self.assertRaises(InvalidFileError):
             checkFile(file_path, file_extension)
 
+    def test_compressed_vcf_extensions(self):
+        # Arrange
+        file_path = "test_file.vcf.gz"
+        with open(file_path, "w") as file:
+            file.write("Test content")
+
+        # Act and Assert
+        self.assertTrue(checkFile(file_path, VCF_EXTENSIONS))
+        self.assertTrue(checkFile(file_path, ".gz"))
+        with self.assertRaises(InvalidFileError):
+            checkFile(file_path, ".vcf")
+
+        # Cleanup
+        os.remove(file_path)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,382 @@
+import json
+import os
+import shutil
+
+from MODApy import variantsdb
+from MODApy.cfg import configuration
+from MODApy.sparsevardb import VARIANT_COLS, SparseVarDB
+from MODApy.variantkeyset import VariantKeySet
+from MODApy.variantsdb import VariantsDB
+from MODApy.vcfmgr import ParsedVCF
+
+import numpy as np
+
+import pandas as pd
+
+import pytest
+
+
+@pytest.fixture
+def vardb():
+    db = pd.DataFrame(
+        {
+            "CHROM": ["1", "1", "2", "X"],
+            "POS": [100, 200, 50, 10],
+            "REF": ["A", "C", "G", "T"],
+            "ALT": ["T", "G", "A", "C"],
+            "GENE_NAME": ["G1", "G1", "G2", "G3"],
+            "HGVS.C": ["c.1A>T", "c.2C>G", "c.3G>A", "c.4T>C"],
+            "HGVS.P": ["p.1", "p.2", "p.3", "p.4"],
+            "P1": ["HOM", ".", "HET", np.nan],
+            "P2": ["HET", "HET", ".", "."],
+            "P3": [".", "UNKWN", "HOM", "."],
+        }
+    ).set_index(["CHROM", "POS", "REF", "ALT", "GENE_NAME", "HGVS.C", "HGVS.P"])
+    return db.pipe(VariantsDB)
+
+
+def test_calcfreqs(vardb):
+    db = vardb.calcfreqs()
+    assert isinstance(db, VariantsDB)
+    assert db.columns.tolist() == [
+        "ALLELE_FREQ",
+        "FREQ",
+        "N_ALLELES",
+        "N_CARRIERS",
+        "P1",
+        "P2",
+        "P3",
+    ]
+    assert db.patients == ["P1", "P2", "P3"]
+    assert db["N_CARRIERS"].tolist() == [2, 2, 2, 0]
+    assert db["N_ALLELES"].tolist() == [3, 1, 3, 0]
+    np.testing.assert_allclose(db["FREQ"], [2 / 3, 2 / 3, 2 / 3, 0])
+    np.testing.assert_allclose(db["ALLELE_FREQ"], [3 / 6, 1 / 6, 3 / 6, 0])
+    assert db["P1"].tolist() == ["HOM", ".", "HET", "."]
+
+
+def test_calcfreqs_recalculates_existing_freqs(vardb):
+    db = vardb.calcfreqs()
+    db["P4"] = ["HOM", ".", ".", "HET"]
+    db = db.calcfreqs()
+    np.testing.assert_allclose(db["FREQ"], [3 / 4, 2 / 4, 2 / 4, 1 / 4])
+    np.testing.assert_allclose(db["ALLELE_FREQ"], [5 / 8, 1 / 8, 3 / 8, 1 / 8])
+
+
+def test_sparsedb_roundtrip(vardb, tmp_path):
+    sparse = SparseVarDB.from_variantsdb(vardb, chunksize=3)
+    assert sparse.nnz == 6
+    sparse.to_sparsedb(str(tmp_path / "variantsDB.sparse"))
+    loaded = SparseVarDB.from_sparsedb(str(tmp_path / "variantsDB.sparse"))
+    assert isinstance(loaded.data, np.memmap)
+    expected = vardb.calcfreqs()
+    freqs = loaded.calcfreqs()
+    np.testing.assert_allclose(freqs["FREQ"], expected["FREQ"])
+    np.testing.assert_allclose(freqs["ALLELE_FREQ"], expected["ALLELE_FREQ"])
+    assert loaded.get_carriers([0, 3]) == [["P1", "P2"], []]
+    pd.testing.assert_frame_equal(
+        loaded.to_dense(), pd.DataFrame(expected), check_dtype=False
+    )
+
+
+def test_addPatientToDB_matches_full_recalculation(vardb):
+    db = vardb.calcfreqs()
+    pvcf = ParsedVCF(
+        {
+            "CHROM": ["1", "3", "2"],
+            "POS": [100, 5, 50],
+            "REF": ["A", "C", "G"],
+            "ALT": ["T", "A", "A"],
+            "ZIGOSITY": ["HET", "HOM", "HOM"],
+            "GENE_NAME": ["G1", "G4", "G2"],
+            "HGVS.C": ["c.1A>T", "c.5C>A", "c.3G>A"],
+            "HGVS.P": ["p.1", "p.5", "p.3"],
+        }
+    )
+    pvcf.name = "P4"
+    added = db.addPatientToDB(pvcf)
+    assert isinstance(added, VariantsDB)
+    assert "P4" not in db.columns
+    assert added.patients == ["P1", "P2", "P3", "P4"]
+    assert len(added) == 5
+    assert added["P4"].tolist() == ["HET", ".", "HOM", ".", "HOM"]
+    expected = added.calcfreqs()
+    np.testing.assert_allclose(added["FREQ"], expected["FREQ"])
+    np.testing.assert_allclose(added["ALLELE_FREQ"], expected["ALLELE_FREQ"])
+    assert added["N_ALLELES"].tolist() == expected["N_ALLELES"].tolist()
+
+
+def test_addPatientToDB_updates_every_annotation(vardb, tmp_path, monkeypatch):
+    db = vardb.reset_index()
+    # a second annotation of 1:100 A>T
+    db = pd.concat([db, db.iloc[[0]].assign(**{"HGVS.C": "c.9A>T"})])
+    db = db.set_index(VARIANT_COLS).pipe(VariantsDB).calcfreqs()
+    monkeypatch.setattr(
+        "MODApy.variantsdb.configuration.variantsDBPath",
+        str(tmp_path / "variantsDB.csv"),
+    )
+    db.to_VarDB()
+    db = VariantsDB.from_VarDB()
+    assert db["N_ALLELES"].dtype == "int64"
+    pvcf = ParsedVCF(
+        {
+            "CHROM": ["1", "3", "3"],
+            "POS": [100, 5, 5],
+            "REF": ["A", "C", "C"],
+            "ALT": ["T", "A", "A"],
+            "ZIGOSITY": ["HET", "HOM", "HOM"],
+            "GENE_NAME": ["G1", "G4", "G5"],
+            "HGVS.C": ["c.1A>T", "c.5C>A", "c.5C>A"],
+            "HGVS.P": ["p.1", "p.5", "p.5"],
+        }
+    )
+    pvcf.name = "P4"
+    added = db.addPatientToDB(pvcf)
+    assert len(added) == 7
+    expected = added.calcfreqs()
+    assert added["P4"].tolist() == expected["P4"].tolist()
+    assert added["N_CARRIERS"].tolist() == expected["N_CARRIERS"].tolist()
+    assert added["N_ALLELES"].tolist() == expected["N_ALLELES"].tolist()
+    assert added.xs("1", level="CHROM")["P4"].tolist() == ["HET", "HET", "."]
+    assert added.xs("3", level="CHROM")["P4"].tolist() == ["HOM", "HOM"]
+    np.testing.assert_allclose(added["FREQ"], expected["FREQ"])
+
+
+def test_sparse_db_stays_sparse(vardb, tmp_path, monkeypatch):
+    dbpath = str(tmp_path / "variantsDB.sparse")
+    monkeypatch.setattr(configuration, "variantsDBPath", dbpath)
+    vardb.calcfreqs().to_VarDB()
+    db = VariantsDB.from_VarDB()
+    assert db.columns.tolist() == ["ALLELE_FREQ", "FREQ", "N_ALLELES", "N_CARRIERS"]
+    assert db.patients == ["P1", "P2", "P3"]
+    assert isinstance(db._sparse_calls().data, np.memmap)
+    panel = pd.DataFrame(
+        {"CHROM": ["2", "1"], "POS": [50, 100], "REF": ["G", "A"], "ALT": "A"}
+    )
+    assert db.get_carriers(panel) == [["P1", "P3"], []]
+    pvcf = ParsedVCF(
+        {
+            "CHROM": ["1", "3"],
+            "POS": [200, 5],
+            "REF": ["C", "C"],
+            "ALT": ["G", "A"],
+            "ZIGOSITY": ["HOM", "HET"],
+            "GENE_NAME": ["G1", "G4"],
+            "HGVS.C": ["c.2C>G", "c.5C>A"],
+            "HGVS.P": ["p.2", "p.5"],
+        }
+    )
+    pvcf.name = "P4"
+    added = db.addPatientToDB(pvcf)
+    assert added.columns.tolist() == db.columns.tolist()
+    assert added.patients == ["P1", "P2", "P3", "P4"]
+    # the sparse DB is saved back over the memory mapped one
+    added.to_VarDB()
+    loaded = VariantsDB.from_VarDB()
+    expected = vardb.calcfreqs().addPatientToDB(pvcf)
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(loaded.to_dense()), pd.DataFrame(expected), check_dtype=False
+    )
+    np.testing.assert_allclose(loaded["FREQ"], expected["FREQ"])
+
+
+def test_index_lookup(vardb):
+    db = vardb.calcfreqs()
+    panel = pd.DataFrame(
+        {
+            "CHROM": [2, "X", "1", "1"],
+            "POS": ["50", 10, 300, 100],
+            "REF": ["G", "T", "A", "A"],
+            "ALT": ["A", "C", "T", "T"],
+        },
+        index=[7, 8, 9, 10],
+    )
+    assert db.locate_variants(panel).tolist() == [2, 3, -1, 0]
+    freqs = db.get_freqs(panel)
+    np.testing.assert_allclose(freqs["FREQ"], [2 / 3, 0, np.nan, 2 / 3])
+    np.testing.assert_allclose(freqs["ALLELE_FREQ"], [3 / 6, 0, np.nan, 3 / 6])
+    patsdf = db.annotate_patients_with_variants(panel)
+    assert patsdf["PATS_WITH_VARIANTS"].tolist() == [
+        ["P1", "P3"],
+        [],
+        [],
+        ["P1", "P2"],
+    ]
+
+
+def test_from_csvdb_loads_requested_chroms(vardb, tmp_path):
+    db = vardb.calcfreqs().reset_index()
+    for chrom, shard in db.groupby("CHROM"):
+        shard.to_csv(tmp_path / ("variantsDB%s.csv" % chrom), index=False)
+    # files of other DBs in the directory are not shards
+    db.to_csv(tmp_path / "otherDB1.csv", index=False)
+    dbpath = str(tmp_path / "variantsDB.csv")
+    loaded = VariantsDB.from_csvdb(dbpath, chroms=["1", "X"])
+    assert loaded.index.get_level_values("CHROM").tolist() == ["1", "1", "X"]
+    assert loaded.index.get_level_values("POS").dtype == "int64"
+    assert loaded["FREQ"].dtype == "float64"
+    loaded = VariantsDB.from_csvdb(
+        dbpath,
+        columns=["CHROM", "POS", "REF", "ALT", "GENE_NAME", "HGVS.C", "HGVS.P", "FREQ"],
+    )
+    assert len(loaded) == 4
+    assert loaded.columns.tolist() == ["FREQ"]
+
+
+def test_read_csv_shard_falls_back_to_c_parser(tmp_path):
+    shard = tmp_path / "variantsDB1.csv"
+    shard.write_text("CHROM,POS,REF,ALT,FREQ\n1,100,A,T,0.5\n1,200,C,G,0.25,9\n")
+    with pytest.raises(pd.errors.ParserError):
+        variantsdb._read_csv_shard(str(shard))
+    # a short row, rejected by pyarrow
+    shard.write_text("CHROM,POS,REF,ALT,FREQ\n1,100,A,T\n")
+    assert variantsdb._read_csv_shard(str(shard))["FREQ"].isna().all()
+
+
+def test_featherdb_roundtrip(vardb, tmp_path):
+    db = vardb.calcfreqs()
+    dbpath = str(tmp_path / "variantsDB.feather")
+    db.to_featherdb(dbpath)
+    manifest = VariantsDB.read_manifest(dbpath)
+    assert manifest["patients"] == ["P1", "P2", "P3"]
+    assert {k: v["nvariants"] for k, v in manifest["shards"].items()} == {
+        "1": 2,
+        "2": 1,
+        "X": 1,
+    }
+    loaded = VariantsDB.from_featherdb(dbpath)
+    pd.testing.assert_frame_equal(pd.DataFrame(loaded), pd.DataFrame(db))
+    loaded = VariantsDB.from_featherdb(dbpath, chroms=["2"])
+    assert loaded.index.get_level_values("POS").tolist() == [50]
+    # chromosome 2 is gone from the DB, and so is its shard
+    db[db.index.get_level_values("CHROM") != "2"].to_featherdb(dbpath)
+    assert sorted(x.name for x in tmp_path.glob("*.feather")) == [
+        "variantsDB1.feather",
+        "variantsDBX.feather",
+    ]
+    assert len(VariantsDB.from_featherdb(dbpath)) == 3
+
+
+def test_to_VarDBCSV_keeps_db(vardb, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        "MODApy.variantsdb.configuration.variantsDBPath",
+        str(tmp_path / "variantsDB.csv"),
+    )
+    db = vardb.calcfreqs()
+    db.to_VarDBCSV()
+    assert db.index.names == vardb.index.names
+    assert sorted(x.name for x in tmp_path.iterdir()) == [
+        "variantsDB1.csv",
+        "variantsDB2.csv",
+        "variantsDBX.csv",
+    ]
+
+
+def test_buildDB_resumes_from_checkpoint(tmp_path, monkeypatch):
+    patients = tmp_path / "Patients"
+    for pat in ["pat1", "pat2"]:
+        os.makedirs(patients / pat)
+        shutil.copy(
+            "tests/test_data/test_%s.vcf" % pat,
+            patients / pat / ("%s.final.vcf" % pat),
+        )
+    dbpath = str(tmp_path / "VariantsDB" / "variantsDB.feather")
+    monkeypatch.setattr(configuration, "patientPath", str(patients) + "/")
+    monkeypatch.setattr(configuration, "variantsDBPath", dbpath)
+    db = VariantsDB.buildDB(checkpoint_every=1)
+    checkpoint = json.load(open(dbpath.replace(".feather", "_checkpoint.json")))
+    assert len(checkpoint["ingested"]) == 2
+    # A new patient and a broken vcf: only those are parsed on the next build
+    os.makedirs(patients / "pat3")
+    shutil.copy("tests/test_data/test_pat3.vcf", patients / "pat3" / "pat3.final.vcf")
+    (patients / "pat3" / "broken.final.vcf").write_text("not a vcf")
+    updated = VariantsDB.buildDB()
+    checkpoint = json.load(open(dbpath.replace(".feather", "_checkpoint.json")))
+    assert len(checkpoint["ingested"]) == 3
+    assert list(checkpoint["failed"]) == [str(patients / "pat3" / "broken.final.vcf")]
+    assert updated.patients[:2] == db.patients
+    expected = updated.calcfreqs()
+    np.testing.assert_allclose(updated["FREQ"], expected["FREQ"])
+    np.testing.assert_allclose(updated["ALLELE_FREQ"], expected["ALLELE_FREQ"])
+    loaded = VariantsDB.from_featherdb(dbpath)
+    assert sorted(loaded.columns) == sorted(updated.columns)
+
+
+def test_from_VarDB_hits_loads_only_hit_chroms(vardb, tmp_path, monkeypatch):
+    dbpath = str(tmp_path / "variantsDB.feather")
+    monkeypatch.setattr(configuration, "variantsDBPath", dbpath)
+    vardb.calcfreqs().to_VarDB()
+    keyset = VariantKeySet.load(str(tmp_path / "variantsDB_keys.npy"))
+    assert isinstance(keyset.keys, np.memmap)
+    assert len(keyset) == 4
+    report = pd.DataFrame(
+        {"CHROM": ["2", "1", "3"], "POS": [50, 1, 7], "REF": "G", "ALT": "A"}
+    )
+    assert keyset.contains(report).tolist() == [True, False, False]
+    db = VariantsDB.from_VarDB_hits(report)
+    assert db.index.get_level_values("CHROM").unique().tolist() == ["2"]
+    assert db.get_freqs(report)["FREQ"].notna().tolist() == [True, False, False]
+    novel = VariantsDB.from_VarDB_hits(report.iloc[1:])
+    assert len(novel) == 0
+    assert novel.get_carriers(report.iloc[1:]) == [[], []]
+    # the DB changes without its key set: the key set is not trusted
+    changed = vardb.calcfreqs()
+    changed.index = changed.index.set_levels(["1", "2", "3"], level="CHROM")
+    changed.to_featherdb()
+    db = VariantsDB.from_VarDB_hits(report)
+    assert db.index.get_level_values("CHROM").unique().tolist() == ["1", "2", "3"]
+
+
+def test_buildDB_sparse(tmp_path, monkeypatch):
+    patients = tmp_path / "Patients"
+    for pat in ["pat1", "pat2"]:
+        os.makedirs(patients / pat)
+        shutil.copy(
+            "tests/test_data/test_%s.vcf" % pat,
+            patients / pat / ("%s.final.vcf" % pat),
+        )
+    dbpath = str(tmp_path / "VariantsDB" / "variantsDB.sparse")
+    monkeypatch.setattr(configuration, "patientPath", str(patients) + "/")
+    monkeypatch.setattr(configuration, "variantsDBPath", dbpath)
+    db = VariantsDB.buildDB(checkpoint_every=1)
+    assert db._sparse_calls() is not None
+    assert len(db.patients) == 2
+    dense = db.to_dense()
+    np.testing.assert_allclose(db["FREQ"], dense.calcfreqs()["FREQ"])
+    loaded = VariantsDB.from_VarDB()
+    assert loaded.patients == db.patients
+    assert loaded._sparse_calls().nnz == db._sparse_calls().nnz
+
+
+def test_add_calls_batch_matches_sequential(vardb):
+    def calls(chroms, zigosity):
+        return pd.DataFrame(
+            {
+                "CHROM": chroms,
+                "POS": [100, 5],
+                "REF": ["A", "C"],
+                "ALT": ["T", "A"],
+                "GENE_NAME": ["G1", "G4"],
+                "HGVS.C": ["c.1A>T", "c.5C>A"],
+                "HGVS.P": ["p.1", "p.5"],
+                "ZIGOSITY": zigosity,
+            }
+        )
+
+    batch = [
+        ("P4", calls(["1", "3"], ["HET", "HOM"])),
+        ("P5", calls(["1", "3"], "HET")),
+    ]
+    db = vardb.calcfreqs()
+    sequential = db._add_calls(batch[:1])._add_calls(batch[1:])
+    batched = db._add_calls(batch)
+    pd.testing.assert_frame_equal(pd.DataFrame(batched), pd.DataFrame(sequential))
+    assert batched["P5"].tolist() == ["HET", ".", ".", ".", "HET"]
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(batched), pd.DataFrame(batched.calcfreqs())
+    )
+    sparse = VariantsDB._from_sparse(SparseVarDB.from_variantsdb(db))._add_calls(batch)
+    assert sparse.patients == batched.patients
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(sparse.to_dense()), pd.DataFrame(batched), check_dtype=False
+    )
@@ -0,0 +1,41 @@
+from MODApy.varkey import FALLBACK_FLAG, decode_keys, encode_variants, variant_keys
+
+import numpy as np
+
+import pandas as pd
+
+
+def test_encode_decode_roundtrip():
+    variants = pd.DataFrame(
+        {
+            "CHROM": ["1", "X", "2", "MT", "GL000220.1", "1", "1"],
+            "POS": [100, 5, 248956422, 3, 10, 7, 7],
+            "REF": ["A", "AC", "G", "C", "T", "A" * 12, "N"],
+            "ALT": ["T", "A", "GTTT", "T", "C", "A", "A"],
+        }
+    )
+    fallback = {}
+    keys = encode_variants(variants, fallback)
+    assert keys.dtype == np.uint64
+    packed = (keys & FALLBACK_FLAG) == 0
+    assert packed.tolist() == [True, True, True, True, False, False, False]
+    assert len(fallback) == 3
+    decoded = decode_keys(keys, fallback)
+    decoded["POS"] = decoded["POS"].astype("int64")
+    pd.testing.assert_frame_equal(decoded, variants)
+    assert decode_keys(keys[4:5])["CHROM"].tolist() == [None]
+
+
+def test_keys_are_normalized_and_sorted():
+    variants = pd.DataFrame(
+        {
+            "CHROM": ["chr1", 1, "2", "10"],
+            "POS": ["100", 100, 1, 1],
+            "REF": ["a", "A", "A", "A"],
+            "ALT": ["t", "T", "T", "T"],
+        }
+    )
+    keys = encode_variants(variants)
+    assert keys[0] == keys[1]
+    assert keys[1] < keys[2] < keys[3]
+    np.testing.assert_array_equal(variant_keys(variants.assign(VARKEY=keys)), keys)
@@ -1,7 +1,14 @@
+import gzip
 from pathlib import Path
 
+from MODApy.utils import is_bgzf
+from MODApy.varkey import encode_variants
 from MODApy.vcfmgr import ParsedVCF
 
+import cyvcf2
+
+import numpy as np
+
 TEST_DATA_PATH = Path("tests/test_data")
 
 
@@ -10,6 +17,68 @@ def test_from_vcf(parsed_vcf):
     df = ParsedVCF.from_vcf(str(TEST_DATA_PATH / "test_pat1.vcf"))
     # Check that the dataframe has the correct shape and columns
     assert isinstance(df, ParsedVCF)
+    np.testing.assert_array_equal(df["VARKEY"], encode_variants(df))
+    df = df.drop(columns="VARKEY")
     assert set(df.columns) == set(parsed_vcf.columns)
     assert df.shape == parsed_vcf.shape
     assert df.equals(parsed_vcf)
+
+
+MULTISAMPLE_VCF = """##fileformat=VCFv4.2
+##contig=<ID=chr1,length=249250621>
+##contig=<ID=chrX,length=155270560>
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Total Depth">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths">
+##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">
+##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype quality">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2\tS3
+chr1\t100\trs1\tA\tT\t50\tPASS\tDP=30\tGT:AD:DP:GQ\t0/1:5,5:10:40\t1/1:0,10:10:30\t0/0:10,0:10:99
+chr1\t200\t.\tC\tG,T\t60\tPASS\tDP=30\tGT:AD:DP:GQ\t1/2:0,4,6:10:20\t0/2:5,0,5:10:35\t./.:.:.:.
+chrX\t300\t.\tG\tA\t70\tPASS\tDP=12\tGT:AD:DP:GQ\t1:0,3:3:15\t0/1:4,4:8:.\t0|0:6,0:6:50
+"""
+
+
+def test_from_vcf_compressed(tmp_path):
+    vcf = str(TEST_DATA_PATH / "test_pat1.vcf")
+    bgz = str(tmp_path / "test_pat1.vcf.gz")
+    reader = cyvcf2.Reader(vcf)
+    writer = cyvcf2.Writer(bgz, reader, mode="wz")
+    for variant in reader:
+        writer.write_record(variant)
+    writer.close()
+    gz = str(tmp_path / "test_pat1.vcf.bgz")
+    with open(vcf, "rb") as f, gzip.open(gz, "wb") as out:
+        out.write(f.read())
+    assert is_bgzf(bgz)
+    assert not is_bgzf(gz)
+    expected = ParsedVCF.from_vcf(vcf)
+    assert ParsedVCF.from_vcf(bgz, threads=2).equals(expected)
+    assert ParsedVCF.from_vcf(gz).equals(expected)
+
+
+def test_multisample_calls(tmp_path):
+    vcf = tmp_path / "cohort.vcf"
+    vcf.write_text(MULTISAMPLE_VCF)
+    calls = ParsedVCF.multisample_calls(str(vcf))
+    assert isinstance(calls, ParsedVCF)
+    cols = ["SAMPLE", "POS", "ALT", "ZIGOSITY", "FORMAT_AD"]
+    assert calls[cols].values.tolist() == [
+        ["S1", 100, "T", "HET", "5,5"],
+        ["S1", 200, "G", "HET", "0,4"],
+        ["S1", 200, "T", "HET", "0,6"],
+        ["S1", 300, "A", "HOM", "0,3"],
+        ["S2", 100, "T", "HOM", "0,10"],
+        ["S2", 200, "T", "HET", "5,5"],
+        ["S2", 300, "A", "HET", "4,4"],
+    ]
+    assert calls["FORMAT_DP"].dtype == "Int64"
+    assert calls["FORMAT_GQ"].dtype == "Int64"
+    assert calls["FORMAT_DP"].tolist() == [10, 10, 10, 3, 10, 10, 8]
+    assert calls["FORMAT_GQ"].fillna(-1).tolist() == [40, 20, 20, 15, 30, 35, -1]
+    np.testing.assert_array_equal(calls["VARKEY"], encode_variants(calls))
+    pvcfs = ParsedVCF.from_multisample_vcf(str(vcf), samples=["S2", "S3"])
+    assert list(pvcfs) == ["S2"]
+    assert pvcfs["S2"].name == "S2"
+    assert "SAMPLE" not in pvcfs["S2"].columns
+    assert pvcfs["S2"]["ZIGOSITY"].tolist() == ["HOM", "HET", "HET"]